@@ -356,9 +356,12 @@ process IDBA {
 
 // FILTER_ASSEMBLY
 TO_FILTER = Channel.create()
-IN_FILTER = TO_FILTER.mix(OUT_BCALM2, OUT_GATB, OUT_MINIA, OUT_MEGAHIT, OUT_METASPADES, OUT_UNICYCLER, OUT_SPADES, OUT_SKESA, OUT_PANDASEQ, OUT_VELVETOPTIMIZER, OUT_IDBA)
+TO_FILTER.mix(OUT_BCALM2, OUT_GATB, OUT_MINIA, OUT_MEGAHIT, OUT_METASPADES, OUT_UNICYCLER, OUT_SPADES, OUT_SKESA, OUT_PANDASEQ, OUT_VELVETOPTIMIZER, OUT_IDBA).into{ IN_FILTER; IN_ASSEMBLY_STATS }
 
-IN_minLen = Channel.value(params.minLength)
+// minLength can be a single value or a comma separated list of values. All thresholds are filtered in a single
+// read of the assembly, each into its own 'filtered_<minLength>' directory
+IN_minLen = Channel.value(params.minLength.toString().tokenize(',')*.trim().join(' '))
+IN_analysis_scripts = Channel.value(file("$baseDir/../../scripts/*.py"))
 
 process FILTER_ASSEMBLY {
 
@@ -368,10 +371,131 @@ process FILTER_ASSEMBLY {
     input:
     set sample_id, file(assembly) from IN_FILTER
     val minLen from IN_minLen
+    file scripts from IN_analysis_scripts
 
     output:
-    file('filtered_*')
+    set sample_id, file('filtered_*/*.fasta') into OUT_FILTER_ASSEMBLY
+    file('filtered_*/*.fai')
 
     script:
-    "reformat.sh in=${assembly} out=filtered_${assembly} minlength=${minLen}"
+    "python3 filter_assembly.py ${assembly} -m ${minLen}"
+}
+
+
+// ANALYSIS
+if (!params.reference){ exit 1, "'reference' parameter missing"}
+IN_reference = Channel.value(file(params.reference))
+
+// Basic statistics of the raw (unfiltered) assemblies of each sample
+process ASSEMBLY_STATS {
+
+    tag {sample_id}
+    publishDir "results/stats/${sample_id}/"
+
+    input:
+    set sample_id, file(assemblies) from IN_ASSEMBLY_STATS.groupTuple()
+    file scripts from IN_analysis_scripts
+    val engine from IN_analysis_engine
+
+    output:
+    file('*.csv')
+
+    script:
+    """
+    mkdir assemblies && mv ${assemblies} assemblies/
+    python3 assembly_stats_global.py assemblies > ${sample_id}_assembly_stats_global.csv
+    """
+}
+
+// Reference index, built once per reference and preset. It's stored with the run results under a directory named
+// after the reference checksum, and reused by later runs while the reference is unchanged
+IN_reference_md5 = Channel.value(Checksum.md5(file(params.reference).toString()))
+IN_mapping_preset = Channel.value(params.mappingPreset)
+
+process INDEX_REFERENCE {
+
+    tag {"${reference.baseName} ${preset}"}
+    storeDir "${params.indexCacheDir}/${reference_md5}_${preset}/"
+
+    input:
+    file reference from IN_reference
+    val reference_md5 from IN_reference_md5
+    val preset from IN_mapping_preset
+
+    output:
+    file('*.mmi') into OUT_INDEX_REFERENCE
+
+    script:
+    "minimap2 -x ${preset} -d ${reference.baseName}.mmi ${reference}"
+}
+
+IN_reference_index = OUT_INDEX_REFERENCE.first()
+
+// One mapping task per filtered assembly (and minimum contig length)
+IN_MAP_CONTIGS = OUT_FILTER_ASSEMBLY.transpose().map{ sample_id, assembly -> [sample_id, assembly.parent.name, assembly] }
+
+process MAP_CONTIGS {
+
+    tag {"${sample_id} ${assembly.baseName}"}
+    publishDir "results/paf_files/${min_length}/"
+
+    input:
+    set sample_id, min_length, file(assembly) from IN_MAP_CONTIGS
+    file index from IN_reference_index
+    val preset from IN_mapping_preset
+
+    output:
+    set sample_id, min_length, file(assembly), file('*.paf') into OUT_MAP_CONTIGS
+
+    script:
+    "minimap2 -c -t $task.cpus -r 10000 -g 10000 -x ${preset} --eqx --secondary=no ${index} ${assembly} > ${assembly.baseName}.paf"
+}
+
+if ( !(params.analysisEngine in ['legacy', 'vectorized']) ){
+    exit 1, "'analysisEngine' parameter must be 'legacy' or 'vectorized'. Provided value: '${params.analysisEngine}'"
+}
+IN_analysis_engine = Channel.value(params.analysisEngine)
+
+// Mapping statistics of all the assemblies of each sample (and minimum contig length)
+process ANALYSE {
+
+    tag {"${sample_id} ${min_length}"}
+    publishDir "results/stats/${sample_id}/${min_length}/"
+
+    input:
+    set sample_id, min_length, file(assemblies), file(mappings) from OUT_MAP_CONTIGS.groupTuple(by: [0, 1])
+    file reference from IN_reference
+    file scripts from IN_analysis_scripts
+    val engine from IN_analysis_engine
+
+    output:
+    file('*.csv')
+    file('*.html') optional true
+    file('*.db') into OUT_ANALYSE_STORE
+
+    script:
+    // samples are stored with their minimum contig length, as in watch_analysis.py
+    store_sample = "${sample_id}_${min_length.replace('filtered_', '')}"
+    """
+    mkdir assemblies mappings && mv ${assemblies} assemblies/ && mv ${mappings} mappings/
+    python3 assembly_mapping_stats_global.py assemblies mappings --engine ${engine} > ${sample_id}_mapping_stats_global.csv
+    python3 assembly_mapping_stats_per_ref.py assemblies mappings --reference ${reference} --engine ${engine} \
+    --print-csv --csv ${sample_id}_mapping_stats_per_ref.csv --store ${store_sample}_results.db --sample ${store_sample}
+    """
+}
+
+// Single results store with the metrics of all the samples (and minimum contig lengths)
+process MERGE_RESULTS {
+
+    publishDir "results/stats/"
+
+    input:
+    file stores from OUT_ANALYSE_STORE.collect()
+    file scripts from IN_analysis_scripts
+
+    output:
+    file('results.db')
+
+    script:
+    "python3 results_store.py results.db merge ${stores}"
 }
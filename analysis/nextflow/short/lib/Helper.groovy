@@ -82,4 +82,21 @@ class CollectInitialMetadata {
         def jsonFile = new File(".metadata.json")
         jsonFile.write json
     }
-}
\ No newline at end of file
+}
+
+class Checksum {
+
+    // md5 checksum of a file, read in blocks
+    static String md5(String path) {
+
+        def digest = java.security.MessageDigest.getInstance("MD5")
+        new File(path).withInputStream { stream ->
+            byte[] buffer = new byte[8192]
+            int read
+            while ((read = stream.read(buffer)) > 0) {
+                digest.update(buffer, 0, read)
+            }
+        }
+        return digest.digest().encodeHex().toString()
+    }
+}
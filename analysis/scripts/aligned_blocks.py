@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Aligned block metrics (NA50, NGA50 and LGA50), in the style of QUAST, for each assembler and reference genome.
+
+The alignment blocks of each contig are sorted by their start in the contig and the contig is broken between two
+consecutive blocks at each extensive misassembly:
+  * translocation - the blocks align to different references
+  * inversion - the blocks align to opposite strands of the same reference
+  * relocation - the distance between the blocks in the reference and in the contig differ by more than
+    --min-relocation bp (default: 1000), taking into account that the copies of the triple reference are contiguous
+Consecutive blocks without a misassembly between them are merged into an aligned block, with the length of their
+aligned contig bases. All the steps are vectorized (integer codes and segment reductions over the sorted alignment
+table), with no per-contig python loop.
+
+For each assembler, this script will output to the command line for each reference genome:
+  * Reference - reference name
+  * Aligned Blocks - number of aligned blocks in the reference
+  * Relocations, Inversions, Translocations - number of breakpoints of each type in the contigs aligned to the
+    reference (translocations are counted in the reference of the block after the breakpoint)
+  * NA50 - length of the shortest aligned block at 50% of the total length of the aligned blocks
+  * NGA50 - length of the shortest aligned block at 50% of the reference length (0 if not reached)
+  * LGA50 - number of aligned blocks, ordered by length, that cover 50% of the reference length (0 if not reached)
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --min-relocation (optional) - minimum inconsistency, in bp, for a relocation (default: 1000)
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+
+MIN_RELOCATION = 1000  # QUAST's default extensive misassembly size
+
+MISASSEMBLY_TYPES = ['Relocations', 'Inversions', 'Translocations']
+
+BLOCK_STATS_COLUMNS = ['Reference', 'Aligned Blocks'] + MISASSEMBLY_TYPES + ['NA50', 'NGA50', 'LGA50']
+
+
+def get_breakpoints(paf_df, min_relocation=MIN_RELOCATION):
+    """
+    Sorts the alignments of each contig by query start and classifies the junction with the previous alignment of
+    the same contig.
+    :param paf_df: pandas DataFrame with PAF columns (see utils.read_paf)
+    :param min_relocation: int with the minimum inconsistency, in bp, for a relocation
+    :return: pandas DataFrame with the sorted alignments, a 'Misassembly' column (empty string if none) and a
+    'Block' column with the aligned block id of each alignment
+    """
+    contigs = pd.factorize(paf_df['Contig'])[0]
+    order = np.lexsort((paf_df['Query Start'].values, contigs))
+    df = paf_df.iloc[order].reset_index(drop=True)
+
+    contigs = contigs[order]
+    references = pd.factorize(df['Reference'])[0]
+    forward = (df['Strand'] == '+').values
+    query_start, query_end = df['Query Start'].values, df['Query End'].values
+    target_start, target_end = df['Target Start'].values, df['Target End'].values
+    ref_len = (df['Reference Len'] // 3).values
+
+    # junction between each alignment (from the second) and the previous one
+    same_contig = np.zeros(len(df), dtype=bool)
+    same_contig[1:] = contigs[1:] == contigs[:-1]
+    same_reference = np.zeros(len(df), dtype=bool)
+    same_reference[1:] = references[1:] == references[:-1]
+    same_strand = np.zeros(len(df), dtype=bool)
+    same_strand[1:] = forward[1:] == forward[:-1]
+
+    # distance between consecutive blocks in the reference, in the direction of the contig
+    reference_gap = np.zeros(len(df), dtype=np.int64)
+    reference_gap[1:] = np.where(forward[1:], target_start[1:] - target_end[:-1], target_start[:-1] - target_end[1:])
+    # the copies of the triple reference are contiguous, so distances are taken modulo the reference length
+    reference_gap = (reference_gap + ref_len // 2) % np.maximum(ref_len, 1) - ref_len // 2
+    query_gap = np.zeros(len(df), dtype=np.int64)
+    query_gap[1:] = query_start[1:] - query_end[:-1]
+
+    translocation = same_contig & ~same_reference
+    inversion = same_contig & same_reference & ~same_strand
+    relocation = same_contig & same_reference & same_strand & (np.abs(reference_gap - query_gap) > min_relocation)
+
+    df['Misassembly'] = np.select([relocation, inversion, translocation], MISASSEMBLY_TYPES, '')
+    df['Block'] = np.cumsum(~same_contig | relocation | inversion | translocation) - 1
+    return df
+
+
+def get_aligned_blocks(paf_df, min_relocation=MIN_RELOCATION):
+    """
+    Breaks the contigs at the extensive misassemblies and merges the remaining consecutive alignments.
+    :param paf_df: pandas DataFrame with PAF columns (see utils.read_paf)
+    :param min_relocation: int with the minimum inconsistency, in bp, for a relocation
+    :return: pandas DataFrame with Contig, Reference, Reference Len, Misassembly (at the block start) and Length of
+    each aligned block
+    """
+    df = get_breakpoints(paf_df, min_relocation)
+
+    # the alignments of each block are contiguous in the sorted table
+    first = np.flatnonzero(np.diff(df['Block'].values, prepend=-1))
+    lengths = (df['Query End'] - df['Query Start']).values
+
+    blocks = df.iloc[first][['Contig', 'Reference', 'Reference Len', 'Misassembly']].reset_index(drop=True)
+    blocks['Length'] = np.add.reduceat(lengths, first) if len(first) else lengths
+    return blocks
+
+
+def get_block_stats(paf_df, min_relocation=MIN_RELOCATION):
+    """
+    Computes the aligned block metrics of each reference.
+    :param paf_df: pandas DataFrame with PAF columns (see utils.read_paf)
+    :param min_relocation: int with the minimum inconsistency, in bp, for a relocation
+    :return: pandas DataFrame with BLOCK_STATS_COLUMNS, one row per reference with aligned blocks (raw reference
+    names)
+    """
+    blocks = get_aligned_blocks(paf_df, min_relocation)
+    if blocks.empty:
+        return pd.DataFrame(columns=BLOCK_STATS_COLUMNS)
+
+    # blocks of each reference from the longest to the shortest
+    references, reference_names = pd.factorize(blocks['Reference'], sort=True)
+    lengths = blocks['Length'].values
+    order = np.lexsort((-lengths, references))
+    references, lengths = references[order], lengths[order]
+    genome_length = (blocks['Reference Len'].values // 3)[order]
+
+    # cumulative length and rank of each block within its reference
+    first = np.flatnonzero(np.diff(references, prepend=-1))
+    counts = np.diff(np.append(first, len(references)))
+    cumulative = np.cumsum(lengths)
+    cumulative -= np.repeat(cumulative[first] - lengths[first], counts)
+    rank = np.arange(len(references)) - np.repeat(first, counts) + 1
+    total_length = np.repeat(np.add.reduceat(lengths, first), counts)
+
+    def first_reached(threshold):
+        # index of the first block of each reference reaching the threshold (-1 if not reached)
+        reached = np.flatnonzero(cumulative >= threshold)
+        index = np.full(len(reference_names), -1)
+        found, position = np.unique(references[reached], return_index=True)
+        index[found] = reached[position]
+        return index
+
+    na50 = first_reached(total_length * 0.5)
+    nga50 = first_reached(genome_length * 0.5)
+
+    stats = pd.DataFrame({'Reference': reference_names, 'Aligned Blocks': counts})
+    misassemblies = blocks['Misassembly'].values[order]
+    for misassembly_type in MISASSEMBLY_TYPES:
+        stats[misassembly_type] = np.bincount(references[misassemblies == misassembly_type],
+                                              minlength=len(reference_names))
+    stats['NA50'] = np.where(na50 >= 0, lengths[na50], 0)
+    stats['NGA50'] = np.where(nga50 >= 0, lengths[nga50], 0)
+    stats['LGA50'] = np.where(nga50 >= 0, rank[nga50], 0)
+    return stats[BLOCK_STATS_COLUMNS]
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--min-relocation', type=int, default=MIN_RELOCATION, dest='min_relocation',
+                        help='Minimum inconsistency, in bp, between the reference and contig distances of two '
+                             'consecutive blocks for a relocation.')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    mappings = sorted(glob.glob(args.mappings + '/*.paf'))
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    for paf_file in mappings:
+        assembler = utils.get_assember_name(paf_file)
+
+        with profiling.stage('get_block_stats', assembler) as stage:
+            paf_df = utils.read_paf(paf_file)
+            stats = get_block_stats(paf_df, args.min_relocation)
+            stage['Items'] = len(paf_df)
+
+        stats['Reference'] = stats['Reference'].map(lambda reference: utils.REFERENCE_DIC.get(reference, reference))
+
+        print('\n\n------' + assembler + '------\n')
+        print(stats.to_csv(index=False), end='')
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
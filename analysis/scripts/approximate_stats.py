@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Quick estimates of the mapping stats of very large assemblies (ex: co-assemblies), in a fixed memory budget.
+
+With --approximate, each assembly is streamed once and its contigs are sampled with a reservoir (algorithm R) per
+contig length stratum (<1 kbp, 1-10 kbp, 10-100 kbp, 100 kbp-1 Mbp and >=1 Mbp), so the few long contigs that hold
+most of the basepairs are always represented. The mapping file is then streamed once, only keeping the alignment rows
+of the sampled contigs. Each sampled contig stands for the contigs of its stratum (weight = contigs seen / contigs
+sampled in the stratum), and the 95% confidence interval of each estimate is obtained by bootstrap, resampling the
+contigs within each stratum. Memory depends only on the sample size, not on the size of the inputs.
+Without --approximate, the same metrics are computed from all the contigs (weight of 1), with no confidence intervals.
+This exact mode is not the production path: the identity of a contig is computed over all its alignments, while
+assembly_mapping_stats_per_ref.py computes it per reference, so the identity and Phred scores of chimeric contigs
+(aligned to several references) differ from the published per-reference values.
+
+For each assembler, this script will output to the command line (estimate, CI low, CI high):
+  * Contigs, basepairs - number of contigs and basepairs of the assembly (exact, counted while streaming)
+  * Mapped contigs, Mapped bp - fraction of the contigs and basepairs with alignments
+  * N50 - N50 of the assembly (length-weighted median of the contig lengths)
+  * Identity - mean identity of the mapped contigs (matching bases of all the alignments of a contig, to any
+    reference, over contig length)
+  * Phred Q10, Phred Q50, Phred Q90 - percentiles of the Phred quality score of the mapped contigs
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the metagenomic assembly files (ending in *.fasta)
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --approximate (optional) - estimate the stats from a sample of the contigs
+  * --sample-size (optional) - contigs sampled per length stratum (default: 10000)
+  * --bootstrap (optional) - number of bootstrap replicates for the confidence intervals (default: 200)
+  * --seed (optional) - random seed, for reproducible estimates
+  * -t (optional) - number of worker processes (default: number of CPUs)
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import sys
+import random
+import bisect
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+import assembly_mapping_stats_per_ref
+
+SAMPLE_SIZE = 10000
+BOOTSTRAP_REPLICATES = 200
+CONFIDENCE = 0.95
+
+# upper bounds of the contig length strata (the last stratum has no upper bound)
+LENGTH_STRATA = [1000, 10000, 100000, 1000000]
+
+PHRED_PERCENTILES = [10, 50, 90]
+APPROXIMATE_STATS_COLUMNS = ['Metric', 'Estimate', 'CI Low', 'CI High']
+
+
+def sample_contigs(fasta_file, sample_size=SAMPLE_SIZE, seed=None):
+    """
+    Streams an assembly and keeps a uniform sample of the contigs of each length stratum (reservoir sampling).
+    :param fasta_file: path to the assembly file
+    :param sample_size: number of contigs sampled per stratum (None to keep all the contigs)
+    :param seed: optional random seed
+    :return: dict with strata indexes as keys and dicts with the number of contigs and basepairs seen and the sampled
+    (contig, length) tuples as values
+    """
+    rng = random.Random(seed)
+    strata = {}
+
+    for header, seq in utils.fasta_iter(fasta_file):
+        stratum = strata.setdefault(bisect.bisect_right(LENGTH_STRATA, len(seq)), {'Seen': 0, 'Bases': 0, 'Sample': []})
+        stratum['Seen'] += 1
+        stratum['Bases'] += len(seq)
+        if sample_size is None or len(stratum['Sample']) < sample_size:
+            stratum['Sample'].append((header, len(seq)))
+        else:
+            i = rng.randrange(stratum['Seen'])
+            if i < sample_size:
+                stratum['Sample'][i] = (header, len(seq))
+
+    return strata
+
+
+def get_matching_bases(paf_file, contigs):
+    """
+    Streams a paf file and sums the matching bases of the alignments of the given contigs, over all the references
+    (unlike assembly_mapping_stats_per_ref.get_alignment_stats, which sums them per reference).
+    :param paf_file: path to the paf file
+    :param contigs: set of contig names (None for all the contigs)
+    :return: dict with contig names as keys and matching bases as values (only contigs with alignments)
+    """
+    matches = {}
+    with open(paf_file) as paf:
+        for line in paf:
+            parts = line.split('\t', 10)
+            if contigs is None or parts[0] in contigs:
+                matches[parts[0]] = matches.get(parts[0], 0) + int(parts[9])
+    return matches
+
+
+def get_contig_sample(fasta_file, paf_file, sample_size=SAMPLE_SIZE, seed=None):
+    """
+    Gets a stratified sample of the contigs of an assembly, with their mapping status and identity.
+    :param fasta_file: path to the assembly file
+    :param paf_file: path to the paf file
+    :param sample_size: number of contigs sampled per stratum (None to keep all the contigs)
+    :param seed: optional random seed
+    :return:
+        - pandas DataFrame with Contig, Contig Len, Stratum, Weight, Mapped (Bool), Identity and Phred (NaN if unmapped)
+        columns, one row per sampled contig
+        - int with the number of basepairs of the assembly
+    """
+    strata = sample_contigs(fasta_file, sample_size, seed)
+
+    rows = []
+    for stratum_index, stratum in sorted(strata.items()):
+        weight = stratum['Seen'] / len(stratum['Sample'])
+        rows.extend((contig, length, stratum_index, weight) for contig, length in stratum['Sample'])
+    df = pd.DataFrame(rows, columns=['Contig', 'Contig Len', 'Stratum', 'Weight'])
+
+    matches = get_matching_bases(paf_file, None if sample_size is None else set(df['Contig']))
+    base_matches = df['Contig'].map(matches)
+    df['Mapped'] = base_matches.notna()
+    df['Identity'] = base_matches / df['Contig Len']
+    df['Phred'] = [assembly_mapping_stats_per_ref.get_phred_quality_score(identity) if mapped else np.nan
+                   for identity, mapped in zip(df['Identity'], df['Mapped'])]
+    return df, sum(stratum['Bases'] for stratum in strata.values())
+
+
+def get_weighted_percentile(values, weights, percentile):
+    """
+    :param values: numpy array of values
+    :param weights: numpy array with the weight of each value
+    :param percentile: float between 0 and 100
+    :return: smallest value with at least percentile % of the total weight at or below it (NaN if no values)
+    """
+    if not len(values):
+        return np.nan
+    order = np.argsort(values, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    return values[order][min(np.searchsorted(cumulative, cumulative[-1] * percentile / 100), len(values) - 1)]
+
+
+def get_weighted_n50(lengths, weights):
+    """
+    N50 as the length-weighted median of the contig lengths. With weights of 1, the same as utils.get_N50.
+    :param lengths: numpy array of contig lengths
+    :param weights: numpy array with the weight (number of contigs represented) of each contig
+    :return: N50
+    """
+    if not len(lengths):
+        return 0
+    order = np.argsort(-lengths, kind='stable')
+    cumulative = np.cumsum((weights * lengths)[order])
+    return lengths[order][min(np.searchsorted(cumulative, cumulative[-1] * 0.5), len(lengths) - 1)]
+
+
+def get_estimates(lengths, weights, mapped, identity, phred):
+    """
+    Estimates the stats of an assembly from a weighted sample of its contigs.
+    :param lengths: numpy array of contig lengths
+    :param weights: numpy array with the weight of each contig
+    :param mapped: numpy boolean array with the mapping status of each contig
+    :param identity: numpy array with the identity of each contig (ignored if unmapped)
+    :param phred: numpy array with the Phred quality score of each contig (ignored if unmapped)
+    :return: list with the estimate of each metric (see get_metric_names)
+    """
+    bases = weights * lengths
+    mapped_weights = weights[mapped]
+
+    return [weights.sum(), bases.sum(),
+            mapped_weights.sum() / max(weights.sum(), 1e-12),
+            bases[mapped].sum() / max(bases.sum(), 1e-12),
+            get_weighted_n50(lengths, weights),
+            (mapped_weights * identity[mapped]).sum() / mapped_weights.sum() if mapped.any() else np.nan] + \
+        [get_weighted_percentile(phred[mapped], mapped_weights, percentile) for percentile in PHRED_PERCENTILES]
+
+
+def get_metric_names():
+    """
+    :return: list with the names of the metrics of get_estimates
+    """
+    return ['Contigs', 'basepairs', 'Mapped contigs', 'Mapped bp', 'N50', 'Identity'] + \
+        [f'Phred Q{percentile}' for percentile in PHRED_PERCENTILES]
+
+
+def get_bootstrap_intervals(df, replicates=BOOTSTRAP_REPLICATES, confidence=CONFIDENCE, seed=None):
+    """
+    Percentile bootstrap confidence intervals of the estimates, resampling the contigs within each stratum.
+    :param df: pandas DataFrame with the contig sample (see get_contig_sample)
+    :param replicates: number of bootstrap replicates
+    :param confidence: confidence level of the intervals
+    :param seed: optional random seed
+    :return: tuple of numpy arrays with the lower and upper bounds of each metric
+    """
+    rng = np.random.default_rng(seed)
+    lengths, weights = df['Contig Len'].values, df['Weight'].values
+    mapped, identity, phred = df['Mapped'].values, df['Identity'].values, df['Phred'].values
+    strata = [np.flatnonzero(df['Stratum'].values == stratum) for stratum in df['Stratum'].unique()]
+
+    estimates = []
+    for _ in range(replicates):
+        index = np.concatenate([rng.choice(rows, len(rows)) for rows in strata])
+        estimates.append(get_estimates(lengths[index], weights[index], mapped[index], identity[index], phred[index]))
+
+    alpha = (1 - confidence) / 2 * 100
+    return tuple(np.nanpercentile(np.array(estimates, dtype=float), [alpha, 100 - alpha], axis=0))
+
+
+def get_approximate_stats(fasta_file, paf_file, sample_size=SAMPLE_SIZE, replicates=BOOTSTRAP_REPLICATES, seed=None):
+    """
+    Computes the stats of an assembler, from a sample of the contigs (with confidence intervals) or from all of them.
+    :param fasta_file: path to the assembly file
+    :param paf_file: path to the paf file
+    :param sample_size: number of contigs sampled per stratum (None for the exact stats)
+    :param replicates: number of bootstrap replicates
+    :param seed: optional random seed
+    :return: pandas DataFrame with APPROXIMATE_STATS_COLUMNS, one row per metric (no CIs for the exact stats)
+    """
+    df, basepairs = get_contig_sample(fasta_file, paf_file, sample_size, seed)
+    estimates = get_estimates(df['Contig Len'].values, df['Weight'].values, df['Mapped'].values,
+                              df['Identity'].values, df['Phred'].values)
+    # the number of basepairs is counted, not estimated
+    estimates[1] = basepairs
+
+    if sample_size is None:
+        low = high = [np.nan] * len(estimates)
+    else:
+        low, high = get_bootstrap_intervals(df, replicates, seed=seed)
+        # the number of contigs and basepairs are counted, not estimated
+        low[:2] = high[:2] = estimates[:2]
+
+    return pd.DataFrame({'Metric': get_metric_names(), 'Estimate': estimates, 'CI Low': low, 'CI High': high},
+                        columns=APPROXIMATE_STATS_COLUMNS)
+
+
+def _get_approximate_stats(task):
+    return get_approximate_stats(*task)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--approximate', action='store_true', dest='approximate',
+                        help='Estimate the stats from a sample of the contigs.')
+    parser.add_argument('--sample-size', type=int, default=SAMPLE_SIZE, dest='sample_size',
+                        help='Contigs sampled per length stratum.')
+    parser.add_argument('--bootstrap', type=int, default=BOOTSTRAP_REPLICATES, dest='replicates',
+                        help='Number of bootstrap replicates for the confidence intervals.')
+    parser.add_argument('--seed', type=int, dest='seed', help='Random seed.')
+    parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes.')
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.sample_size < 1 or args.replicates < 1:
+        parser.error('the sample size and number of bootstrap replicates must be positive')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    assemblies, mappings = manifest.get_paired_files(args.assemblies, args.mappings)
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    sample_size = args.sample_size if args.approximate else None
+    tasks = [(assembly, mapping, sample_size, args.replicates, args.seed)
+             for assembly, mapping in zip(assemblies, mappings)]
+
+    with profiling.stage('get_approximate_stats', items=len(tasks)):
+        if len(tasks) <= 1 or args.threads == 1:
+            results = [_get_approximate_stats(task) for task in tasks]
+        else:
+            with Pool(args.threads) as pool:
+                results = pool.map(_get_approximate_stats, tasks, chunksize=1)
+
+    for assembly, df in zip(assemblies, results):
+        print('\n\n------' + utils.get_assember_name(assembly) + '------\n')
+        print(df.to_csv(index=False, float_format='%.4f'), end='')
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+All-vs-all agreement between the assemblies of a sample, without references.
+
+Each assembly is sketched with FracMinHash (see sketches.py, with the sketches cached on disk) and the number of
+shared hashes of every pair of assemblies is obtained in a pool of worker processes. The shared hash counts are kept
+in a comparisons table in the sketch cache directory, keyed by the sketch of each assembly (which changes with the
+assembly file and the sketch parameters), so adding an assembly to the directory only costs the comparisons of the
+new assembly with the others.
+
+This script will output to the command line:
+  * Containment matrix - fraction of the k-mers of the assembly in each row found in the assembly in each column
+  * Jaccard matrix - shared k-mers over the k-mers in either assembly
+and a heatmap of both matrices (`assembler_overlap.html`).
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the metagenomic assembly files (ending in *.fasta)
+  * -k (optional) - k-mer size, up to 32 (default: 21)
+  * --scaled (optional) - keep one in every `scaled` k-mers in the sketches (default: 1000)
+  * -t (optional) - number of worker processes (default: number of CPUs)
+  * --cache (optional) - sketch cache directory, also used for the comparisons table (default: .sketch_cache)
+  * --no-plots (optional) - do not produce the heatmap
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+import sketches
+
+COMPARISONS_FILE = 'comparisons.csv'
+
+# sketches of the assemblies in each worker process, set once by the pool initializer
+_worker_sketches = {}
+
+
+def load_comparisons(comparisons_file):
+    """
+    :param comparisons_file: path to the comparisons table
+    :return: dict with (sketch key, sketch key) tuples, in sorted order, as keys and shared hashes as values
+    """
+    if not os.path.isfile(comparisons_file):
+        return {}
+    df = pd.read_csv(comparisons_file)
+    return {(key_a, key_b): int(shared) for key_a, key_b, shared in df.itertuples(index=False)}
+
+
+def save_comparisons(comparisons, comparisons_file):
+    """
+    :param comparisons: dict with (sketch key, sketch key) tuples as keys and shared hashes as values
+    :param comparisons_file: path to the comparisons table
+    """
+    df = pd.DataFrame([(key_a, key_b, shared) for (key_a, key_b), shared in sorted(comparisons.items())],
+                      columns=['Sketch A', 'Sketch B', 'Shared Hashes'])
+    df.to_csv(comparisons_file + '.tmp', index=False)
+    os.replace(comparisons_file + '.tmp', comparisons_file)
+
+
+def _init_worker(assembly_sketches):
+    _worker_sketches.update(assembly_sketches)
+
+
+def _get_shared(pair):
+    key_a, key_b = pair
+    return sketches.get_containment(_worker_sketches[key_a], _worker_sketches[key_b])[0]
+
+
+def get_shared_hashes(assembly_sketches, comparisons=None, threads=None):
+    """
+    Gets the number of shared hashes of every pair of assemblies, only comparing the pairs missing from comparisons.
+    :param assembly_sketches: dict with sketch keys as keys and sorted numpy arrays of unique hashes as values
+    :param comparisons: optional dict with previous comparisons (see load_comparisons)
+    :param threads: number of worker processes (default: number of CPUs)
+    :return: dict with (sketch key, sketch key) tuples, in sorted order, as keys and shared hashes as values
+    """
+    comparisons = dict(comparisons or {})
+    keys = sorted(assembly_sketches)
+    pairs = [(key_a, key_b) for i, key_a in enumerate(keys) for key_b in keys[i + 1:]
+             if (key_a, key_b) not in comparisons]
+
+    if len(pairs) <= 1 or threads == 1:
+        _init_worker(assembly_sketches)
+        shared = [_get_shared(pair) for pair in pairs]
+    else:
+        with Pool(threads, initializer=_init_worker, initargs=(assembly_sketches,)) as pool:
+            shared = pool.map(_get_shared, pairs, chunksize=max(1, len(pairs) // (4 * (threads or os.cpu_count()))))
+
+    comparisons.update(zip(pairs, shared))
+    return comparisons
+
+
+def get_overlap_matrices(assemblers, keys, sizes, comparisons):
+    """
+    :param assemblers: list of assembler names
+    :param keys: list with the sketch key of each assembler
+    :param sizes: list with the number of hashes in the sketch of each assembler
+    :param comparisons: dict with (sketch key, sketch key) tuples as keys and shared hashes as values
+    :return: tuple of pandas DataFrames with the containment (row in column) and Jaccard matrices
+    """
+    shared = np.zeros((len(keys), len(keys)))
+    for i, key_a in enumerate(keys):
+        for j, key_b in enumerate(keys):
+            shared[i, j] = sizes[i] if i == j else comparisons[tuple(sorted((key_a, key_b)))]
+
+    sizes = np.asarray(sizes, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        containment = np.nan_to_num(shared / sizes[:, None])
+        jaccard = np.nan_to_num(shared / (sizes[:, None] + sizes[None, :] - shared))
+
+    return pd.DataFrame(containment, index=assemblers, columns=assemblers), \
+        pd.DataFrame(jaccard, index=assemblers, columns=assemblers)
+
+
+def plot_overlap(containment, jaccard, filename='assembler_overlap.html'):
+    """
+    Heatmaps of the containment and Jaccard matrices.
+    :param containment: pandas DataFrame with the containment matrix (see get_overlap_matrices)
+    :param jaccard: pandas DataFrame with the Jaccard matrix (see get_overlap_matrices)
+    :param filename: path to the html file
+    """
+    from plotly import subplots
+    from plotly.offline import plot
+    import plotly.graph_objects as go
+
+    fig = subplots.make_subplots(rows=1, cols=2, subplot_titles=['Containment (row in column)', 'Jaccard'])
+    for c, matrix in enumerate([containment, jaccard], start=1):
+        fig.add_trace(go.Heatmap(z=matrix.values, x=matrix.columns, y=matrix.index, zmin=0, zmax=1,
+                                 colorscale='Viridis', showscale=c == 2,
+                                 text=matrix.round(3).values, hoverinfo='x+y+text'), 1, c)
+
+    fig.update_layout(title="Pairwise k-mer overlap between assemblies", plot_bgcolor='rgb(255,255,255)')
+    fig.update_yaxes(autorange='reversed')
+    plot(fig, filename=filename)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('-k', type=int, default=sketches.KSIZE, dest='ksize', help='K-mer size (up to 32).')
+    parser.add_argument('--scaled', type=int, default=sketches.SCALED, dest='scaled',
+                        help='Keep one in every `scaled` k-mers in the sketches.')
+    parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes.')
+    parser.add_argument('--cache', type=str, default=sketches.CACHE_DIR, dest='cache_dir',
+                        help='Sketch cache directory, also used for the comparisons table.')
+    parser.add_argument('--no-plots', action='store_false', dest='plots', help='Do not produce the heatmap.')
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    if not 0 < args.ksize <= 32:
+        parser.error('the k-mer size must be between 1 and 32')
+    if args.scaled < 1:
+        parser.error('the scaled factor must be at least 1')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    assemblies = manifest.list_files(args.assemblies, '.fasta')
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    with profiling.stage('sketch_assemblies', items=len(assemblies)):
+        assembly_sketches = sketches.sketch_files(assemblies, args.ksize, args.scaled, False, args.cache_dir,
+                                                  args.threads)
+
+    # the name of the cached sketch identifies the assembly file and the sketch parameters
+    keys = [os.path.basename(sketches.get_cache_file(assembly, args.ksize, args.scaled, False, args.cache_dir))
+            for assembly in assemblies]
+    hashes = {key: next(iter(assembly_sketches[assembly].values()), np.empty(0, dtype=np.uint64))
+              for key, assembly in zip(keys, assemblies)}
+
+    comparisons_file = os.path.join(args.cache_dir, COMPARISONS_FILE)
+    previous = load_comparisons(comparisons_file)
+
+    with profiling.stage('get_shared_hashes') as stage:
+        comparisons = get_shared_hashes(hashes, previous, args.threads)
+        stage['Items'] = len(comparisons) - len(previous)
+    if len(comparisons) > len(previous):
+        save_comparisons(comparisons, comparisons_file)
+
+    containment, jaccard = get_overlap_matrices([utils.get_assember_name(assembly) for assembly in assemblies], keys,
+                                                [len(hashes[key]) for key in keys], comparisons)
+
+    print('\n\n------Containment (row in column)------\n')
+    print(containment.to_csv(float_format='%.4f', index_label='Assembler'), end='')
+    print('\n\n------Jaccard------\n')
+    print(jaccard.to_csv(float_format='%.4f', index_label='Assembler'), end='')
+
+    if args.plots:
+        with profiling.stage('plot'):
+            plot_overlap(containment, jaccard)
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
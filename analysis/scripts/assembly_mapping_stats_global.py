@@ -20,6 +20,12 @@ Expected input
 This script takes the following arguments (in this order):
   * Path to the unfiltered (raw) assembly files (ending in *.fasta)
   * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --manifest (optional) - manifest file (see manifest.py) to reuse and update between runs
+  * --engine (optional) - implementation of the assembly parsing: legacy or vectorized (see validate_engines.py)
+    (default: legacy)
+  * --composition (optional) - save the composition (GC, Ns, homopolymers) and mapping status of each contig in
+    `<assembler>_contig_composition.csv` (see contig_composition.py), computed in the same pass over the assemblies
+  * --profile (optional) - print timing and memory usage of each stage
 
 Authorship
 ----------
@@ -28,13 +34,14 @@ https://github.com/cimendes
 """
 
 import sys
-from plotly.offline import plot
-import glob
-import fnmatch
-import plotly.graph_objects as go
+import argparse
+import pandas as pd
 
 #import commonly used functions from utils.py
 import utils
+import profiling
+import manifest
+import contig_composition
 
 
 def save_unmapped_contigs(df, assembly_files):
@@ -44,50 +51,73 @@ def save_unmapped_contigs(df, assembly_files):
     :param assembly_files: list of assembly fasta files
     :return:
     """
+    assembly_index = utils.index_by_assembler(assembly_files)
     for assembler in sorted(df['Assembler'].unique()):
 
-        fasta = utils.fasta_iter(fnmatch.filter(assembly_files, '*_' + assembler + '.*')[0])
-        unmapped_contigs = list(df['Contig'][(df['Mapped'] == 'Unmapped') & (df['Assembler'] == assembler)])
-        with open('unmapped_'+assembler+'.fasta', 'w') as fh:
-            for header, seq in fasta:
-                if header in unmapped_contigs:
-                    fh.write(">" + header + "\n" + seq + "\n")
+        with profiling.stage('save_unmapped_contigs', assembler):
+            fasta = utils.fasta_iter(assembly_index[assembler])
+            unmapped_contigs = list(df['Contig'][(df['Mapped'] == 'Unmapped') & (df['Assembler'] == assembler)])
+            with open('unmapped_'+assembler+'.fasta', 'w') as fh:
+                for header, seq in fasta:
+                    if header in unmapped_contigs:
+                        fh.write(">" + header + "\n" + seq + "\n")
 
 
-def main():
-    try:
-        assemblies = glob.glob(sys.argv[1] + '/*.fasta')
-        mappings = glob.glob(sys.argv[2] + '/*.paf')
-    except IndexError as e:
-        print(e, "files not found")
-        sys.exit(0)
+def save_contig_composition(df):
+    """
+    For each assembly, saves the composition of each contig with its mapping status in a csv table
+    :param df: dataframe with assembly info and contig composition (see utils.parse_assemblies)
+    """
+    for assembler in sorted(df['Assembler'].unique()):
+        df.loc[df['Assembler'] == assembler, contig_composition.COMPOSITION_COLUMNS + ['Mapped']]\
+            .to_csv(assembler + '_contig_composition.csv', index=False, float_format='%.4f')
 
-    #add sanity check
-    if len(assemblies) != len(mappings):
-        print("Number of input files don't match.")
-        sys.exit(0)
 
-    print(','.join(['Assembler', '% mapped contigs', '% mapped bp']))
+def get_mapping_summary(df):
+    """
+    Counts the mapped contigs and basepairs of each assembler.
+    :param df: dataframe with assembly info (see utils.parse_assemblies)
+    :return: pandas DataFrame with Assembler, Contigs, Mapped contigs, basepairs and Mapped bp
+    """
+    rows = []
+    for assembler in sorted(df['Assembler'].unique()):
 
-    # Dataframe with assembly info
-    df = utils.parse_assemblies(assemblies, mappings)
+        contigs = df['Contig Len'][df['Assembler'] == assembler]
+        mapped_contigs = df['Contig Len'][(df['Mapped'] == 'Mapped') & (df['Assembler'] == assembler)]
 
-    save_unmapped_contigs(df, assemblies)
+        rows.append({'Assembler': assembler, 'Contigs': len(contigs), 'Mapped contigs': len(mapped_contigs),
+                     'basepairs': int(sum(contigs)), 'Mapped bp': int(sum(mapped_contigs))})
 
-    # Create plot - contig distribution (mapped vs unmapped contigs for each assembler)
-    fig = go.Figure()
+    return pd.DataFrame(rows, columns=['Assembler', 'Contigs', 'Mapped contigs', 'basepairs', 'Mapped bp'])
 
-    for assembler in sorted(df['Assembler'].unique()):
 
-        contigs = df['Contig Len'][df['Assembler'] == assembler]
-        mapped_contigs = df['Contig Len'][(df['Mapped'] == 'Mapped') & (df['Assembler'] == assembler)]
+def print_mapping_summary(df_summary):
+    """
+    Prints the mapped contigs and basepairs of each assembler as a csv table.
+    :param df_summary: pandas DataFrame with mapping summary (see get_mapping_summary)
+    """
+    print(','.join(['Assembler', '% mapped contigs', '% mapped bp']))
 
-        print(','.join([assembler, f'{len(mapped_contigs)} ({(len(mapped_contigs)/len(contigs))*100:.2f}%)',
-                        f'{sum(mapped_contigs)} ({(sum(mapped_contigs)/sum(contigs))*100:.2f}%)']))
+    for row in df_summary.to_dict('records'):
+        print(','.join([row['Assembler'],
+                        f'{row["Mapped contigs"]} ({(row["Mapped contigs"]/row["Contigs"])*100:.2f}%)',
+                        f'{row["Mapped bp"]} ({(row["Mapped bp"]/row["basepairs"])*100:.2f}%)']))
 
+
+def plot_contig_distribution(df):
+    """
+    Boxplot with the size distribution of mapped contigs and scatter of the unmapped contigs, per assembler.
+    :param df: dataframe with assembly info (see utils.parse_assemblies)
+    """
+    from plotly.offline import plot
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    for assembler in sorted(df['Assembler'].unique()):
         # mapped contigs as boxplots
         fig.add_trace(go.Box(x=df['Contig Len'][(df['Mapped'] == 'Mapped') & (df['Assembler'] == assembler)],
-                            name=assembler, boxpoints='outliers',
+                             name=assembler, boxpoints='outliers',
                              boxmean=False, fillcolor='#D3D3D3', line=dict(color='#000000')))
         # unmapped contigs as scatter-like plot (boxplot showing only the underlying data)
         fig.add_trace(go.Box(x=df['Contig Len'][(df['Mapped'] == 'Unmapped') & (df['Assembler'] == assembler)],
@@ -100,5 +130,50 @@ def main():
     plot(fig)
 
 
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--manifest', type=str, dest='manifest',
+                        help='Manifest file (see manifest.py) to reuse and update between runs.')
+    parser.add_argument('--composition', action='store_true', dest='composition',
+                        help='Save a csv table with the composition and mapping status of each contig, per assembler.')
+    parser.add_argument('--engine', choices=utils.ENGINES, default='legacy', dest='engine',
+                        help='Implementation of the assembly parsing (legacy or vectorized, see validate_engines.py).')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    # paired and validated assembly and mapping files
+    assemblies, mappings = manifest.get_paired_files(args.assemblies, args.mappings, args.manifest)
+
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    # Dataframe with assembly info
+    df = utils.parse_assemblies(assemblies, mappings, args.engine, args.composition)
+
+    print_mapping_summary(get_mapping_summary(df))
+
+    save_unmapped_contigs(df, assemblies)
+
+    if args.composition:
+        save_contig_composition(df)
+
+    with profiling.stage('plot'):
+        plot_contig_distribution(df)
+
+    profiling.report(args)
+
+
 if __name__ == '__main__':
     main()
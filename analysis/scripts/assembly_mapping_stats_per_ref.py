@@ -9,10 +9,12 @@ For each assembler, this script will output to the command line for each referen
   * lowest identity - % of identity to the reference of the worst mapping contig
   * breadth of coverage - % of the reference genome covered by the contigs
   * aligned contigs - number of aligned contigs to the reference
+  * chimeric contigs - number of aligned contigs with a relevant share of their alignments in other references
   * aligned basepairs - total number of basepairs aligned to te reference
 
 The following custom metrics are implemented:
   * C90 - Number of contigs, ordered by length, that cover 90% of the reference genome
+  * NA50, NGA50, LGA50 - aligned block metrics, with the contigs broken at misassemblies (see aligned_blocks.py)
   * NID - Normalized identity by contig lenght
 
 
@@ -21,6 +23,19 @@ Expected input
 This script takes the following arguments (in this order):
   * Path to the metagenomic assembly files (ending in *.fasta)
   * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --reference (optional) - path to the triple reference genomes
+  * --print-csv (optional) - save csv with breadth of coverage values per reference for each assembler
+  * --csv (optional) - save the mapping stats per reference of all the assemblers in a single csv table
+  * --min-fraction (optional) - minimum fraction of aligned bases in a reference to assign a contig to it
+  * --store (optional) - SQLite results store (see results_store.py) to upsert the metrics per reference into
+  * --sample (optional) - sample name for the results store (default: from the assembly file names)
+  * --no-plots (optional) - do not produce the C90 and Phred score plots
+  * --manifest (optional) - manifest file (see manifest.py) to reuse and update between runs
+  * --engine (optional) - implementation of the breadth of coverage, lowest identity and assembly parsing: legacy or
+    vectorized (see validate_engines.py) (default: legacy)
+
+The metrics can also be computed in-process, without printing, with `get_sample_metrics` (or `get_samples_metrics`
+for several samples), which return the per-contig, per-reference and per-contig identity tables as DataFrames.
 
 The triple bacterial reference files for the zymos mock community are available at
 "../../data/references/Zymos_Genomes_triple_chromosomes.fasta"
@@ -35,23 +50,41 @@ https://raw.githubusercontent.com/rrwick/Long-read-assembler-comparison/master/s
 """
 
 import sys
-from itertools import groupby
-import glob
+import argparse
 import os
 import re
-import fnmatch
 import math
+from collections import namedtuple
+import numpy as np
 import pandas as pd
-from plotly import subplots
-from plotly.offline import plot
-import plotly.graph_objects as go
 
 #import commonly used functions from utils.py
 import utils
+import profiling
+import manifest
+import results_store
+import contig_assignment
+import aligned_blocks
+import coverage_depth
+import reference_tracks
 
 REFERENCE_SEQUENCES = os.path.join(os.path.dirname(__file__),
                                    '..', '..', 'data', 'references', 'Zymos_Genomes_triple_chromosomes.fasta')
 
+# columns of the mapping stats per reference, in output order
+REFERENCE_STATS_COLUMNS = ['Reference', 'Reference Length', 'Contiguity', 'Identity', 'Lowest Identity',
+                           'Breadth of Coverage', 'C90', 'C95', 'Aligned Contigs', 'Chimeric Contigs', 'NA50',
+                           'NGA50', 'LGA50', 'Aligned Bp']
+
+# columns of the identity of each contig aligned to a reference
+CONTIG_STATS_COLUMNS = ['Assembler', 'Reference', 'Contig', 'Contig Length', 'Identity', 'Phred Quality Score']
+
+# metrics of a sample:
+#   - contigs: assembly info with the matching reference of each mapped contig (see add_matching_ref)
+#   - references: mapping stats per assembler and reference (REFERENCE_STATS_COLUMNS)
+#   - contig_identity: identity of each contig aligned to a reference (CONTIG_STATS_COLUMNS)
+SampleMetrics = namedtuple('SampleMetrics', ['contigs', 'references', 'contig_identity'])
+
 # colors for each subplot
 colours = ['#a6cee3', '#1f78b4', '#b2df8a', '#33a02c', '#fb9a99', '#e31a1c',
            '#fdbf6f', '#ff7f00', '#cab2d6', '#6a3d9a', '#ffff99', '#b15928']
@@ -106,13 +139,20 @@ def get_c95(alignment_lengths, ref_len):
     return c95
 
 
-def get_covered_bases(covered_bases_list, ref_len):
+def get_covered_bases(covered_bases_list, ref_len, engine='legacy'):
     """
     Get ration of referee lengths (adjusted for triple reference) covered by mapping contigs
     :param covered_bases_list: list with alignment coordinates
     :param ref_len: expected reference length
+    :param engine: 'legacy' (set of covered bases) or 'vectorized' (merged folded intervals)
     :return: % of reference covered by the alignment
     """
+    if engine == 'vectorized':
+        intervals = np.array(covered_bases_list, dtype=np.int64).reshape(-1, 2)
+        starts, ends = coverage_depth.fold_intervals(intervals[:, 0], intervals[:, 1], int(ref_len))
+        covered_starts, covered_ends = reference_tracks.get_covered_intervals(starts, ends)
+        return (covered_ends - covered_starts).sum() / ref_len
+
     sorted_list = sorted(covered_bases_list, key=lambda x: x[0])
 
     covered_bases = set()
@@ -148,13 +188,27 @@ def get_expanded_cigar(cigar):
     return ''.join(expanded_cigar)
 
 
-def get_lowest_window_identity(cigar, window_size):
+def get_lowest_window_identity(cigar, window_size, engine='legacy'):
     """
 
     :param cigar: string with alignment cigar
     :param window_size: int with window size
+    :param engine: 'legacy' (expanded cigar string) or 'vectorized' (cumulative sum of the matches)
     :return: float with lowest identity value for mapping contigs
     """
+    if engine == 'vectorized':
+        # same operations as get_expanded_cigar
+        operations = re.findall(r'(\d+)([IDX=])', cigar)
+        lengths, operations = zip(*operations) if operations else ((), ())
+        matches = np.repeat(np.array(operations, dtype='U1') == '=', np.array(lengths, dtype=np.int64))
+
+        # same windows as the expanded cigar (the last window is not included)
+        n_windows = len(matches) - window_size
+        if n_windows <= 0:
+            return 0.0
+        cumulative = np.concatenate(([0], np.cumsum(matches)))
+        return (cumulative[window_size:window_size + n_windows] - cumulative[:n_windows]).min() / window_size
+
     lowest_window_id = float('inf')
     expanded_cigar = get_expanded_cigar(cigar)
 
@@ -168,17 +222,19 @@ def get_lowest_window_identity(cigar, window_size):
     return lowest_window_id
 
 
-def get_alignment_stats(paf_filename, ref_name, ref_length, df_phred):
+def get_alignment_stats(paf_filename, ref_name, ref_length, engine='legacy'):
     """
     Function to process the mapping (*.paf) file for a given reference.
     :param paf_filename: tabular file with alignment information for an assembler
     :param ref_name: reference name to filter from the paf_filename
     :param ref_length: expected reference length
+    :param engine: implementation of the breadth of coverage and lowest identity (see utils.ENGINES)
     :return:
         - contiguity: largest % of reference covered by a single contig
         - coverage:  % of the reference genome covered by the contigs (breadth of coverage)
         - lowest_identity: % of identity to the reference of the worst mapping contig
         - nID: Normalized identity by contig lenght
+        - contig_stats: list of dicts with Contig, Contig Length, Identity and Phred Quality Score of each contig
     """
 
     # Tracks the longest single alignment, in terms of the reference bases.
@@ -187,177 +243,265 @@ def get_alignment_stats(paf_filename, ref_name, ref_length, df_phred):
     n_identity = []
 
     longest_alignment = 0
+    longest_alignment_cigar = ''
 
     aligment_dict = {'Reference': utils.REFERENCE_DIC[ref_name], 'Reference_Length': ref_length, 'Longest_Alignment': 0,
                      'Longest_Alignment_Cigar': '', 'Contigs': {}}
 
-    with open(paf_filename) as paf:
-        for line in paf:
-            parts = line.strip().split('\t')
-            if parts[5] == ref_name:
-                # parse values from PAF file
-                contig_name, contig_length = parts[0], int(parts[1])
-                start, end = int(parts[7]), int(parts[8])
-
-                # number of residue matches, alignment block length
-                matching_bases, total_bases = int(parts[9]), int(parts[10])  # TODO
-                cigar = parts[-1]
-
-                if contig_name not in aligment_dict['Contigs'].keys():
-                    aligment_dict['Contigs'][contig_name] = {'Length': contig_length, 'Base_Matches': matching_bases,
-                                                             'Identity': None, 'Phred': None}
-                else:
-                    aligment_dict['Contigs'][contig_name]['Base_Matches'] += matching_bases
-
-                if end - start > longest_alignment:
-                    longest_alignment = end - start
-                    longest_alignment_cigar = cigar
-                longest_alignment = max(longest_alignment, end - start)
-                covered_bases.append([start, end])
-
-    # Calculate identity for all the contigs:
-    for contig in aligment_dict['Contigs'].keys():
-        aligment_dict['Contigs'][contig]['Identity'] = aligment_dict['Contigs'][contig]['Base_Matches'] / \
-                                                       aligment_dict['Contigs'][contig]['Length']
-        n_identity.append(aligment_dict['Contigs'][contig]['Base_Matches'])
-
-        aligment_dict['Contigs'][contig]['Phred'] = get_phred_quality_score(aligment_dict['Contigs'][contig]['Identity'])
-        df_phred = df_phred.append({'Assembler': os.path.basename(paf_filename).split('.')[0].rsplit('_')[-1],
-                                    'Reference': aligment_dict['Reference'],
-                                    'Contig': contig,
-                                    'Contig Length': aligment_dict['Contigs'][contig]['Length'],
-                                    'Phred Quality Score': aligment_dict['Contigs'][contig]['Phred']
-                                    }, ignore_index=True)
+    assembler = utils.get_assember_name(paf_filename)
+
+    with profiling.stage('read_paf', assembler):
+        with open(paf_filename) as paf:
+            for line in paf:
+                parts = line.strip().split('\t')
+                if parts[5] == ref_name:
+                    # parse values from PAF file
+                    contig_name, contig_length = parts[0], int(parts[1])
+                    start, end = int(parts[7]), int(parts[8])
+
+                    # number of residue matches, alignment block length
+                    matching_bases, total_bases = int(parts[9]), int(parts[10])  # TODO
+                    cigar = parts[-1]
+
+                    if contig_name not in aligment_dict['Contigs'].keys():
+                        aligment_dict['Contigs'][contig_name] = {'Length': contig_length,
+                                                                 'Base_Matches': matching_bases,
+                                                                 'Identity': None, 'Phred': None}
+                    else:
+                        aligment_dict['Contigs'][contig_name]['Base_Matches'] += matching_bases
+
+                    if end - start > longest_alignment:
+                        longest_alignment = end - start
+                        longest_alignment_cigar = cigar
+                    longest_alignment = max(longest_alignment, end - start)
+                    covered_bases.append([start, end])
+
+    contig_stats = []
+    with profiling.stage('phred_scores', assembler, len(aligment_dict['Contigs'])):
+        # Calculate identity for all the contigs:
+        for contig in aligment_dict['Contigs'].keys():
+            aligment_dict['Contigs'][contig]['Identity'] = aligment_dict['Contigs'][contig]['Base_Matches'] / \
+                                                           aligment_dict['Contigs'][contig]['Length']
+            n_identity.append(aligment_dict['Contigs'][contig]['Base_Matches'])
+
+            aligment_dict['Contigs'][contig]['Phred'] = \
+                get_phred_quality_score(aligment_dict['Contigs'][contig]['Identity'])
+            contig_stats.append({'Contig': contig,
+                                 'Contig Length': aligment_dict['Contigs'][contig]['Length'],
+                                 'Identity': aligment_dict['Contigs'][contig]['Identity'],
+                                 'Phred Quality Score': aligment_dict['Contigs'][contig]['Phred']})
 
     contiguity = longest_alignment / ref_length
-    lowest_identity = get_lowest_window_identity(longest_alignment_cigar, 1000)
+    with profiling.stage('get_lowest_window_identity', assembler):
+        lowest_identity = get_lowest_window_identity(longest_alignment_cigar, 1000, engine)
 
-    coverage = get_covered_bases(covered_bases, ref_length)
+    with profiling.stage('get_covered_bases', assembler, len(covered_bases)):
+        coverage = get_covered_bases(covered_bases, ref_length, engine)
 
-    identity = sum(n_identity)/len(n_identity)
+    identity = sum(n_identity)/len(n_identity) if n_identity else 0.0
 
-    return contiguity, coverage, lowest_identity, identity, df_phred
+    return contiguity, coverage, lowest_identity, identity, contig_stats
 
 
-def parse_paf_files(df, mappings, print_csv=False):
+def get_reference_stats(df, mappings, reference_file=REFERENCE_SEQUENCES, engine='legacy'):
     """
-    Parses fasta, paf files references and returns info in dataframe.
-    :param df: pandas DataFrame with assembly stats
+    Computes the mapping stats of each assembler for each reference, and the identity of each mapped contig.
+    :param df: pandas DataFrame with assembly stats, with the matching reference of each contig (see add_matching_ref)
     :param mappings: list of paf files
-    :param print_csv: Bool to print csv with breadth of coverage values per reference for each assembler
-    :return: pandas Dataframe with columns Reference, Assembler and C90
+    :param reference_file: path to the triple reference fasta file
+    :param engine: implementation of the breadth of coverage and lowest identity (see utils.ENGINES)
+    :return:
+        - pandas DataFrame with Assembler and REFERENCE_STATS_COLUMNS, one row per assembler and reference
+        - pandas DataFrame with CONTIG_STATS_COLUMNS, one row per contig aligned to each reference
     """
+    # reference names and lengths, adjusted for the triple reference
+    references = [(header, len(seq)/3) for header, seq in utils.fasta_iter(reference_file)]
 
-    # Dataframe for C90 plot
-    df_c90 = pd.DataFrame(columns=['Reference', 'Assembler', 'C90'])
-
-    # Dataframe for Phred Score plot
-    df_phred = pd.DataFrame(columns=['Assembler', 'Reference', 'Contig', 'Contig Length', 'Phred Quality Score'])
+    reference_rows = []
+    contig_rows = []
+    mapping_index = utils.index_by_assembler(mappings)
 
     for assembler in sorted(df['Assembler'].unique()):
 
-        print('\n\n------' + assembler + '------\n')
-
         # filter dataframe for the assembler
         df_assembler = df[df['Assembler'] == assembler]
 
-        # iterator for reference files (sequence length is needed)
-        references = (x[1] for x in groupby(open(REFERENCE_SEQUENCES, "r"), lambda line: line[0] == ">"))
+        paf_file = mapping_index[assembler]
 
-        paf_file = fnmatch.filter(mappings, '*_' + assembler + '.*')[0]
+        paf_df = utils.read_paf(paf_file)
 
-        print(','.join(["Reference", "Reference Length", "Contiguity", "Identity", "Lowest Identity",
-                        "Breadth of Coverage", "C90", "C95", "Aligned Contigs", "NA50", "Aligned Bp"]))
+        # aligned bases in each reference, including the alignments of chimeric contigs to other references
+        aligned_bp = contig_assignment.get_aligned_bases(paf_df).groupby('Reference')['Aligned Bases'].sum()
 
-        if print_csv:
-            fh = open(assembler + "_breadth_of_coverage_contigs.csv", "w")
-            fh.write("Reference, Breadth of Coverage, Contigs\n")
+        # aligned block metrics, with the contigs broken at misassemblies
+        block_stats = aligned_blocks.get_block_stats(paf_df).set_index('Reference')
 
-        for header in references:
-            header_str = header.__next__()[1:].strip().split()[0]
+        for header_str, ref_len in references:
             reference_name = utils.REFERENCE_DIC[header_str]
-            seq = "".join(s.strip() for s in references.__next__())
 
             df_assembler_reference = df_assembler[df_assembler['Mapped'] == header_str]
 
             mapped_contigs = df_assembler_reference['Contig Len'].astype('int').tolist()
+            blocks = block_stats.loc[header_str] if header_str in block_stats.index else None
+
+            contiguity, coverage, lowest_identity, identity, contig_stats = get_alignment_stats(paf_file, header_str,
+                                                                                                ref_len, engine)
+
+            reference_rows.append({'Assembler': assembler, 'Reference': reference_name, 'Reference Length': ref_len,
+                                   'Contiguity': contiguity, 'Identity': identity,
+                                   'Lowest Identity': lowest_identity, 'Breadth of Coverage': coverage,
+                                   'C90': get_c90(mapped_contigs, ref_len), 'C95': get_c95(mapped_contigs, ref_len),
+                                   'Aligned Contigs': len(mapped_contigs),
+                                   'Chimeric Contigs': int(df_assembler_reference['Chimeric'].sum()),
+                                   'NA50': int(blocks['NA50']) if blocks is not None else 0,
+                                   'NGA50': int(blocks['NGA50']) if blocks is not None else 0,
+                                   'LGA50': int(blocks['LGA50']) if blocks is not None else 0,
+                                   'Aligned Bp': int(aligned_bp.get(header_str, 0))})
+
+            for contig in contig_stats:
+                contig_rows.append({'Assembler': assembler, 'Reference': reference_name, **contig})
+
+    return pd.DataFrame(reference_rows, columns=['Assembler'] + REFERENCE_STATS_COLUMNS), \
+        pd.DataFrame(contig_rows, columns=CONTIG_STATS_COLUMNS)
+
+
+def print_reference_stats(df_stats):
+    """
+    Prints the mapping stats per reference as a csv table for each assembler.
+    :param df_stats: pandas DataFrame with mapping stats per reference (see get_reference_stats)
+    """
+    for assembler in sorted(df_stats['Assembler'].unique()):
+
+        print('\n\n------' + assembler + '------\n')
 
-            na50 = utils.get_N50(mapped_contigs)
-            c90 = get_c90(mapped_contigs, len(seq)/3)  # adjust for triple reference
-            df_c90 = df_c90.append({'Reference': reference_name, 'Assembler': assembler, 'C90': c90}, ignore_index=True)
-            c95 = get_c95(mapped_contigs, len(seq)/3)  # adjust for triple reference
+        print(','.join(REFERENCE_STATS_COLUMNS))
 
-            contiguity, coverage, lowest_identity, identity, df_phred = get_alignment_stats(paf_file,
-                                                                                            header_str,
-                                                                                            len(seq)/3,
-                                                                                            df_phred)
+        for row in df_stats[df_stats['Assembler'] == assembler].to_dict('records'):
+            print(','.join([row['Reference'], f'{row["Reference Length"]}', f'{row["Contiguity"]:.2f}',
+                            f'{row["Identity"]:.6f}', f'{row["Lowest Identity"]:.6f}',
+                            f'{row["Breadth of Coverage"]:.2f}', f'{row["C90"]}', f'{row["C95"]}',
+                            f'{row["Aligned Contigs"]}', f'{row["Chimeric Contigs"]}', f'{row["NA50"]}',
+                            f'{row["NGA50"]}', f'{row["LGA50"]}', f'{row["Aligned Bp"]}']))
+
+
+def write_breadth_tables(df_stats):
+    """
+    Saves a `<assembler>_breadth_of_coverage_contigs.csv` table with the breadth of coverage and number of aligned
+    contigs per reference, for each assembler.
+    :param df_stats: pandas DataFrame with mapping stats per reference (see get_reference_stats)
+    """
+    for assembler in sorted(df_stats['Assembler'].unique()):
+        df_assembler = df_stats[df_stats['Assembler'] == assembler]
+        with open(assembler + "_breadth_of_coverage_contigs.csv", "w") as fh:
+            fh.write("Reference, Breadth of Coverage, Contigs\n")
+            for reference, coverage, contigs in df_assembler[['Reference', 'Breadth of Coverage',
+                                                              'Aligned Contigs']].itertuples(index=False):
+                fh.write(','.join([reference, str(coverage), str(contigs)]) + '\n')
 
-            if print_csv:
-                fh.write(','.join([reference_name, str(coverage), str(len(mapped_contigs))]) + '\n')
 
-            print(','.join([reference_name, f'{len(seq)/3}', f'{contiguity:.2f}', f'{identity:.6f}',
-                            f'{lowest_identity:.6f}', f'{coverage:.2f}', f'{c90}', f'{c95}',
-                            f'{len(mapped_contigs)}', f'{na50}', f'{sum(mapped_contigs)}']))
+def write_reference_stats(df_stats, csv_file):
+    """
+    Saves the mapping stats per reference of all the assemblers as a single csv table.
+    :param df_stats: pandas DataFrame with mapping stats per reference (see get_reference_stats)
+    :param csv_file: path to the csv file
+    """
+    df_stats[['Assembler'] + REFERENCE_STATS_COLUMNS].to_csv(csv_file, index=False)
 
-        if print_csv:
-            fh.close()
 
-    return df_c90, df_phred
+def store_reference_stats(store, sample, df_stats):
+    """
+    Upserts the mapping stats per reference into the results store.
+    :param store: sqlite3 connection to the results store (see results_store.py)
+    :param sample: string with sample name
+    :param df_stats: pandas DataFrame with mapping stats per reference (see get_reference_stats)
+    """
+    results_store.upsert_dataframe(store, sample, df_stats, REFERENCE_STATS_COLUMNS[1:])
 
 
-def add_matching_ref(df, mappings):
+def add_matching_ref(df, mappings, min_fraction=None):
     """
     For each contig in the df, adds the correspondent reference if the contig is mapped. Drops the unmapped contigs.
+    Contigs mapping to more than one reference are assigned to the reference with most aligned bases (see
+    contig_assignment.py) and flagged in the 'Chimeric' column.
     :param df: Pandas Dataframe with stats for each contig
     :param mappings: list of paf files
+    :param min_fraction: minimum fraction of aligned bases in a reference to assign a contig to it (default: majority)
     :return: Pandas Dataframe with stats for each contig with reference info instead of 'Mapped' and rows with
-    unmapped contigs removed
+    unmapped (or unassigned) contigs removed
     """
+    assignments = []
+    mapping_index = utils.index_by_assembler(mappings)
     for assembler in sorted(df['Assembler'].unique()):
-        paf_file = fnmatch.filter(mappings, '*_' + assembler + '.*')[0]
-        mapped_contigs = utils.get_mapped_contigs_with_ref(paf_file)  # dictionary with contigs
-        
-        for contig in df['Contig'][(df['Mapped'] == 'Mapped') & (df['Assembler'] == assembler)]:
-            # get index.
-            row_index = df[(df['Contig'] == contig) & (df['Mapped'] == 'Mapped') & (df['Assembler'] == assembler)]\
-                .index.item()
-            df.loc[row_index, 'Mapped'] = mapped_contigs[contig]  # update with reference
-
-    # remove unmapped contigs from dataframe
-    df = df.drop(df[df.Mapped == 'Unmapped'].index)
+        paf_file = mapping_index[assembler]
+        with profiling.stage('add_matching_ref', assembler) as stage:
+            assignment = contig_assignment.assign_contigs(utils.read_paf(paf_file), min_fraction)
+            stage['Items'] = len(assignment)
+        assignment['Assembler'] = assembler
+        assignments.append(assignment[['Assembler', 'Contig', 'Reference', 'Chimeric']])
+
+    df = df.merge(pd.concat(assignments, ignore_index=True), on=['Assembler', 'Contig'], how='inner')
+    df['Mapped'] = df.pop('Reference')  # update with reference
+
+    # remove unassigned contigs from dataframe
+    df = df.drop(df[df.Mapped == contig_assignment.UNASSIGNED].index)
     return df
 
 
-def main():
-    try:
-        assemblies = glob.glob(sys.argv[1] + '/*.fasta')
-        mappings = glob.glob(sys.argv[2] + '/*.paf')
+def get_sample_metrics(assemblies, mappings, reference_file=REFERENCE_SEQUENCES, min_fraction=None, engine='legacy'):
+    """
+    Computes all the metrics of a sample, from its assemblies and the mapping of their contigs to the triple reference.
+    :param assemblies: list of assembly files
+    :param mappings: list of paf files
+    :param reference_file: path to the triple reference fasta file
+    :param min_fraction: minimum fraction of aligned bases in a reference to assign a contig to it (default: majority)
+    :param engine: implementation of the breadth of coverage, lowest identity and assembly parsing (see utils.ENGINES)
+    :return: SampleMetrics with the per-contig assignment, per-reference stats and per-contig identity dataframes
+    """
+    # Dataframe with assembly info
+    df = utils.parse_assemblies(assemblies, mappings, engine)
 
-    except IndexError as e:
-        print(e, "files not found")
-        sys.exit(0)
+    # Add correspondent reference to each dataframe contig
+    df = add_matching_ref(df, mappings, min_fraction)
 
-    try:
-        if sys.argv[3] == "--print-csv":
-            print_csv = True
-    except IndexError as e:
-        print_csv = False
+    df_stats, df_contigs = get_reference_stats(df, mappings, reference_file, engine)
 
-    # Dataframe with assembly info
-    df = utils.parse_assemblies(assemblies, mappings)
+    return SampleMetrics(df, df_stats, df_contigs)
+
+
+def get_samples_metrics(samples, reference_file=REFERENCE_SEQUENCES, min_fraction=None):
+    """
+    Computes the metrics of several samples in-process, concatenated with a leading 'Sample' column.
+    :param samples: dict with sample names as keys and tuples with lists of assembly and paf files as values
+    :param reference_file: path to the triple reference fasta file
+    :param min_fraction: minimum fraction of aligned bases in a reference to assign a contig to it (default: majority)
+    :return: SampleMetrics with the dataframes of all samples
+    """
+    metrics = {field: [] for field in SampleMetrics._fields}
+
+    for sample, (assemblies, mappings) in samples.items():
+        sample_metrics = get_sample_metrics(assemblies, mappings, reference_file, min_fraction)
+        for field in SampleMetrics._fields:
+            metrics[field].append(getattr(sample_metrics, field).assign(Sample=sample))
+
+    return SampleMetrics(*[pd.concat(metrics[field], ignore_index=True)[
+                               ['Sample'] + [col for col in metrics[field][0].columns if col != 'Sample']]
+                           for field in SampleMetrics._fields])
 
-    # Add correspondent reference to each dataframe contig
-    df = add_matching_ref(df, mappings)
 
-    # Get and print mapping stats tables for each assembler
-    to_plot_c90, to_plot_phred = parse_paf_files(df, mappings, print_csv)
+def plot_c90(df_stats, filename='c90.html'):
+    """
+    Scatter plot with the C90 per reference genome for each assembler.
+    :param df_stats: pandas DataFrame with mapping stats per reference (see get_reference_stats)
+    :param filename: path to the output html file
+    """
+    from plotly.offline import plot
+    import plotly.graph_objects as go
 
-    # Create plot - C90 per reference
     fig_c90 = go.Figure()
     i = 0
-    for assembler in sorted(to_plot_c90['Assembler'].unique()):
-        fig_c90.add_trace(go.Scatter(x=to_plot_c90['C90'][to_plot_c90['Assembler'] == assembler],
-                                     y=to_plot_c90['Reference'][to_plot_c90['Assembler'] == assembler],
+    for assembler in sorted(df_stats['Assembler'].unique()):
+        fig_c90.add_trace(go.Scatter(x=df_stats['C90'][df_stats['Assembler'] == assembler],
+                                     y=df_stats['Reference'][df_stats['Assembler'] == assembler],
                                      mode='markers', name=assembler, opacity=0.7,
                                      marker=dict(color=colours[i], size=24, line=dict(width=1, color='black'))))
         i += 1
@@ -365,34 +509,43 @@ def main():
                           xaxis_title="Contigs",
                           xaxis_type="log",
                           plot_bgcolor='rgb(255,255,255)',
-                          xaxis=dict(showline=True, zeroline=False, linewidth=1, linecolor='black', gridcolor='#DCDCDC')
+                          xaxis=dict(showline=True, zeroline=False, linewidth=1, linecolor='black',
+                                     gridcolor='#DCDCDC')
                           )
 
-    plot(fig_c90, filename='c90.html')
+    plot(fig_c90, filename=filename)
 
-    # Create plot - Phred Score per contig, per reference
-    fig_phred = go.Figure()
+
+def plot_phred(df_contigs, filename='phred_scatter.html'):
+    """
+    Scatter plots with the Phred quality score per contig for each assembler, one subplot per reference.
+    :param df_contigs: pandas DataFrame with the identity of each contig (see get_reference_stats)
+    :param filename: path to the output html file
+    """
+    from plotly import subplots
+    from plotly.offline import plot
+    import plotly.graph_objects as go
 
     num_cols = 2
-    num_rows = int(len(to_plot_phred['Reference'].unique()) / num_cols)
+    num_rows = int(len(df_contigs['Reference'].unique()) / num_cols)
 
     # define number and organization of subplots
     phred_subplots = subplots.make_subplots(rows=num_rows, cols=num_cols,
                                             shared_yaxes=True, shared_xaxes=True,
-                                            subplot_titles=to_plot_phred['Reference'].unique(),
+                                            subplot_titles=df_contigs['Reference'].unique(),
                                             horizontal_spacing=0.04,
                                             vertical_spacing=0.08)
     r, c = 1, 1
 
-    for reference in sorted(to_plot_phred['Reference'].unique()):
+    for reference in sorted(df_contigs['Reference'].unique()):
         tracers = []
         legend = True if r == 1 and c == 1 else False
         i = 0
-        for assembler in to_plot_phred['Assembler'].unique():
-            tracer = go.Scatter(y=to_plot_phred['Phred Quality Score'][(to_plot_phred['Reference'] == reference) &
-                                                                       (to_plot_phred['Assembler'] == assembler)],
-                                x=to_plot_phred['Contig Length'][(to_plot_phred['Reference'] == reference) &
-                                                                 (to_plot_phred['Assembler'] == assembler)],
+        for assembler in df_contigs['Assembler'].unique():
+            tracer = go.Scatter(y=df_contigs['Phred Quality Score'][(df_contigs['Reference'] == reference) &
+                                                                    (df_contigs['Assembler'] == assembler)],
+                                x=df_contigs['Contig Length'][(df_contigs['Reference'] == reference) &
+                                                              (df_contigs['Assembler'] == assembler)],
                                 name=assembler,
                                 legendgroup='group{}'.format(i),
                                 showlegend=legend,
@@ -413,7 +566,76 @@ def main():
             c = 1
     # phred_subplots.update_xaxes(type="log") TODO
 
-    plot(phred_subplots, filename='phred_scatter.html', auto_open=True)
+    plot(phred_subplots, filename=filename, auto_open=True)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--print-csv', action='store_true', dest='print_csv',
+                        help='Save csv with breadth of coverage values per reference for each assembler.')
+    parser.add_argument('--csv', type=str, dest='csv_file',
+                        help='Save the mapping stats per reference of all the assemblers in a single csv table.')
+    parser.add_argument('--reference', type=str, default=REFERENCE_SEQUENCES, dest='reference',
+                        help='Path to the triple reference genomes (default: Zymos_Genomes_triple_chromosomes.fasta '
+                             'in the data/references folder).')
+    parser.add_argument('--min-fraction', type=float, dest='min_fraction',
+                        help='Minimum fraction of aligned bases in a reference to assign a contig to it '
+                             '(default: reference with most aligned bases).')
+    parser.add_argument('--store', type=str, dest='store',
+                        help='SQLite results store to upsert the metrics per reference into.')
+    parser.add_argument('--sample', type=str, dest='sample',
+                        help='Sample name for the results store (default: from the assembly file names).')
+    parser.add_argument('--no-plots', action='store_false', dest='plots',
+                        help='Do not produce the C90 and Phred score plots.')
+    parser.add_argument('--manifest', type=str, dest='manifest',
+                        help='Manifest file (see manifest.py) to reuse and update between runs.')
+    parser.add_argument('--engine', choices=utils.ENGINES, default='legacy', dest='engine',
+                        help='Implementation of the breadth of coverage, lowest identity and assembly parsing.')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    # paired and validated assembly and mapping files
+    assemblies, mappings = manifest.get_paired_files(args.assemblies, args.mappings, args.manifest)
+
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    metrics = get_sample_metrics(assemblies, mappings, args.reference, args.min_fraction, args.engine)
+
+    # Output sinks: mapping stats tables, breadth of coverage tables and results store
+    print_reference_stats(metrics.references)
+
+    if args.print_csv:
+        write_breadth_tables(metrics.references)
+
+    if args.csv_file:
+        write_reference_stats(metrics.references, args.csv_file)
+
+    if args.store:
+        store = results_store.connect(args.store)
+        store_reference_stats(store, args.sample or utils.get_sample_name(sorted(assemblies)[0]), metrics.references)
+        store.close()
+
+    if args.plots:
+        with profiling.stage('plot_c90'):
+            plot_c90(metrics.references)
+
+        with profiling.stage('plot_phred'):
+            plot_phred(metrics.contig_identity)
+
+    profiling.report(args)
 
 
 if __name__ == '__main__':
@@ -20,10 +20,13 @@ For each assembly, this script will output to the command line for each referenc
   * n50 in contigs>1000bp - sequence length of the shortest contig at 50% of the total length of contigs with ´
 size >= 1000 bp
 
+The same statistics are returned as a DataFrame by `get_assembly_stats`, to be used without printing.
+
 Expected input
 --------------
 This script takes the following arguments (in this order):
   * Path to the unfiltered (raw) assembly files (ending in *.fasta)
+  * --profile (optional) - print timing and memory usage of each stage
 
 Authorship
 ----------
@@ -33,9 +36,15 @@ https://github.com/cimendes
 
 import sys
 import glob
+import argparse
+import pandas as pd
 
 #import commonly used functions from utils.py
 import utils
+import profiling
+
+ASSEMBLY_STATS_COLUMNS = ['Assembler', 'Contigs', 'basepairs', 'Max contig size', 'n50', 'contigs>1000bp',
+                          'bp in contigs>1000bp', 'n50 in contigs>1000bp']
 
 
 def get_contig_lists(fasta):
@@ -57,33 +66,73 @@ def get_contig_lists(fasta):
     return contigs_len, contigs_len_over_1000
 
 
-def main():
+def get_assembly_stats(assemblies):
     """
-    in a directory with assemblies (ended in "*.fasta"),
-    calculate the assembly statistics (number of contigs, total number of basepairs, max contig size, n50)
-    for all contigs per assembly, including separate stats for the contigs with over 1000bp
+    Computes the basic statistics of each assembly, for all the contigs and for the contigs with over 1000bp.
+    :param assemblies: list of assembly files
+    :return: pandas DataFrame with ASSEMBLY_STATS_COLUMNS, one row per assembly
     """
-    try:
-        assemblies = sorted(glob.glob(sys.argv[1] + '/*.fasta'))
-    except IndexError as e:
-        print(e, "Directory not found.")
-        sys.exit(0)
+    rows = []
+
+    for assembly_file in assemblies:
+
+        filename = utils.get_assember_name(assembly_file)
+        with profiling.stage('get_contig_lists', filename) as stage:
+            contigs, contigs_over_1000bp = get_contig_lists(utils.fasta_iter(assembly_file))
+            stage['Items'] = len(contigs)
+
+        rows.append({'Assembler': filename, 'Contigs': len(contigs), 'basepairs': sum(contigs),
+                     'Max contig size': max(contigs, default=0), 'n50': utils.get_N50(contigs),
+                     'contigs>1000bp': len(contigs_over_1000bp), 'bp in contigs>1000bp': sum(contigs_over_1000bp),
+                     'n50 in contigs>1000bp': utils.get_N50(contigs_over_1000bp)})
 
+    return pd.DataFrame(rows, columns=ASSEMBLY_STATS_COLUMNS)
+
+
+def print_assembly_stats(df):
+    """
+    Prints the assembly statistics as a csv table, with the percentages of contigs and basepairs over 1000bp.
+    :param df: pandas DataFrame with assembly statistics (see get_assembly_stats)
+    """
     print(','.join(['Assembler', 'Contigs', 'basepairs', 'Max contig size', 'n50', 'contigs>1000bp (%)',
                     ' bp in contigs>1000bp (%)', 'n50 in contigs>1000bp']))
 
-    for assembly_file in assemblies:
+    for row in df.to_dict('records'):
+        print(','.join([row['Assembler'], f'{row["Contigs"]}', f'{row["basepairs"]}', f'{row["Max contig size"]}',
+                        f'{row["n50"]}',
+                        f'{row["contigs>1000bp"]} ({(row["contigs>1000bp"]/row["Contigs"])*100:.2f}%)',
+                        f'{row["bp in contigs>1000bp"]} ({(row["bp in contigs>1000bp"]/row["basepairs"])*100:.2f}%)',
+                        f'{row["n50 in contigs>1000bp"]}']))
 
-        filename = utils.get_assember_name(assembly_file)
-        contigs, contigs_over_1000bp = get_contig_lists(utils.fasta_iter(assembly_file))
 
-        n50_contigs = utils.get_N50(contigs)
-        n50_contigs_over_1000bp = utils.get_N50(contigs_over_1000bp)
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the unfiltered (raw) assembly files (ending in *.fasta).')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    in a directory with assemblies (ended in "*.fasta"),
+    calculate the assembly statistics (number of contigs, total number of basepairs, max contig size, n50)
+    for all contigs per assembly, including separate stats for the contigs with over 1000bp
+    """
+    args = parse_arguments()
+    profiling.setup(args)
+
+    assemblies = sorted(glob.glob(args.assemblies + '/*.fasta'))
+    if not assemblies:
+        print("Directory not found.")
+        sys.exit(0)
+
+    print_assembly_stats(get_assembly_stats(assemblies))
 
-        print(','.join([filename, f'{len(contigs)}', f'{sum(contigs)}', f'{n50_contigs}', f'{max(contigs)}',
-                        f'{len(contigs_over_1000bp)} ({(len(contigs_over_1000bp)/len(contigs))*100:.2f}%)',
-                        f'{sum(contigs_over_1000bp)} ({(sum(contigs_over_1000bp)/sum(contigs))*100:.2f}%)',
-                        f'{n50_contigs_over_1000bp}']))
+    profiling.report(args)
 
 
 if __name__ == '__main__':
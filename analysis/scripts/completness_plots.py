@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 
-This script takes csv tables by species and plots them as series of scatter plots
+This script takes csv tables by species (or the results store) and plots them as series of scatter plots,
+with one trace per assembler in each species subplot
 
 Edited by the King of Plots through dark arts and the use of some kind of putrid concoctions.
 """
@@ -12,93 +13,127 @@ import argparse
 
 import numpy as np
 import pandas as pd
-from plotly import subplots
-from scipy import interpolate
-import plotly.graph_objs as go
-from plotly.offline import plot
-import plotly.figure_factory as ff
 
+import results_store
 
-def main(csv_tables):
 
-    # call Cthulhu and beg him to make this work
-    species_data = {}
+COLUMNS = ['Sample', 'Reference', 'Assembler', 'Breadth of Coverage', 'Contigs']  # columns for dataframe
+
+# number of contigs at each x axis tick
+INTERPOLATION_XVALUES = [0, 40, 80, 160, 320, 640, 1280, 2560]
+
+# colors for each assembler
+COLOURS = ['#a6cee3', '#1f78b4', '#b2df8a', '#33a02c', '#fb9a99', '#e31a1c',
+           '#fdbf6f', '#ff7f00', '#cab2d6', '#6a3d9a', '#ffff99', '#b15928']
+
+
+def read_csv_tables(csv_tables):
+    """
+    Reads the `<assembler>_breadth_of_coverage_contigs.csv` tables into a single long-format dataframe
+    :param csv_tables: list of csv files
+    :return: pandas dataframe with columns Sample, Reference, Assembler, Breadth of Coverage and Contigs
+    """
+    tables = []
     for file in csv_tables:
         assembler_name = os.path.basename(file).split('_')[0]
         print('Processing {0} data...'.format(assembler_name))
 
         # import table with data
-        data = pd.read_csv(file)
-        species = list(data['Reference'])
-        coverage = list(data[' Breadth of Coverage'])
-        contigs = list(data[' Contigs'])
-
-        for i, s in enumerate(species):
-            species_data.setdefault(s, {})[assembler_name] = (coverage[i], contigs[i])
-
-    interpolation_xvalues = [0, 40, 80, 160, 320, 640, 1280, 2560]
-    interpolation_function = interpolate.interp1d(interpolation_xvalues, np.arange(len(interpolation_xvalues)))
-
-    # colors for each assembler
-    colors = ['#a6cee3', '#1f78b4', '#b2df8a', '#33a02c', '#fb9a99', '#e31a1c',
-              '#fdbf6f', '#ff7f00', '#cab2d6', '#6a3d9a', '#ffff99', '#b15928']
-    # create a tracer for each assembler data point
-    # simpler to manage colors and legends
-    tracers = {}
-    i = 0
-    j = 0
-    group = 1
-    for k, v in species_data.items():
-        for a, d in v.items():
-            legend = True if j == 0 else False
-            text = str(d[1])+'<br>'+a
-            tracer = go.Scatter(x=list(interpolation_function([d[1]])),
-                                y=[d[0]],
-                                name=a,
-                                showlegend=legend,
-                                legendgroup='group{0}'.format(group),  # group legends
-                                opacity=1,
-                                mode='markers',
-                                marker=dict(color=colors[i],
-                                            size=7,
-                                            line=dict(width=1, color='black')),
-                                text=text,
-                                hoverinfo='y+text'
-                                )
-            i += 1
-            group += 1
-            tracers.setdefault(k, []).append(tracer)
-
-        i = 0
-        j += 1
-        group = 1
+        data = pd.read_csv(file, skipinitialspace=True)
+        data['Assembler'] = assembler_name
+        data['Sample'] = ''
+        tables.append(data)
+
+    return pd.concat(tables, ignore_index=True).reindex(columns=COLUMNS)
+
+
+def read_store(db_file, samples=None):
+    """
+    Reads breadth of coverage and number of aligned contigs from the results store with a single query
+    :param db_file: path to the SQLite results store
+    :param samples: optional list of samples to plot
+    :return: pandas dataframe with columns Sample, Reference, Assembler, Breadth of Coverage and Contigs
+    """
+    conn = results_store.connect(db_file)
+    data = results_store.get_metrics(conn, ['Breadth of Coverage', 'Aligned Contigs'], samples)
+    conn.close()
+
+    data = data.rename(columns={'Aligned Contigs': 'Contigs'})
+    return data[data['Reference'] != ''].reindex(columns=COLUMNS)
+
+
+def get_x_position(contigs):
+    """
+    Maps the number of contigs to the piecewise-linear, log-like, x axis of the plot
+    :param contigs: array-like with number of contigs
+    :return: numpy array with x axis positions
+    """
+    return np.interp(contigs, INTERPOLATION_XVALUES, np.arange(len(INTERPOLATION_XVALUES)))
+
+
+def main(data):
+    """
+    Plots breadth of coverage against number of contigs, with one subplot per reference and one trace per assembler
+    in each subplot.
+    :param data: pandas dataframe in long format, with columns Reference, Assembler, Breadth of Coverage and Contigs
+    (or Aligned Contigs), and optionally Sample
+    """
+    from plotly import subplots
+    import plotly.graph_objs as go
+    from plotly.offline import plot
+
+    # call Cthulhu and beg him to make this work
+    data = data.rename(columns={'Aligned Contigs': 'Contigs'}).reindex(columns=COLUMNS)
+    data['Sample'] = data['Sample'].fillna('').astype(str)
+    data['x'] = get_x_position(data['Contigs'].to_numpy(dtype=float))
+    data['text'] = data['Contigs'].astype(int).astype(str) + '<br>' + data['Assembler'] + \
+        np.where(data['Sample'] != '', '<br>' + data['Sample'], '')
+
+    references = list(data['Reference'].unique())
+    assemblers = sorted(data['Assembler'].unique())
 
     num_cols = 2
-    num_rows = len(tracers)/num_cols
-    num_rows = int(num_rows) if len(tracers)%num_cols == 0 else int(num_rows)+1
+    num_rows = len(references)/num_cols
+    num_rows = int(num_rows) if len(references)%num_cols == 0 else int(num_rows)+1
     # define number and organization of subplots
     meta_subplots = subplots.make_subplots(rows=num_rows,
                                            cols=num_cols,
                                            #shared_xaxes=True,
                                            shared_yaxes=True,
-                                           subplot_titles=list(species_data.keys()),
+                                           subplot_titles=references,
                                            horizontal_spacing=0.04,
                                            vertical_spacing=0.1)
 
+    # create a tracer for each assembler in each subplot, holding the points of all samples
+    # legends are grouped by assembler, and shown only once (in the first tracer of each assembler)
+    tracers = []
+    rows, cols = [], []
+    legend_assemblers = set()
+    for (reference, assembler), group in data.groupby(['Reference', 'Assembler'], sort=False):
+        i = assemblers.index(assembler)
+        position = references.index(reference)
+        tracers.append(go.Scatter(x=group['x'],
+                                  y=group['Breadth of Coverage'],
+                                  name=assembler,
+                                  showlegend=assembler not in legend_assemblers,
+                                  legendgroup=assembler,  # group legends
+                                  opacity=1,
+                                  mode='markers',
+                                  marker=dict(color=COLOURS[i % len(COLOURS)],
+                                              size=7,
+                                              line=dict(width=1, color='black')),
+                                  text=group['text'],
+                                  hoverinfo='y+text'
+                                  ))
+        legend_assemblers.add(assembler)
+        rows.append(position // num_cols + 1)
+        cols.append(position % num_cols + 1)
+
     # add assemblers tracers to subplot
-    r = 1
-    c = 1
-    for k, v in tracers.items():
-        for t in v:
-            meta_subplots.add_trace(t, r, c)
-        c += 1
-        if c > num_cols:
-            r += 1
-            c = 1
+    meta_subplots.add_traces(tracers, rows=rows, cols=cols)
 
     # define xaxes attributes
-    xaxis_range = list(interpolation_function(interpolation_xvalues))
-    print(xaxis_range)
+    xaxis_range = list(get_x_position(INTERPOLATION_XVALUES))
     meta_subplots.update_xaxes(showgrid=False,
                                showline=True,
                                linecolor='black',
@@ -110,7 +145,7 @@ def main(csv_tables):
                                              size=12),
                                range=[xaxis_range[0], xaxis_range[-1]],
                                tickvals=xaxis_range,
-                               ticktext=interpolation_xvalues)
+                               ticktext=INTERPOLATION_XVALUES)
 
     # define yaxes attributes
     meta_subplots.update_yaxes(showgrid=False,
@@ -152,18 +187,29 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description=__doc__,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
 
-    parser.add_argument('-i', nargs='+', type=str, required=True,
-                        dest='input_files',
-                        help='Path to the directory that contains the input '
-                             'CSV files.')
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('-i', nargs='+', type=str,
+                             dest='input_files',
+                             help='Path to the directory that contains the input '
+                                  'CSV files.')
+    input_group.add_argument('--db', type=str,
+                             dest='db',
+                             help='Path to the SQLite results store (see results_store.py).')
+
+    parser.add_argument('--sample', nargs='+', type=str,
+                        dest='samples',
+                        help='Samples to plot from the results store (default: all).')
 
     args = parser.parse_args()
 
-    return [args.input_files]
+    return [args.input_files, args.db, args.samples]
 
 
 if __name__ == '__main__':
 
     args = parse_arguments()
 
-    main(args[0])
+    if args[1]:
+        main(read_store(args[1], args[2]))
+    else:
+        main(read_csv_tables(args[0]))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Assigns each mapped contig to a single reference genome, resolving contigs with alignments to more than one reference.
+
+The aligned bases (query span of the alignment blocks) of each contig are summed per reference in a single grouped
+pass over the alignment table. Each contig is then assigned to the reference with the most aligned bases (majority)
+or, if a minimum fraction is given, only when that reference holds at least that fraction of the contig's aligned
+bases. Contigs with a relevant share of aligned bases in more than one reference are flagged as chimeric.
+
+For each assembly, this script will output to the command line:
+  * Assembler - assembler name (from paf file name)
+  * Mapped contigs - number of contigs with at least one alignment
+  * Assigned contigs - number of contigs assigned to a reference
+  * Chimeric contigs - number of contigs with aligned bases in more than one reference
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --min-fraction (optional) - minimum fraction of aligned bases to assign a contig (default: majority)
+  * --chimera-fraction (optional) - minimum fraction of aligned bases in a second reference to flag a contig as
+chimeric (default: 0.1)
+  * --save (optional) - save a `<assembler>_contig_assignment.csv` table with the assignment of each contig
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import sys
+import glob
+import argparse
+
+#import commonly used functions from utils.py
+import utils
+
+UNASSIGNED = 'Unassigned'  # reference of the contigs under the minimum fraction of aligned bases
+
+
+def get_aligned_bases(paf_df):
+    """
+    Gets the number of aligned bases of each contig in each reference.
+    :param paf_df: pandas dataframe with the PAF alignment blocks (see utils.read_paf)
+    :return: pandas dataframe with columns Contig, Reference, Contig Len and Aligned Bases
+    """
+    aligned = paf_df[['Contig', 'Reference', 'Contig Len']].copy()
+    aligned['Aligned Bases'] = paf_df['Query End'] - paf_df['Query Start']
+
+    return aligned.groupby(['Contig', 'Reference'], sort=False).agg(
+        **{'Contig Len': ('Contig Len', 'first'), 'Aligned Bases': ('Aligned Bases', 'sum')}).reset_index()
+
+
+def assign_contigs(paf_df, min_fraction=None, chimera_fraction=0.1):
+    """
+    Assigns each contig in the alignment table to a reference.
+    :param paf_df: pandas dataframe with the PAF alignment blocks (see utils.read_paf)
+    :param min_fraction: minimum fraction of the contig's aligned bases in the best reference for it to be assigned.
+    If None, contigs are assigned to the reference with the most aligned bases.
+    :param chimera_fraction: minimum fraction of the contig's aligned bases in a reference for it to count towards
+    the chimera flag
+    :return: pandas dataframe with columns Contig, Reference, Contig Len, Aligned Bases, Total Aligned Bases,
+    Fraction, References and Chimeric
+    """
+    aligned = get_aligned_bases(paf_df)
+    aligned['Total Aligned Bases'] = aligned.groupby('Contig', sort=False)['Aligned Bases'].transform('sum')
+    aligned['Fraction'] = aligned['Aligned Bases'] / aligned['Total Aligned Bases']
+
+    # number of references holding a relevant share of the contig
+    relevant = aligned['Fraction'] >= chimera_fraction
+    references = relevant.groupby(aligned['Contig'], sort=False).sum()
+
+    # best reference for each contig
+    best = aligned.groupby('Contig', sort=False)['Aligned Bases'].idxmax()
+    assignment = aligned.loc[best.to_numpy()].set_index('Contig')
+    assignment['References'] = references.reindex(assignment.index).astype(int)
+    assignment['Chimeric'] = assignment['References'] > 1
+
+    if min_fraction is not None:
+        assignment.loc[assignment['Fraction'] < min_fraction, 'Reference'] = UNASSIGNED
+
+    return assignment.reset_index()
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--min-fraction', type=float, dest='min_fraction',
+                        help='Minimum fraction of aligned bases to assign a contig (default: majority).')
+    parser.add_argument('--chimera-fraction', type=float, default=0.1, dest='chimera_fraction',
+                        help='Minimum fraction of aligned bases in a second reference to flag a contig as chimeric.')
+    parser.add_argument('--save', action='store_true', dest='save',
+                        help='Save a csv table with the assignment of each contig, per assembler.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    mappings = sorted(glob.glob(args.mappings + '/*.paf'))
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    print(','.join(['Assembler', 'Mapped contigs', 'Assigned contigs', 'Chimeric contigs']))
+
+    for paf_file in mappings:
+        assembler = utils.get_assember_name(paf_file)
+        assignment = assign_contigs(utils.read_paf(paf_file), args.min_fraction, args.chimera_fraction)
+
+        assigned = (assignment['Reference'] != UNASSIGNED).sum()
+        chimeric = assignment['Chimeric'].sum()
+        print(','.join([assembler, f'{len(assignment)}',
+                        f'{assigned} ({(assigned/max(len(assignment), 1))*100:.2f}%)',
+                        f'{chimeric} ({(chimeric/max(len(assignment), 1))*100:.2f}%)']))
+
+        if args.save:
+            assignment.to_csv(assembler + '_contig_assignment.csv', index=False)
+
+
+if __name__ == '__main__':
+    main()
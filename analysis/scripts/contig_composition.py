@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Sequence composition of every contig, to triage the unmapped contigs without running other tools.
+
+Each assembly is read once as raw bytes and its contigs are concatenated into a single numpy array of bases, with the
+offset of each contig (the only copy of the bases kept in memory). All the metrics are obtained with vectorized
+operations over that array (base counts with segment reductions at the contig offsets, ambiguous bases by position
+and homopolymers from the positions followed by enough equal bases), with no per-base python loop:
+  * Contig Len - contig length
+  * GC - fraction of G and C over the A, C, G and T bases
+  * N - number of ambiguous bases (anything other than A, C, G and T)
+  * Longest N-run - longest run of Ns
+  * Longest Homopolymer - longest run of the same A, C, G or T base (0 if shorter than --homopolymer)
+  * Homopolymers - number of runs of the same A, C, G or T base with at least --homopolymer bases (default: 5)
+  * Homopolymer Bases - number of bases in those runs
+With the mapping files, the table also has the mapping status (Mapped/Unmapped) of each contig, as in
+utils.parse_assemblies.
+
+For each assembler, this script will output to the command line, for the mapped and unmapped contigs:
+  * Contigs, basepairs, mean GC, contigs with Ns, N bases and longest homopolymer
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the assembly files (ending in *.fasta)
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf) (optional)
+  * --homopolymer (optional) - minimum length of the counted homopolymers (default: 5)
+  * --save (optional) - save the composition of each contig in `<assembler>_contig_composition.csv`
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import mmap
+import argparse
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+
+MIN_HOMOPOLYMER = 5
+
+COMPOSITION_COLUMNS = ['Contig', 'Contig Len', 'GC', 'N', 'Longest N-run', 'Longest Homopolymer', 'Homopolymers',
+                       'Homopolymer Bases']
+
+def read_fasta_bytes(fasta_file):
+    """
+    Reads a fasta file as a single array of (upper case) bases. The file is memory-mapped and the bases of each contig
+    are appended to a single buffer, so only one copy of the bases is kept in memory.
+    :param fasta_file: path to the fasta file
+    :return: tuple with the list of contig names, numpy array with the bases (ASCII codes) of all the contigs and
+    numpy array with the offset of each contig (contig i is bases[offsets[i]:offsets[i+1]])
+    """
+    names, bases, lengths = [], bytearray(), []
+
+    if os.path.getsize(fasta_file):
+        with open(fasta_file, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = mm.find(b'>')
+            while start != -1:
+                header_end = mm.find(b'\n', start)
+                header_end = len(mm) if header_end == -1 else header_end
+                end = mm.find(b'\n>', header_end)
+                end = len(mm) if end == -1 else end
+
+                header = mm[start + 1:header_end]
+                names.append(header.split()[0].decode() if header.strip() else '')
+                sequence = mm[header_end:end].replace(b'\n', b'').replace(b'\r', b'').upper()
+                bases += sequence
+                lengths.append(len(sequence))
+
+                start = -1 if end == len(mm) else end + 1
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return names, np.frombuffer(bases, dtype=np.uint8), offsets
+
+
+def segment_count(mask, offsets):
+    """
+    :param mask: numpy boolean array
+    :param offsets: numpy array with the offsets of the segments (see read_fasta_bytes)
+    :return: numpy array with the number of True values in each segment (0 for empty segments)
+    """
+    counts = np.zeros(len(offsets) - 1, dtype=np.int64)
+    not_empty = np.diff(offsets) > 0
+    if len(mask):
+        counts[not_empty] = np.add.reduceat(mask.view(np.uint8), offsets[:-1][not_empty], dtype=np.uint32)
+    return counts
+
+
+def get_runs(positions, min_length=1, breaks=None):
+    """
+    Groups sorted positions into runs of consecutive positions.
+    :param positions: sorted numpy array of positions
+    :param min_length: int added to the span of each run (the length of the run flagged by each position)
+    :param breaks: optional numpy array of positions that always start a new run (ex: contig offsets)
+    :return: tuple of numpy arrays with the start and length of each run
+    """
+    if not len(positions):
+        return positions, positions
+
+    new_run = np.ones(len(positions), dtype=bool)
+    new_run[1:] = np.diff(positions) != 1
+    if breaks is not None:
+        new_run |= np.isin(positions, breaks)
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:], len(positions)) - 1
+    return positions[first], positions[last] - positions[first] + min_length
+
+
+def get_runs_per_contig(starts, lengths, offsets):
+    """
+    :param starts: numpy array with run starts
+    :param lengths: numpy array with run lengths
+    :param offsets: numpy array with the offset of each contig
+    :return: tuple of numpy arrays with the number of runs, bases in runs and longest run of each contig
+    """
+    contigs = np.searchsorted(offsets, starts, side='right') - 1
+    longest = np.zeros(len(offsets) - 1, dtype=np.int64)
+    np.maximum.at(longest, contigs, lengths)
+    return np.bincount(contigs, minlength=len(longest)), \
+        np.bincount(contigs, weights=lengths, minlength=len(longest)).astype(np.int64), longest
+
+
+def get_composition(names, bases, offsets, min_homopolymer=MIN_HOMOPOLYMER):
+    """
+    Computes the composition of each contig.
+    :param names: list of contig names
+    :param bases: numpy array with the bases of all the contigs (see read_fasta_bytes)
+    :param offsets: numpy array with the offset of each contig
+    :param min_homopolymer: int with the minimum length of the counted homopolymers (at least 2)
+    :return: pandas DataFrame with COMPOSITION_COLUMNS, one row per contig
+    """
+    lengths = np.diff(offsets)
+    gc_bases = (bases == ord('G')) | (bases == ord('C'))
+    acgt = gc_bases | (bases == ord('A')) | (bases == ord('T'))
+    gc = segment_count(gc_bases, offsets)
+
+    # ambiguous bases are rare, so they are handled by position
+    _, n_bases, longest_n_run = get_runs_per_contig(*get_runs(np.flatnonzero(~acgt), breaks=offsets), offsets)
+
+    # homopolymers: positions followed by min_homopolymer - 1 equal bases in the same contig
+    same_as_next = (bases[1:] == bases[:-1]) & acgt[1:]
+    contig_ends = offsets[1:-1]
+    same_as_next[contig_ends[(contig_ends > 0) & (contig_ends < len(bases))] - 1] = False
+    window = same_as_next[:max(len(same_as_next) - min_homopolymer + 2, 0)].copy()
+    for i in range(1, min_homopolymer - 1):
+        window &= same_as_next[i:i + len(window)]
+    homopolymers, homopolymer_bases, longest_homopolymer = \
+        get_runs_per_contig(*get_runs(np.flatnonzero(window), min_homopolymer), offsets)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gc_fraction = np.nan_to_num(gc / (lengths - n_bases))
+
+    return pd.DataFrame({'Contig': names, 'Contig Len': lengths, 'GC': gc_fraction, 'N': n_bases,
+                         'Longest N-run': longest_n_run, 'Longest Homopolymer': longest_homopolymer,
+                         'Homopolymers': homopolymers, 'Homopolymer Bases': homopolymer_bases},
+                        columns=COMPOSITION_COLUMNS)
+
+
+def get_assembly_composition(assemblies, mappings=None, min_homopolymer=MIN_HOMOPOLYMER):
+    """
+    Computes the composition of the contigs of each assembly, with their mapping status if the mappings are given.
+    :param assemblies: list of assembly files
+    :param mappings: optional list of paf files
+    :param min_homopolymer: int with the minimum length of the counted homopolymers
+    :return: pandas DataFrame with Assembler, COMPOSITION_COLUMNS and Mapped (with the mappings) columns
+    """
+    mapping_index = utils.index_by_assembler(mappings) if mappings else {}
+
+    tables = []
+    for assembly_file in assemblies:
+        assembler = utils.get_assember_name(assembly_file)
+
+        with profiling.stage('get_composition', assembler) as stage:
+            df = get_composition(*read_fasta_bytes(assembly_file), min_homopolymer)
+            stage['Items'] = len(df)
+
+        df.insert(0, 'Assembler', assembler)
+        if mappings:
+            mapped_contigs = utils.get_mapped_contigs(mapping_index[assembler])
+            df['Mapped'] = np.where(df['Contig'].isin(mapped_contigs), 'Mapped', 'Unmapped')
+        tables.append(df)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def get_composition_summary(df):
+    """
+    Summarises the composition of the contigs of each assembler (and mapping status, if available).
+    :param df: pandas DataFrame with the contig composition (see get_assembly_composition)
+    :return: pandas DataFrame with one row per assembler (and mapping status)
+    """
+    groups = ['Assembler'] + (['Mapped'] if 'Mapped' in df.columns else [])
+    df = df.assign(**{'GC bases': df['GC'] * (df['Contig Len'] - df['N']), 'ACGT bases': df['Contig Len'] - df['N'],
+                      'Contigs with Ns': df['N'] > 0})
+    summary = df.groupby(groups).agg(**{'Contigs': ('Contig', 'size'), 'basepairs': ('Contig Len', 'sum'),
+                                        'GC bases': ('GC bases', 'sum'), 'ACGT bases': ('ACGT bases', 'sum'),
+                                        'Contigs with Ns': ('Contigs with Ns', 'sum'), 'N bases': ('N', 'sum'),
+                                        'Longest Homopolymer': ('Longest Homopolymer', 'max')}).reset_index()
+    summary.insert(len(groups) + 2, 'GC', summary.pop('GC bases') / summary.pop('ACGT bases').clip(lower=1))
+    return summary
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, nargs='?', help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--homopolymer', type=int, default=MIN_HOMOPOLYMER, dest='min_homopolymer',
+                        help='Minimum length of the counted homopolymers.')
+    parser.add_argument('--save', action='store_true', dest='save',
+                        help='Save a csv table with the composition of each contig, per assembler.')
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.min_homopolymer < 2:
+        parser.error('the minimum homopolymer length must be at least 2')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    if args.mappings:
+        assemblies, mappings = manifest.get_paired_files(args.assemblies, args.mappings)
+    else:
+        assemblies, mappings = manifest.list_files(args.assemblies, '.fasta'), None
+
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    df = get_assembly_composition(assemblies, mappings, args.min_homopolymer)
+    summary = get_composition_summary(df)
+
+    for assembler in sorted(df['Assembler'].unique()):
+        print('\n\n------' + assembler + '------\n')
+        print(summary[summary['Assembler'] == assembler].drop(columns='Assembler')
+              .to_csv(index=False, float_format='%.4f'), end='')
+
+        if args.save:
+            df[df['Assembler'] == assembler].drop(columns='Assembler')\
+                .to_csv(assembler + '_contig_composition.csv', index=False, float_format='%.4f')
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Per-base depth of coverage of each reference by the contigs of each assembler, to find where the assemblies pile up
+redundant contigs or collapse repeats.
+
+The alignment intervals of the PAF file are folded into the coordinates of a single copy of the triple reference
+(splitting the intervals that cross a copy boundary), and the depth of every reference base is obtained from a
+difference array (+1 at each interval start, -1 at each interval end, followed by a cumulative sum), with no
+per-base python loop.
+
+For each assembler, this script will output to the command line for each reference genome:
+  * Reference - reference name
+  * Mean depth - mean depth of coverage of the reference by the contigs
+  * Max depth - highest depth of coverage
+  * >=Nx - fraction of the reference covered by at least N contigs, for each depth in --depths
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --reference (optional) - path to the triple reference genomes (default: reference lengths from the paf files)
+  * --depths (optional) - depths to report the fraction of the reference covered at (default: 1 2 3 5 10)
+  * --window (optional) - window size of the depth tracks (default: 1000)
+  * --save (optional) - save `<assembler>_depth_histogram.csv` and `<assembler>_depth_windows.csv` tables
+  * --plot (optional) - plot the depth tracks of each reference for all assemblers
+  * --store (optional) - SQLite results store (see results_store.py) to upsert the depth metrics into
+  * --sample (optional) - sample name for the results store (default: from the paf file names)
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import results_store
+
+DEPTHS = [1, 2, 3, 5, 10]
+WINDOW_SIZE = 1000
+
+
+def fold_intervals(starts, ends, ref_len, return_index=False):
+    """
+    Folds alignment intervals on the triple reference into the coordinates of a single copy of the reference.
+    Intervals crossing the boundary between two copies are split at the boundary.
+    :param starts: numpy array with interval starts (0-based) in the triple reference
+    :param ends: numpy array with interval ends (exclusive) in the triple reference
+    :param ref_len: int with the length of a single copy of the reference
+    :param return_index: Bool to also return the index of the original interval of each folded interval
+    :return: tuple of numpy arrays with the starts and ends of the folded intervals (and original interval indexes)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    # number of reference copies spanned by each interval
+    first_copy = starts // ref_len
+    pieces = (ends - 1) // ref_len - first_copy + 1
+    pieces = np.where(ends > starts, pieces, 0)
+
+    # one row per piece, clipped to the copy it belongs to
+    interval = np.repeat(np.arange(len(starts)), pieces)
+    copy = first_copy[interval] + np.arange(len(interval)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    piece_starts = np.maximum(starts[interval], copy * ref_len) - copy * ref_len
+    piece_ends = np.minimum(ends[interval], (copy + 1) * ref_len) - copy * ref_len
+
+    if return_index:
+        return piece_starts, piece_ends, interval
+    return piece_starts, piece_ends
+
+
+def get_depth(starts, ends, ref_len):
+    """
+    Gets the depth of coverage of each base of the reference from folded alignment intervals, with a difference array.
+    :param starts: numpy array with interval starts (0-based)
+    :param ends: numpy array with interval ends (exclusive)
+    :param ref_len: int with reference length
+    :return: numpy array with the depth of each reference base
+    """
+    difference = np.bincount(starts, minlength=ref_len + 1) - np.bincount(ends, minlength=ref_len + 1)
+    return np.cumsum(difference[:ref_len]).astype(np.int32)
+
+
+def get_depth_histogram(depth):
+    """
+    :param depth: numpy array with the depth of each reference base
+    :return: numpy array with the number of reference bases at each depth (index)
+    """
+    return np.bincount(depth)
+
+
+def get_fraction_at_depth(histogram, depths):
+    """
+    Gets the fraction of the reference covered by at least each of the given depths.
+    :param histogram: numpy array with the number of reference bases at each depth (see get_depth_histogram)
+    :param depths: list of ints with minimum depths
+    :return: list of floats with the fraction of reference bases with depth >= each of depths
+    """
+    # number of bases with depth >= index
+    at_least = np.cumsum(histogram[::-1])[::-1]
+    total = at_least[0]
+    return [at_least[depth] / total if depth < len(at_least) else 0.0 for depth in depths]
+
+
+def get_windowed_depth(depth, window_size=WINDOW_SIZE):
+    """
+    Gets the mean depth of coverage in fixed windows along the reference (the last window may be shorter).
+    :param depth: numpy array with the depth of each reference base
+    :param window_size: int with window size
+    :return: tuple of numpy arrays with the window starts and mean depths
+    """
+    window_starts = np.arange(0, len(depth), window_size)
+    window_lengths = np.diff(np.append(window_starts, len(depth)))
+    return window_starts, np.add.reduceat(depth, window_starts) / window_lengths
+
+
+def get_depth_stats(paf_file, ref_lengths, depths=DEPTHS, window_size=WINDOW_SIZE):
+    """
+    Computes the depth of coverage stats of each reference for an assembler.
+    :param paf_file: path to the PAF file of the assembler
+    :param ref_lengths: dict with reference names as keys and single copy lengths as values
+    :param depths: list of ints with minimum depths to report the covered fraction for
+    :param window_size: int with window size of the depth tracks
+    :return:
+        - pandas DataFrame with Reference, Mean depth, Max depth and >=Nx columns, one row per reference
+        - pandas DataFrame with Reference, Depth and Bases (depth histogram)
+        - pandas DataFrame with Reference, Start, End and Mean depth (depth tracks)
+    """
+    paf_df = utils.read_paf(paf_file)
+
+    stats, histograms, windows = [], [], []
+    for reference, ref_len in ref_lengths.items():
+        reference_name = utils.REFERENCE_DIC.get(reference, reference)
+        paf_reference = paf_df[paf_df['Reference'] == reference]
+
+        starts, ends = fold_intervals(paf_reference['Target Start'].values, paf_reference['Target End'].values,
+                                      ref_len)
+        depth = get_depth(starts, ends, ref_len)
+        histogram = get_depth_histogram(depth)
+
+        stats.append({'Reference': reference_name, 'Mean depth': depth.mean(), 'Max depth': int(depth.max()),
+                      **{f'>={depth_value}x': fraction for depth_value, fraction in
+                         zip(depths, get_fraction_at_depth(histogram, depths))}})
+
+        histograms.append(pd.DataFrame({'Reference': reference_name, 'Depth': np.arange(len(histogram)),
+                                        'Bases': histogram}))
+
+        window_starts, window_depth = get_windowed_depth(depth, window_size)
+        windows.append(pd.DataFrame({'Reference': reference_name, 'Start': window_starts,
+                                     'End': np.minimum(window_starts + window_size, ref_len),
+                                     'Mean depth': window_depth}))
+
+    return pd.DataFrame(stats), pd.concat(histograms, ignore_index=True), pd.concat(windows, ignore_index=True)
+
+
+def get_reference_lengths(mappings, reference_file=None):
+    """
+    Gets the length of a single copy of each triple reference, from the reference fasta file or from the paf files.
+    :param mappings: list of paf files
+    :param reference_file: optional path to the triple reference fasta file
+    :return: dict with reference names as keys and lengths as values
+    """
+    if reference_file:
+        return {header: len(seq) // 3 for header, seq in utils.fasta_iter(reference_file)}
+
+    ref_lengths = {}
+    for paf_file in mappings:
+        paf_df = utils.read_paf(paf_file)
+        for reference, reference_len in paf_df[['Reference', 'Reference Len']].drop_duplicates()\
+                .itertuples(index=False):
+            ref_lengths[reference] = int(reference_len) // 3
+    return dict(sorted(ref_lengths.items()))
+
+
+def plot_depth_tracks(windows):
+    """
+    Line plots with the windowed depth of coverage along each reference, one subplot per reference.
+    :param windows: pandas DataFrame with Assembler, Reference, Start and Mean depth columns
+    """
+    from plotly import subplots
+    from plotly.offline import plot
+    import plotly.graph_objects as go
+
+    references = sorted(windows['Reference'].unique())
+    fig = subplots.make_subplots(rows=len(references), cols=1, subplot_titles=references, vertical_spacing=0.03)
+
+    for r, reference in enumerate(references, start=1):
+        for assembler in sorted(windows['Assembler'].unique()):
+            track = windows[(windows['Reference'] == reference) & (windows['Assembler'] == assembler)]
+            fig.add_trace(go.Scatter(x=track['Start'], y=track['Mean depth'], name=assembler, legendgroup=assembler,
+                                     showlegend=r == 1, mode='lines', line=dict(width=1)), r, 1)
+
+    fig.update_layout(title="Depth of coverage along each reference genome", plot_bgcolor='rgb(255,255,255)',
+                      height=300 * len(references))
+    fig.update_yaxes(title_text="Depth", gridcolor='#DCDCDC')
+    plot(fig, filename='depth_tracks.html')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--reference', type=str, dest='reference',
+                        help='Path to the triple reference genomes (default: reference lengths from the paf files).')
+    parser.add_argument('--depths', nargs='+', type=int, default=DEPTHS, dest='depths',
+                        help='Depths to report the fraction of the reference covered at.')
+    parser.add_argument('--window', type=int, default=WINDOW_SIZE, dest='window_size',
+                        help='Window size of the depth tracks.')
+    parser.add_argument('--save', action='store_true', dest='save',
+                        help='Save the depth histogram and the depth tracks of each assembler as csv tables.')
+    parser.add_argument('--plot', action='store_true', dest='plot',
+                        help='Plot the depth tracks of each reference for all assemblers.')
+    parser.add_argument('--store', type=str, dest='store',
+                        help='SQLite results store to upsert the depth metrics per reference into.')
+    parser.add_argument('--sample', type=str, dest='sample',
+                        help='Sample name for the results store (default: from the paf file names).')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    mappings = sorted(glob.glob(args.mappings + '/*.paf'))
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    ref_lengths = get_reference_lengths(mappings, args.reference)
+    store = results_store.connect(args.store) if args.store else None
+
+    all_windows = []
+    for paf_file in mappings:
+        assembler = utils.get_assember_name(paf_file)
+
+        with profiling.stage('get_depth_stats', assembler, len(ref_lengths)):
+            stats, histogram, windows = get_depth_stats(paf_file, ref_lengths, args.depths, args.window_size)
+
+        print('\n\n------' + assembler + '------\n')
+        print(stats.to_csv(index=False, float_format='%.4f'), end='')
+
+        if args.save:
+            histogram.to_csv(assembler + '_depth_histogram.csv', index=False)
+            windows.to_csv(assembler + '_depth_windows.csv', index=False, float_format='%.4f')
+
+        if store is not None:
+            stats['Assembler'] = assembler
+            results_store.upsert_dataframe(store, args.sample or utils.get_sample_name(paf_file), stats,
+                                           [col for col in stats.columns if col not in ('Assembler', 'Reference')])
+
+        all_windows.append(windows.assign(Assembler=assembler))
+
+    if store is not None:
+        store.close()
+
+    if args.plot:
+        with profiling.stage('plot'):
+            plot_depth_tracks(pd.concat(all_windows, ignore_index=True))
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
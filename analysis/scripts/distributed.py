@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Distributed execution of the analysis of many samples and assemblers, split into shards.
+
+The sample x assembler matrix is discovered from a results tree (see manifest.py) and split into shards of similar
+size (balanced by the size of the assembly and mapping files), which are saved in a plan in a work directory. Each
+shard computes the metrics of its assemblers (assembly stats, mapped contigs and bp and the mapping stats per
+reference, see watch_analysis.py) and writes them to its own result tables, followed by a `.done` marker. A shard
+that fails writes a `.failed` file with the error instead, and only the shards without a `.done` marker are run
+again, so finished shards are never redone.
+
+The shards are run by an executor:
+  * local - a pool of worker processes in this machine, which also retries the failed shards (--retries)
+  * slurm - a SLURM job array with one task per pending shard, submitted with sbatch, where each task runs
+    `srun distributed.py run-shard <work dir> $SLURM_ARRAY_TASK_ID`
+The result tables of all the shards are then merged into a single table of each type.
+
+Expected input
+--------------
+This script takes a command and the path to the work directory:
+  * plan - discover and split the sample x assembler matrix
+    * Path to the assembly files (ending in *.fasta, searched recursively)
+    * Path to the mapped contigs to the triple reference genomes (ending in *.paf, searched recursively)
+    * --shards (optional) - number of shards (default: 100)
+    * --reference (optional) - path to the triple reference genomes
+    * --min-fraction (optional) - minimum fraction of aligned bases in a reference to assign a contig to it
+    * --engine (optional) - implementation of the breadth of coverage, lowest identity and assembly parsing: legacy
+      or vectorized (see validate_engines.py) (default: vectorized)
+    * --force (optional) - replace an existing plan, discarding the results of its shards
+  * submit - run the pending shards
+    * --executor (optional) - local or slurm (default: local)
+    * -t (optional) - number of worker processes of the local executor (default: number of CPUs)
+    * --retries (optional) - times the local executor retries the failed shards (default: 1)
+    * --max-parallel, --cpus, --mem, --slurm-option (optional) - SLURM job array options
+    * --dry-run (optional) - write the SLURM job array script without submitting it
+  * run-shard - run a single shard (default: $SLURM_ARRAY_TASK_ID)
+  * status - print the status of each shard
+  * merge - merge the result tables of the finished shards into assembly_stats.csv and reference_stats.csv
+    * -o (optional) - output directory (default: the work directory)
+    * --store (optional) - SQLite results store (see results_store.py) to upsert the merged metrics into
+
+The triple bacterial reference files for the zymos mock community are available at
+"../../data/references/Zymos_Genomes_triple_chromosomes.fasta"
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import shutil
+import socket
+import argparse
+import traceback
+import subprocess
+from multiprocessing import Pool
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import manifest
+import results_store
+import watch_analysis
+import assembly_mapping_stats_per_ref
+
+PLAN_VERSION = 1
+PLAN_FILE = 'plan.json'
+SHARDS = 100
+RETRIES = 1
+
+
+def get_tasks(assemblies_dir, mappings_dir):
+    """
+    Gets the sample x assembler matrix of a results tree.
+    :param assemblies_dir: path to the assembly files (searched recursively)
+    :param mappings_dir: path to the mapping files (searched recursively)
+    :return: list of dicts with sample, assembler, assembly and mapping (absolute paths) and size (bytes of both
+    files)
+    """
+    current_manifest = manifest.build_manifest(assemblies_dir, mappings_dir, recursive=True, checksum=False)
+    files = current_manifest['files']
+
+    tasks = []
+    for entry in current_manifest['entries']:
+        if entry['status'] != 'OK':
+            print(f'Skipping {entry["sample"]} {entry["assembler"]}: {entry["status"]}', file=sys.stderr)
+            continue
+        tasks.append({'sample': watch_analysis.get_pair_sample(entry), 'assembler': entry['assembler'],
+                      'assembly': os.path.abspath(entry['assembly']), 'mapping': os.path.abspath(entry['mapping']),
+                      'size': files[entry['assembly']]['size'] + files[entry['mapping']]['size']})
+    return tasks
+
+
+def split_tasks(tasks, shards=SHARDS):
+    """
+    Splits the tasks into shards of similar size, assigning the largest tasks first to the smallest shard.
+    :param tasks: list of task dicts (see get_tasks)
+    :param shards: int with the maximum number of shards
+    :return: list of non-empty lists of tasks
+    """
+    heap = [(0, i, []) for i in range(min(shards, len(tasks)))]
+    for task in sorted(tasks, key=lambda task: (-task['size'], task['sample'], task['assembler'])):
+        size, i, shard = heapq.heappop(heap)
+        shard.append(task)
+        heapq.heappush(heap, (size + task['size'], i, shard))
+    return [shard for _, _, shard in sorted(heap, key=lambda item: item[1])]
+
+
+def get_shard_file(work_dir, shard_id, suffix):
+    """
+    :param work_dir: path to the work directory
+    :param shard_id: int with shard index
+    :param suffix: string with the file type (ex: 'done', 'assembly.csv')
+    :return: path to the file of the shard
+    """
+    return os.path.join(work_dir, 'shards', f'shard_{shard_id:05d}.{suffix}')
+
+
+def save_plan(plan, work_dir, force=False):
+    """
+    :param plan: dict with the plan (see make_plan)
+    :param work_dir: path to the work directory
+    :param force: Bool to replace an existing plan, removing the results of its shards
+    """
+    plan_file = os.path.join(work_dir, PLAN_FILE)
+    if os.path.isfile(plan_file):
+        if not force:
+            raise FileExistsError(f'{plan_file} already exists (use --force to replace it)')
+        shutil.rmtree(os.path.join(work_dir, 'shards'), ignore_errors=True)
+
+    os.makedirs(os.path.join(work_dir, 'shards'), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'logs'), exist_ok=True)
+    with open(plan_file, 'w') as fh:
+        json.dump(plan, fh, indent=1)
+
+
+def load_plan(work_dir):
+    """
+    :param work_dir: path to the work directory
+    :return: dict with the plan (see make_plan)
+    """
+    with open(os.path.join(work_dir, PLAN_FILE)) as fh:
+        plan = json.load(fh)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f'{work_dir} has a plan with an unsupported version')
+    return plan
+
+
+def make_plan(assemblies_dir, mappings_dir, shards=SHARDS, reference_file=None, min_fraction=None,
+              engine='vectorized'):
+    """
+    :param assemblies_dir: path to the assembly files
+    :param mappings_dir: path to the mapping files
+    :param shards: int with the maximum number of shards
+    :param reference_file: path to the triple reference fasta file
+    :param min_fraction: minimum fraction of aligned bases in a reference to assign a contig to it
+    :param engine: implementation of the breadth of coverage, lowest identity and assembly parsing (see utils.ENGINES)
+    :return: dict with the plan, with the analysis options and the list of tasks of each shard
+    """
+    return {'version': PLAN_VERSION,
+            'reference': os.path.abspath(reference_file or assembly_mapping_stats_per_ref.REFERENCE_SEQUENCES),
+            'min_fraction': min_fraction,
+            'engine': engine,
+            'shards': split_tasks(get_tasks(assemblies_dir, mappings_dir), shards)}
+
+
+def get_shard_status(work_dir, shard_id):
+    """
+    :param work_dir: path to the work directory
+    :param shard_id: int with shard index
+    :return: string with 'done', 'failed' or 'pending'
+    """
+    if os.path.isfile(get_shard_file(work_dir, shard_id, 'done')):
+        return 'done'
+    if os.path.isfile(get_shard_file(work_dir, shard_id, 'failed')):
+        return 'failed'
+    return 'pending'
+
+
+def get_pending_shards(work_dir, plan):
+    """
+    :param work_dir: path to the work directory
+    :param plan: dict with the plan
+    :return: list with the indexes of the shards that didn't finish (pending or failed)
+    """
+    return [shard_id for shard_id in range(len(plan['shards'])) if get_shard_status(work_dir, shard_id) != 'done']
+
+
+def write_table(df, path):
+    """
+    Writes a csv table atomically, so a killed shard never leaves a partial table behind.
+    :param df: pandas DataFrame
+    :param path: path to the csv file
+    """
+    df.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def run_shard(work_dir, shard_id):
+    """
+    Computes the metrics of the tasks of a shard and writes its result tables and `.done` marker. On failure, writes
+    the error to the `.failed` file of the shard and raises it.
+    :param work_dir: path to the work directory
+    :param shard_id: int with shard index
+    """
+    plan = load_plan(work_dir)
+    start = time.time()
+    failed_file = get_shard_file(work_dir, shard_id, 'failed')
+
+    try:
+        assembly_tables, reference_tables = [], []
+        for task in plan['shards'][shard_id]:
+            # plans saved before the engine option was added were run with the legacy engine
+            df_assembly, df_references = watch_analysis.get_pair_metrics(task['assembly'], task['mapping'],
+                                                                         plan['reference'], plan['min_fraction'],
+                                                                         plan.get('engine', 'legacy'))
+            assembly_tables.append(df_assembly.assign(Sample=task['sample']))
+            reference_tables.append(df_references.assign(Sample=task['sample']))
+
+        write_table(pd.concat(assembly_tables, ignore_index=True), get_shard_file(work_dir, shard_id, 'assembly.csv'))
+        write_table(pd.concat(reference_tables, ignore_index=True),
+                    get_shard_file(work_dir, shard_id, 'reference.csv'))
+    except Exception:
+        with open(failed_file, 'w') as fh:
+            fh.write(traceback.format_exc())
+        raise
+
+    if os.path.isfile(failed_file):
+        os.remove(failed_file)
+    with open(get_shard_file(work_dir, shard_id, 'done'), 'w') as fh:
+        json.dump({'tasks': len(plan['shards'][shard_id]), 'seconds': time.time() - start,
+                   'host': socket.gethostname()}, fh)
+
+
+def _run_shard(task):
+    work_dir, shard_id = task
+    try:
+        run_shard(work_dir, shard_id)
+        return True
+    except Exception:
+        return False
+
+
+def run_local(work_dir, shard_ids, args):
+    """
+    Local executor: runs the shards in a pool of worker processes, retrying the failed shards.
+    :param work_dir: path to the work directory
+    :param shard_ids: list of shard indexes
+    :param args: parsed command line arguments (threads and retries)
+    :return: list with the indexes of the shards that failed after all the retries
+    """
+    for attempt in range(args.retries + 1):
+        if not shard_ids:
+            break
+        if attempt:
+            print(f'Retrying {len(shard_ids)} failed shards', file=sys.stderr)
+        with Pool(args.threads) as pool:
+            succeeded = pool.map(_run_shard, [(work_dir, shard_id) for shard_id in shard_ids], chunksize=1)
+        shard_ids = [shard_id for shard_id, ok in zip(shard_ids, succeeded) if not ok]
+    return shard_ids
+
+
+def get_slurm_script(work_dir, shard_ids, args):
+    """
+    :param work_dir: path to the work directory
+    :param shard_ids: list of shard indexes
+    :param args: parsed command line arguments (max_parallel, cpus, mem and slurm_options)
+    :return: string with the SLURM job array script
+    """
+    work_dir = os.path.abspath(work_dir)
+    array = ','.join(str(shard_id) for shard_id in shard_ids)
+    if args.max_parallel:
+        array += f'%{args.max_parallel}'
+
+    lines = ['#!/usr/bin/env bash',
+             '#SBATCH --job-name=assembly_analysis',
+             f'#SBATCH --array={array}',
+             '#SBATCH --nodes=1',
+             '#SBATCH --tasks-per-node=1',
+             f'#SBATCH --cpus-per-task={args.cpus}',
+             f'#SBATCH --mem-per-cpu={args.mem}',
+             f'#SBATCH --output={os.path.join(work_dir, "logs", "shard_%a.log")}']
+    lines += [f'#SBATCH {option}' for option in args.slurm_options]
+    lines += ['', f'srun {sys.executable} {os.path.abspath(__file__)} run-shard {work_dir} $SLURM_ARRAY_TASK_ID', '']
+    return '\n'.join(lines)
+
+
+def run_slurm(work_dir, shard_ids, args):
+    """
+    SLURM executor: submits the shards as a job array (asynchronous, the failed shards are retried by submitting
+    again once the array finishes).
+    :param work_dir: path to the work directory
+    :param shard_ids: list of shard indexes
+    :param args: parsed command line arguments (see get_slurm_script and dry_run)
+    :return: empty list (the status of the shards is only known once the job array finishes)
+    """
+    script_file = os.path.join(work_dir, 'slurm_array.sh')
+    with open(script_file, 'w') as fh:
+        fh.write(get_slurm_script(work_dir, shard_ids, args))
+
+    if args.dry_run:
+        print(f'SLURM job array script written to {script_file}', file=sys.stderr)
+    else:
+        subprocess.run(['sbatch', script_file], check=True)
+    return []
+
+
+# executors, with the signature (work_dir, shard_ids, args) -> list of failed shard indexes
+EXECUTORS = {'local': run_local, 'slurm': run_slurm}
+
+
+def merge_shards(work_dir, plan):
+    """
+    Merges the result tables of the finished shards.
+    :param work_dir: path to the work directory
+    :param plan: dict with the plan
+    :return: tuple of pandas DataFrames with the assembly and reference stats of all the finished shards
+    """
+    assembly_tables, reference_tables = [], []
+    for shard_id in range(len(plan['shards'])):
+        if get_shard_status(work_dir, shard_id) == 'done':
+            assembly_tables.append(pd.read_csv(get_shard_file(work_dir, shard_id, 'assembly.csv')))
+            reference_tables.append(pd.read_csv(get_shard_file(work_dir, shard_id, 'reference.csv')))
+
+    df_assembly = pd.concat(assembly_tables, ignore_index=True) if assembly_tables else pd.DataFrame()
+    df_references = pd.concat(reference_tables, ignore_index=True) if reference_tables else pd.DataFrame()
+
+    df_assembly = df_assembly.reindex(columns=['Sample', 'Assembler'] + watch_analysis.ASSEMBLY_METRICS)
+    df_references = df_references.reindex(columns=['Sample', 'Assembler', 'Reference'] +
+                                          watch_analysis.REFERENCE_METRICS)
+    return df_assembly.sort_values(['Sample', 'Assembler'], ignore_index=True), \
+        df_references.sort_values(['Sample', 'Assembler'], kind='stable', ignore_index=True)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    plan_parser = subparsers.add_parser('plan', help='Split the sample x assembler matrix into shards.')
+    plan_parser.add_argument('work_dir', type=str, help='Path to the work directory.')
+    plan_parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    plan_parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    plan_parser.add_argument('--shards', type=int, default=SHARDS, dest='shards', help='Number of shards.')
+    plan_parser.add_argument('--reference', type=str, dest='reference',
+                             help='Path to the triple reference genomes (default: '
+                                  'Zymos_Genomes_triple_chromosomes.fasta in the data folder).')
+    plan_parser.add_argument('--min-fraction', type=float, dest='min_fraction',
+                             help='Minimum fraction of aligned bases to assign a contig (default: majority).')
+    plan_parser.add_argument('--engine', choices=utils.ENGINES, default='vectorized', dest='engine',
+                             help='Implementation of the breadth of coverage, lowest identity and assembly parsing.')
+    plan_parser.add_argument('--force', action='store_true', dest='force',
+                             help='Replace an existing plan, discarding the results of its shards.')
+
+    submit_parser = subparsers.add_parser('submit', help='Run the pending shards.')
+    submit_parser.add_argument('work_dir', type=str, help='Path to the work directory.')
+    submit_parser.add_argument('--executor', choices=sorted(EXECUTORS), default='local', dest='executor',
+                               help='Executor of the shards.')
+    submit_parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes (local executor).')
+    submit_parser.add_argument('--retries', type=int, default=RETRIES, dest='retries',
+                               help='Times the failed shards are retried (local executor).')
+    submit_parser.add_argument('--max-parallel', type=int, dest='max_parallel',
+                               help='Maximum number of shards running at the same time (slurm executor).')
+    submit_parser.add_argument('--cpus', type=int, default=1, dest='cpus', help='CPUs per shard (slurm executor).')
+    submit_parser.add_argument('--mem', type=str, default='4GB', dest='mem',
+                               help='Memory per CPU (slurm executor).')
+    submit_parser.add_argument('--slurm-option', action='append', default=[], dest='slurm_options',
+                               help='Extra #SBATCH option, ex: --slurm-option="--partition=long" (repeatable).')
+    submit_parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                               help='Write the SLURM job array script without submitting it.')
+
+    shard_parser = subparsers.add_parser('run-shard', help='Run a single shard.')
+    shard_parser.add_argument('work_dir', type=str, help='Path to the work directory.')
+    shard_parser.add_argument('shard_id', type=int, nargs='?', default=os.environ.get('SLURM_ARRAY_TASK_ID'),
+                              help='Shard index (default: $SLURM_ARRAY_TASK_ID).')
+
+    status_parser = subparsers.add_parser('status', help='Print the status of each shard.')
+    status_parser.add_argument('work_dir', type=str, help='Path to the work directory.')
+
+    merge_parser = subparsers.add_parser('merge', help='Merge the result tables of the finished shards.')
+    merge_parser.add_argument('work_dir', type=str, help='Path to the work directory.')
+    merge_parser.add_argument('-o', type=str, dest='output_dir', help='Output directory (default: work directory).')
+    merge_parser.add_argument('--store', type=str, dest='store',
+                              help='SQLite results store to upsert the merged metrics into.')
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(0)
+    if args.command == 'run-shard' and args.shard_id is None:
+        shard_parser.error('the shard index is required outside of a SLURM job array')
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    if args.command == 'plan':
+        plan = make_plan(args.assemblies, args.mappings, args.shards, args.reference, args.min_fraction, args.engine)
+        save_plan(plan, args.work_dir, args.force)
+        print(f'{sum(len(shard) for shard in plan["shards"])} tasks in {len(plan["shards"])} shards')
+        return
+
+    plan = load_plan(args.work_dir)
+
+    if args.command == 'run-shard':
+        run_shard(args.work_dir, int(args.shard_id))
+
+    elif args.command == 'submit':
+        pending = get_pending_shards(args.work_dir, plan)
+        print(f'{len(pending)} of {len(plan["shards"])} shards pending', file=sys.stderr)
+        failed = EXECUTORS[args.executor](args.work_dir, pending, args) if pending else []
+        if failed:
+            print(f'Failed shards: {",".join(str(shard_id) for shard_id in failed)} (see the .failed files in '
+                  f'{os.path.join(args.work_dir, "shards")})', file=sys.stderr)
+            sys.exit(1)
+
+    elif args.command == 'status':
+        print(','.join(['Shard', 'Tasks', 'Status']))
+        for shard_id, shard in enumerate(plan['shards']):
+            print(','.join([str(shard_id), str(len(shard)), get_shard_status(args.work_dir, shard_id)]))
+
+    elif args.command == 'merge':
+        pending = get_pending_shards(args.work_dir, plan)
+        if pending:
+            print(f'Warning: {len(pending)} shards not finished, their results are missing', file=sys.stderr)
+
+        df_assembly, df_references = merge_shards(args.work_dir, plan)
+        output_dir = args.output_dir or args.work_dir
+        os.makedirs(output_dir, exist_ok=True)
+        write_table(df_assembly, os.path.join(output_dir, 'assembly_stats.csv'))
+        write_table(df_references, os.path.join(output_dir, 'reference_stats.csv'))
+
+        if args.store:
+            store = results_store.connect(args.store)
+            for sample, df_sample in df_assembly.groupby('Sample'):
+                results_store.upsert_dataframe(store, sample, df_sample, watch_analysis.ASSEMBLY_METRICS)
+            for sample, df_sample in df_references.groupby('Sample'):
+                assembly_mapping_stats_per_ref.store_reference_stats(store, sample, df_sample)
+            store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Homopolymer and sequence context profile of the errors (SNPs, insertions and deletions) of each assembler.
+
+The `cs` difference string (or, if missing, the `cg` CIGAR with `--eqx` operations) of each alignment is split into
+its operations, and the reference position of each operation is obtained from the cumulative reference bases of the
+previous operations of the alignment (folded into a single copy of the triple reference). The reference context of each
+error is looked up in a byte-packed, upper case copy of the single copy of each reference, saved once in a cache
+directory and memory-mapped (shared by all the worker processes), together with the length of the homopolymer each
+reference base belongs to:
+  * SNP - homopolymer of the substituted base
+  * deletion - homopolymer of the first deleted base
+  * insertion - homopolymer of the reference base before or after the insertion point with the same base as the
+    inserted sequence (`cs` only; with a `cg` CIGAR, the longest of the two)
+The rates are per 100 kbp of aligned reference bases in the same class (aligned bases are counted with their depth).
+The PAF files are processed in parallel, one per worker process.
+
+For each assembler, this script will output to the command line for each homopolymer length (up to 8+):
+  * Homopolymer Length - length of the reference homopolymer
+  * Aligned Bases - aligned reference bases in homopolymers of that length
+  * SNPs, Insertions, Deletions - number of errors
+  * SNPs, Insertions, Deletions per 100 kbp - error rates
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf, with `cs` or `cg` tags)
+  * --reference (optional) - path to the triple reference genomes
+  * --cache (optional) - directory of the packed reference (default: .reference_cache)
+  * -t (optional) - number of worker processes (default: number of CPUs)
+  * --save (optional) - save the errors by trinucleotide context in `<assembler>_error_context.csv`
+
+The triple bacterial reference files for the zymos mock community are available at
+"../../data/references/Zymos_Genomes_triple_chromosomes.fasta"
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+import coverage_depth
+
+REFERENCE_SEQUENCES = os.path.join(os.path.dirname(__file__),
+                                   '..', '..', 'data', 'references', 'Zymos_Genomes_triple_chromosomes.fasta')
+
+CACHE_DIR = '.reference_cache'
+MAX_HOMOPOLYMER = 8  # homopolymers of this length or longer are reported together
+ERROR_TYPES = ['SNPs', 'Insertions', 'Deletions']
+
+CIGAR_OPERATIONS = re.compile(r'(\d+)([MIDNSHP=X])')
+CS_OPERATIONS = re.compile(r'([:*+\-=])([0-9]+|[A-Za-z]+)')
+
+# 2-bit code of each base (4 for bases other than ACGT), for the trinucleotide contexts
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+BASE_CODES[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4)
+CONTEXTS = [a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+
+
+def get_homopolymer_lengths(bases):
+    """
+    :param bases: numpy array with the bases of a sequence
+    :return: numpy array with the length of the homopolymer of each base (capped at 255)
+    """
+    if not len(bases):
+        return np.zeros(0, dtype=np.uint8)
+    run_start = np.ones(len(bases), dtype=bool)
+    run_start[1:] = bases[1:] != bases[:-1]
+    run_lengths = np.diff(np.append(np.flatnonzero(run_start), len(bases)))
+    return np.repeat(np.minimum(run_lengths, 255), run_lengths).astype(np.uint8)
+
+
+def pack_reference(reference_file, packed_prefix):
+    """
+    Saves the single copy of each triple reference as upper case bytes, with the homopolymer length of each base and an
+    index with the offset and length of each reference.
+    :param reference_file: path to the triple reference fasta file
+    :param packed_prefix: path prefix of the `.bases`, `.homopolymers` and `.json` files
+    """
+    index, offset = {}, 0
+    with open(packed_prefix + '.bases.tmp', 'wb') as bases_fh, open(packed_prefix + '.homopolymers.tmp', 'wb') as \
+            homopolymers_fh:
+        for header, seq in utils.fasta_iter(reference_file):
+            bases = seq[:len(seq) // 3].upper().encode()
+            bases_fh.write(bases)
+            homopolymers_fh.write(get_homopolymer_lengths(np.frombuffer(bases, dtype=np.uint8)).tobytes())
+            index[header] = [offset, len(bases)]
+            offset += len(bases)
+
+    for suffix in ('.bases', '.homopolymers'):
+        os.replace(packed_prefix + suffix + '.tmp', packed_prefix + suffix)
+    with open(packed_prefix + '.json', 'w') as fh:
+        json.dump(index, fh)
+
+
+def get_packed_reference(reference_file, cache_dir=CACHE_DIR):
+    """
+    Gets the packed reference from the cache, packing it first if needed.
+    :param reference_file: path to the triple reference fasta file
+    :param cache_dir: path to the cache directory
+    :return: path prefix of the packed reference (see load_packed_reference)
+    """
+    path = os.path.abspath(reference_file)
+    stat = os.stat(path)
+    key = hashlib.md5(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+    packed_prefix = os.path.join(cache_dir, os.path.basename(path) + '.' + key)
+
+    if not os.path.isfile(packed_prefix + '.json'):
+        os.makedirs(cache_dir, exist_ok=True)
+        pack_reference(reference_file, packed_prefix)
+    return packed_prefix
+
+
+def load_packed_reference(packed_prefix):
+    """
+    :param packed_prefix: path prefix of the packed reference (see pack_reference)
+    :return: dict with reference names as keys and tuples of memory-mapped numpy arrays with the bases and homopolymer
+    lengths of the reference as values
+    """
+    with open(packed_prefix + '.json') as fh:
+        index = json.load(fh)
+    if not index:
+        return {}
+    bases = np.memmap(packed_prefix + '.bases', dtype=np.uint8, mode='r')
+    homopolymers = np.memmap(packed_prefix + '.homopolymers', dtype=np.uint8, mode='r')
+    return {reference: (bases[offset:offset + length], homopolymers[offset:offset + length])
+            for reference, (offset, length) in index.items()}
+
+
+def get_operations(tags):
+    """
+    Splits the `cs` (or `cg`) tags of the alignments into operations.
+    :param tags: list with the `cs` or `cg` tag value of each alignment (None if missing)
+    :return: tuple of numpy arrays with the operation (=, X, I, D or M), length, first query base (for X and I with
+    `cs`, 0 otherwise) and alignment index of each operation
+    """
+    operations, lengths, query_bases, alignments = [], [], [], []
+    for i, tag in enumerate(tags):
+        if not tag:
+            continue
+        if tag[0].isdigit():
+            for length, operation in CIGAR_OPERATIONS.findall(tag):
+                operations.append(operation)
+                lengths.append(int(length))
+                query_bases.append(0)
+                alignments.append(i)
+            continue
+        for operator, value in CS_OPERATIONS.findall(tag):
+            if operator == ':':
+                operations.append('=')
+                lengths.append(int(value))
+                query_bases.append(0)
+            elif operator == '=':
+                operations.append('=')
+                lengths.append(len(value))
+                query_bases.append(0)
+            elif operator == '*':
+                operations.append('X')
+                lengths.append(1)
+                query_bases.append(ord(value[1].upper()))
+            else:
+                operations.append('I' if operator == '+' else 'D')
+                lengths.append(len(value))
+                query_bases.append(ord(value[0].upper()) if operator == '+' else 0)
+            alignments.append(i)
+
+    return np.array(operations, dtype='U1'), np.array(lengths, dtype=np.int64), \
+        np.array(query_bases, dtype=np.uint8), np.array(alignments, dtype=np.int64)
+
+
+def get_error_profile(paf_file, packed_prefix):
+    """
+    Counts the errors and aligned reference bases of an assembler by homopolymer length and trinucleotide context.
+    :param paf_file: path to the PAF file
+    :param packed_prefix: path prefix of the packed reference (see get_packed_reference)
+    :return: tuple of pandas DataFrames with Aligned Bases and ERROR_TYPES counts, per homopolymer length (1 to
+    MAX_HOMOPOLYMER) and per trinucleotide context (CONTEXTS)
+    """
+    packed_reference = load_packed_reference(packed_prefix)
+    paf_df = utils.read_paf(paf_file, tags=('cs', 'cg'))
+    paf_df = paf_df[paf_df['Reference'].isin(packed_reference)].reset_index(drop=True)
+
+    operations, lengths, query_bases, alignments = \
+        get_operations(paf_df['cs'].where(paf_df['cs'].notna(), paf_df['cg']).tolist())
+
+    # reference position of each operation: target start plus the reference bases of the previous operations
+    reference_lengths = np.where(np.isin(operations, ['=', 'X', 'M', 'D']), lengths, 0)
+    consumed = np.cumsum(reference_lengths) - reference_lengths
+    first_operation = np.searchsorted(alignments, alignments)
+    positions = paf_df['Target Start'].values.astype(np.int64)[alignments] + consumed - consumed[first_operation]
+    references = paf_df['Reference'].values[alignments] if len(alignments) else np.array([], dtype=object)
+
+    homopolymer_counts = np.zeros((MAX_HOMOPOLYMER, 4), dtype=np.int64)
+    context_counts = np.zeros((len(CONTEXTS), 4), dtype=np.int64)
+
+    for reference, (bases, homopolymers) in packed_reference.items():
+        ref_len = len(bases)
+        on_reference = references == reference
+        if not ref_len or not on_reference.any():
+            continue
+
+        operation, length, position, query_base = \
+            operations[on_reference], lengths[on_reference], positions[on_reference], query_bases[on_reference]
+
+        # aligned bases (with their depth) by homopolymer length and context
+        aligned = np.isin(operation, ['=', 'X', 'M'])
+        starts, ends = coverage_depth.fold_intervals(position[aligned], position[aligned] + length[aligned], ref_len)
+        depth = coverage_depth.get_depth(starts, ends, ref_len)
+        homopolymer_class = np.minimum(homopolymers, MAX_HOMOPOLYMER).astype(np.int64) - 1
+        codes = BASE_CODES[bases].astype(np.int64)
+        context = np.roll(codes, 1) * 16 + codes * 4 + np.roll(codes, -1)
+        context = np.where((np.roll(codes, 1) < 4) & (codes < 4) & (np.roll(codes, -1) < 4), context, -1)
+        homopolymer_counts[:, 0] += np.bincount(homopolymer_class, weights=depth, minlength=MAX_HOMOPOLYMER)\
+            .astype(np.int64)
+        context_counts[:, 0] += np.bincount(context[context >= 0], weights=depth[context >= 0],
+                                            minlength=len(CONTEXTS)).astype(np.int64)
+
+        # errors: one SNP per substituted base, one insertion or deletion per operation
+        snp = operation == 'X'
+        snp_positions = np.repeat(position[snp], length[snp]) + np.arange(length[snp].sum()) - \
+            np.repeat(np.cumsum(length[snp]) - length[snp], length[snp])
+        insertion = operation == 'I'
+        deletion = operation == 'D'
+
+        snp_positions %= ref_len
+        insertion_positions = position[insertion] % ref_len
+        deletion_positions = position[deletion] % ref_len
+
+        # insertions: homopolymer of the adjacent base with the inserted base (or the longest, without sequence)
+        before = (insertion_positions - 1) % ref_len
+        inserted = query_base[insertion]
+        insertion_homopolymers = np.where(
+            inserted == 0, np.maximum(homopolymers[before], homopolymers[insertion_positions]),
+            np.where(inserted == bases[before], homopolymers[before],
+                     np.where(inserted == bases[insertion_positions], homopolymers[insertion_positions], 1)))
+
+        for column, event_positions, event_homopolymers in \
+                [(1, snp_positions, homopolymers[snp_positions]),
+                 (2, insertion_positions, insertion_homopolymers),
+                 (3, deletion_positions, homopolymers[deletion_positions])]:
+            event_class = np.minimum(event_homopolymers, MAX_HOMOPOLYMER).astype(np.int64) - 1
+            homopolymer_counts[:, column] += np.bincount(event_class, minlength=MAX_HOMOPOLYMER)
+            event_context = context[event_positions]
+            context_counts[:, column] += np.bincount(event_context[event_context >= 0], minlength=len(CONTEXTS))
+
+    columns = ['Aligned Bases'] + ERROR_TYPES
+    df_homopolymers = pd.DataFrame(homopolymer_counts, columns=columns)
+    df_homopolymers.insert(0, 'Homopolymer Length', [str(length) for length in range(1, MAX_HOMOPOLYMER)] +
+                           [f'{MAX_HOMOPOLYMER}+'])
+    df_contexts = pd.DataFrame(context_counts, columns=columns)
+    df_contexts.insert(0, 'Context', CONTEXTS)
+    return add_rates(df_homopolymers), add_rates(df_contexts)
+
+
+def add_rates(df):
+    """
+    :param df: pandas DataFrame with Aligned Bases and ERROR_TYPES counts
+    :return: pandas DataFrame with the error rates per 100 kbp of aligned bases added
+    """
+    for error_type in ERROR_TYPES:
+        df[error_type + ' per 100 kbp'] = df[error_type] / df['Aligned Bases'].clip(lower=1) * 100000
+    return df
+
+
+def _get_error_profile(task):
+    return get_error_profile(*task)
+
+
+def get_error_profiles(mappings, packed_prefix, threads=None):
+    """
+    Gets the error profile of several assemblers, one PAF file per worker process.
+    :param mappings: list of paf files
+    :param packed_prefix: path prefix of the packed reference (see get_packed_reference)
+    :param threads: number of worker processes (default: number of CPUs)
+    :return: dict with paf files as keys and get_error_profile results as values
+    """
+    tasks = [(paf_file, packed_prefix) for paf_file in mappings]
+    if len(tasks) <= 1 or threads == 1:
+        return {paf_file: _get_error_profile(task) for paf_file, task in zip(mappings, tasks)}
+
+    with Pool(threads) as pool:
+        return dict(zip(mappings, pool.map(_get_error_profile, tasks, chunksize=1)))
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--reference', type=str, default=REFERENCE_SEQUENCES, dest='reference',
+                        help='Path to the triple reference genomes (default: Zymos_Genomes_triple_chromosomes.fasta '
+                             'in the data folder).')
+    parser.add_argument('--cache', type=str, default=CACHE_DIR, dest='cache_dir',
+                        help='Directory of the packed reference.')
+    parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes.')
+    parser.add_argument('--save', action='store_true', dest='save',
+                        help='Save a csv table with the errors by trinucleotide context, per assembler.')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    mappings = manifest.list_files(args.mappings, '.paf')
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    with profiling.stage('get_packed_reference'):
+        packed_prefix = get_packed_reference(args.reference, args.cache_dir)
+
+    with profiling.stage('get_error_profiles', items=len(mappings)):
+        profiles = get_error_profiles(mappings, packed_prefix, args.threads)
+
+    for paf_file in mappings:
+        assembler = utils.get_assember_name(paf_file)
+        df_homopolymers, df_contexts = profiles[paf_file]
+
+        print('\n\n------' + assembler + '------\n')
+        print(df_homopolymers.to_csv(index=False, float_format='%.2f'), end='')
+
+        if args.save:
+            df_contexts.to_csv(assembler + '_error_context.csv', index=False, float_format='%.2f')
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
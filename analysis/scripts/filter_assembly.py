@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Filters assemblies for a minimum contig length, for one or more length thresholds in a single read of each assembly.
+
+For each assembly and threshold, the contigs with a length equal or over the threshold are written to
+`<output directory>/filtered_<threshold>/filtered_<assembly file name>`, alongside a samtools-compatible
+length index (`.fai`) of the filtered contigs.
+Contig headers are trimmed at the first whitespace, as in the remaining analysis scripts.
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Assembly files (ending in *.fasta)
+  * -m - one or more minimum contig lengths (default: 1000)
+  * -o (optional) - output directory (default: current directory)
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import argparse
+
+#import commonly used functions from utils.py
+import utils
+
+
+def filter_assembly(assembly_file, min_lengths, output_dir='.'):
+    """
+    Writes the contigs of an assembly over each minimum length to a separate fasta file, with its length index.
+    :param assembly_file: path to the assembly fasta file
+    :param min_lengths: list of minimum contig lengths
+    :param output_dir: path to the output directory
+    :return: dict with minimum lengths as keys and number of contigs written as values
+    """
+    min_lengths = sorted(set(min_lengths))
+    filename = 'filtered_' + os.path.basename(assembly_file)
+
+    outputs = {}
+    for min_length in min_lengths:
+        directory = os.path.join(output_dir, 'filtered_' + str(min_length))
+        os.makedirs(directory, exist_ok=True)
+        fasta_path = os.path.join(directory, filename)
+        outputs[min_length] = {'fasta': open(fasta_path, 'w'), 'index': open(fasta_path + '.fai', 'w'),
+                               'offset': 0, 'contigs': 0}
+
+    for header, seq in utils.fasta_iter(assembly_file):
+        record_header = '>' + header + '\n'
+        for min_length in min_lengths:
+            if len(seq) < min_length:
+                break  # thresholds are sorted
+            output = outputs[min_length]
+            output['fasta'].write(record_header + seq + '\n')
+
+            # name, length, offset of the sequence, bases per line, bytes per line
+            seq_offset = output['offset'] + len(record_header.encode())
+            output['index'].write('\t'.join([header, str(len(seq)), str(seq_offset), str(len(seq)),
+                                             str(len(seq) + 1)]) + '\n')
+            output['offset'] = seq_offset + len(seq) + 1
+            output['contigs'] += 1
+
+    for output in outputs.values():
+        output['fasta'].close()
+        output['index'].close()
+
+    return {min_length: output['contigs'] for min_length, output in outputs.items()}
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', nargs='+', type=str, help='Assembly files (ending in *.fasta).')
+    parser.add_argument('-m', nargs='+', type=int, default=[1000], dest='min_lengths',
+                        help='Minimum contig lengths.')
+    parser.add_argument('-o', type=str, default='.', dest='output_dir', help='Output directory.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    print(','.join(['Assembler'] + ['contigs>={}bp'.format(min_length) for min_length in sorted(set(args.min_lengths))]))
+
+    for assembly_file in args.assemblies:
+        contigs = filter_assembly(assembly_file, args.min_lengths, args.output_dir)
+        print(','.join([utils.get_assember_name(assembly_file)] + [str(contigs[min_length])
+                                                                   for min_length in sorted(contigs)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Discovery and validation of the assembly and mapping files of a results tree, persisted as a JSON manifest.
+
+The assembly (*.fasta) and mapping (*.paf) files are listed once (optionally recursively) and indexed by
+(sample, assembler), from the file name (`[filtered_]<sample>_<assembler>`). Each assembly is paired with the mapping of
+the same sample and assembler by index lookup. The group, the number at the end of the parent directory name, if any
+(ex: the minimum contig length in `filtered_1000/` and `paf_files/1000/`), is only used to pair the files when there are
+several for the same sample and assembler. The size and MD5 checksum of every file (and of the reference, if given) are
+obtained concurrently with a pool of threads.
+
+The manifest is saved as JSON. When it is rebuilt, the checksums of the files with the same size and modification
+time as in the previous manifest are reused, so later runs only hash new or changed files.
+
+This script will output to the command line:
+  * Group, Sample, Assembler - pairing key (the group only pairs several files of the same sample and assembler)
+  * Assembly, Mapping - paired files (or "missing")
+  * Assembly size, Mapping size - file sizes in bytes
+  * Status - OK, missing pair or empty file
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the assembly files (ending in *.fasta)
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * -o (optional) - path to the manifest file (default: manifest.json)
+  * -t (optional) - number of threads (default: 8)
+  * --reference (optional) - path to the triple reference genomes, to be included in the manifest
+  * --recursive (optional) - also look for files in subdirectories
+  * --no-checksum (optional) - do not compute the MD5 checksums
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+#import commonly used functions from utils.py
+import utils
+
+MANIFEST_VERSION = 1
+THREADS = 8
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def list_files(directory, extension, recursive=False):
+    """
+    Lists the files of a directory with a given extension, skipping the unmapped contigs fasta files.
+    :param directory: path to the directory
+    :param extension: string with file extension (ex: '.fasta')
+    :param recursive: Bool to also list the files in subdirectories
+    :return: sorted list of file paths
+    """
+    files = []
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir() and recursive:
+                    pending.append(entry.path)
+                elif entry.is_file() and entry.name.endswith(extension) and not entry.name.startswith('unmapped_'):
+                    files.append(entry.path)
+    return sorted(files)
+
+
+def get_key(path):
+    """
+    Gets the pairing key of an assembly or mapping file.
+    :param path: path to the file
+    :return: tuple with group, sample and assembler names
+    """
+    group = re.search(r'(\d*)$', os.path.basename(os.path.dirname(os.path.abspath(path)))).group(1)
+    return group, utils.get_sample_name(path), utils.get_assember_name(path)
+
+
+def pair_files(assembly_files, mapping_files):
+    """
+    Pairs the assembly and mapping files by sample and assembler. When there are several files for the same sample and
+    assembler (ex: one per minimum contig length, with --recursive), they are paired by group.
+    :param assembly_files: list of assembly files
+    :param mapping_files: list of mapping files
+    :return: list of (group, sample, assembler, assembly, mapping) tuples, with None for the missing file of the
+    unmatched files
+    """
+    files = {}
+    for kind, paths in enumerate((assembly_files, mapping_files)):
+        for path in paths:
+            group, sample, assembler = get_key(path)
+            files.setdefault((sample, assembler), ([], []))[kind].append((group, path))
+
+    pairs = []
+    for (sample, assembler), (assemblies, mappings) in sorted(files.items()):
+        if len(assemblies) == 1 and len(mappings) == 1:
+            (group, assembly), (mapping_group, mapping) = assemblies[0], mappings[0]
+            pairs.append((group or mapping_group, sample, assembler, assembly, mapping))
+            continue
+
+        assembly_groups, mapping_groups = dict(assemblies), dict(mappings)
+        for group in sorted(set(assembly_groups) | set(mapping_groups)):
+            pairs.append((group, sample, assembler, assembly_groups.get(group), mapping_groups.get(group)))
+    return pairs
+
+
+def get_md5(path):
+    """
+    :param path: path to the file
+    :return: string with the MD5 checksum of the file
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_file_record(path, previous=None, checksum=True):
+    """
+    Gets the size, modification time and checksum of a file, reusing the previous checksum if the file is unchanged.
+    :param path: path to the file
+    :param previous: optional dict with the previous record of the file
+    :param checksum: Bool to compute the MD5 checksum
+    :return: dict with size, mtime_ns and md5 (None if not computed)
+    """
+    stat = os.stat(path)
+    record = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'md5': None}
+    if previous and previous['size'] == record['size'] and previous['mtime_ns'] == record['mtime_ns']:
+        record['md5'] = previous['md5']
+    if checksum and record['md5'] is None:
+        record['md5'] = get_md5(path)
+    return record
+
+
+def load_manifest(manifest_file):
+    """
+    :param manifest_file: path to the manifest file
+    :return: dict with the manifest, or None if the file doesn't exist or has another version
+    """
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as fh:
+        manifest = json.load(fh)
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def build_manifest(assemblies_dir, mappings_dir, reference_file=None, recursive=False, threads=THREADS,
+                   checksum=True, previous=None):
+    """
+    Discovers, pairs and validates the assembly and mapping files.
+    :param assemblies_dir: path to the assembly files
+    :param mappings_dir: path to the mapping files
+    :param reference_file: optional path to the triple reference fasta file
+    :param recursive: Bool to also look for files in subdirectories
+    :param threads: number of threads to stat and checksum the files
+    :param checksum: Bool to compute the MD5 checksums
+    :param previous: optional dict with a previous manifest, to reuse the checksums of unchanged files
+    :return: dict with the manifest
+    """
+    assemblies = list_files(assemblies_dir, '.fasta', recursive)
+    mappings = list_files(mappings_dir, '.paf', recursive)
+
+    paths = sorted(set(assemblies) | set(mappings) | ({reference_file} if reference_file else set()))
+    previous_files = previous['files'] if previous else {}
+    with ThreadPoolExecutor(threads) as pool:
+        records = pool.map(lambda path: get_file_record(path, previous_files.get(path), checksum), paths)
+        files = dict(zip(paths, records))
+
+    entries = []
+    for group, sample, assembler, assembly, mapping in pair_files(assemblies, mappings):
+        if assembly is None or mapping is None:
+            status = 'missing ' + ('assembly' if assembly is None else 'mapping')
+        elif files[assembly]['size'] == 0 or files[mapping]['size'] == 0:
+            status = 'empty ' + ('assembly' if files[assembly]['size'] == 0 else 'mapping')
+        else:
+            status = 'OK'
+        entries.append({'group': group, 'sample': sample, 'assembler': assembler, 'assembly': assembly,
+                        'mapping': mapping, 'status': status})
+
+    return {'version': MANIFEST_VERSION, 'assemblies': os.path.abspath(assemblies_dir),
+            'mappings': os.path.abspath(mappings_dir), 'reference': reference_file, 'files': files,
+            'entries': entries}
+
+
+def save_manifest(manifest, manifest_file):
+    """
+    :param manifest: dict with the manifest (see build_manifest)
+    :param manifest_file: path to the manifest file
+    """
+    with open(manifest_file, 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+
+
+def get_manifest(assemblies_dir, mappings_dir, manifest_file=None, reference_file=None, recursive=False,
+                 threads=THREADS, checksum=True):
+    """
+    Builds the manifest of the assembly and mapping files, reusing and updating a persisted manifest if given.
+    :param assemblies_dir: path to the assembly files
+    :param mappings_dir: path to the mapping files
+    :param manifest_file: optional path to the manifest file
+    :param reference_file: optional path to the triple reference fasta file
+    :param recursive: Bool to also look for files in subdirectories
+    :param threads: number of threads to stat and checksum the files
+    :param checksum: Bool to compute the MD5 checksums
+    :return: dict with the manifest
+    """
+    previous = load_manifest(manifest_file) if manifest_file else None
+    manifest = build_manifest(assemblies_dir, mappings_dir, reference_file, recursive, threads, checksum, previous)
+    if manifest_file:
+        save_manifest(manifest, manifest_file)
+    return manifest
+
+
+def get_paired_files(assemblies_dir, mappings_dir, manifest_file=None):
+    """
+    Gets the validated pairs of assembly and mapping files, skipping (and reporting) the pairs with an empty file.
+    Exits with an error listing the unmatched files, if any. Checksums are only computed if the manifest is persisted.
+    :param assemblies_dir: path to the assembly files
+    :param mappings_dir: path to the mapping files
+    :param manifest_file: optional path to the manifest file
+    :return: tuple with the lists of paired assembly and mapping files
+    """
+    manifest = get_manifest(assemblies_dir, mappings_dir, manifest_file, checksum=manifest_file is not None)
+
+    assemblies, mappings, unmatched = [], [], []
+    for entry in manifest['entries']:
+        if entry['status'] == 'OK':
+            assemblies.append(entry['assembly'])
+            mappings.append(entry['mapping'])
+        elif entry['status'].startswith('missing'):
+            unmatched.append(f'{entry["assembly"] or entry["mapping"]}: {entry["status"]}')
+        else:
+            print(f'Skipping {entry["sample"]} {entry["assembler"]}: {entry["status"]}', file=sys.stderr)
+
+    if unmatched:
+        sys.exit('Unmatched assembly and mapping files:\n' + '\n'.join(unmatched))
+    return assemblies, mappings
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('-o', type=str, default='manifest.json', dest='manifest_file', help='Path to the manifest.')
+    parser.add_argument('-t', type=int, default=THREADS, dest='threads', help='Number of threads.')
+    parser.add_argument('--reference', type=str, dest='reference', help='Path to the triple reference genomes.')
+    parser.add_argument('--recursive', action='store_true', dest='recursive',
+                        help='Also look for files in subdirectories.')
+    parser.add_argument('--no-checksum', action='store_false', dest='checksum',
+                        help='Do not compute the MD5 checksums.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    manifest = get_manifest(args.assemblies, args.mappings, args.manifest_file, args.reference, args.recursive,
+                            args.threads, args.checksum)
+
+    print(','.join(['Group', 'Sample', 'Assembler', 'Assembly', 'Mapping', 'Assembly size', 'Mapping size', 'Status']))
+    for entry in manifest['entries']:
+        print(','.join([entry['group'], entry['sample'], entry['assembler'],
+                        entry['assembly'] or 'missing', entry['mapping'] or 'missing',
+                        str(manifest['files'][entry['assembly']]['size']) if entry['assembly'] else '',
+                        str(manifest['files'][entry['mapping']]['size']) if entry['mapping'] else '',
+                        entry['status']]))
+
+
+if __name__ == '__main__':
+    main()
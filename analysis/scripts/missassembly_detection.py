@@ -30,91 +30,177 @@ https://github.com/cimendes
 
 import sys
 import math
+from array import array
+import numpy as np
 
 #import commonly used functions from utils.py
 import utils
 
+# one record per alignment block, with contig and reference as indexes in AlignmentBlocks.contigs/references
+BLOCK_DTYPE = np.dtype([('contig', np.int32),
+                        ('query start', np.int32),
+                        ('query end', np.int32),
+                        ('strand', np.int8),  # 1 for '+', -1 for '-'
+                        ('reference', np.int32),
+                        ('target start', np.int32),
+                        ('target end', np.int32),
+                        ('exact matches', np.int32),
+                        ('snp', np.int32)])
 
-def check_missassemblies(mappings):
-    """
-    :param df: Pandas Dataframe with stats for each contig
-    :param mappings: list of paf files
-    :return: dictionary
-    """
-
-    missmatch_dict = {}
-
-    for paf_file in mappings:
-        assembler = utils.get_assember_name(paf_file)
-
-        with open(paf_file, 'r') as paf_fh:
-            for line in paf_fh:
-                line = line.split()
-
-                contig, contig_len, query_start, query_end, strand = line[0:5]
-                reference, reference_len, target_start, target_end = line[5:9]
 
-                # a non-perfect alignment or a different number of residue matches
-                if int(line[11]) != 0 or line[1] != line[9]:
+class AlignmentBlocks:
+    """
+    Compact store of the alignment blocks of an assembler, grouped by contig.
 
-                    cigar = line[-1]
-                    exact_matches, snp, indel = utils.parse_cs(cigar)  # TODO - gap size to be adjusted by param
+    The blocks are kept in a structured numpy array (BLOCK_DTYPE), stably sorted by contig so the blocks of each
+    contig are contiguous and in PAF order: the blocks of contig i are blocks[offsets[i]:offsets[i+1]].
+    The signed indel sizes (+ for insertions, - for deletions) of all blocks are kept in a single array, with the
+    indels of block j in indels[indel_offsets[j]:indel_offsets[j+1]].
+    """
 
-                    contig_dict = {'contig length': contig_len,
-                                   'query start': int(query_start),
-                                   'query end': int(query_end),
-                                   'strand': strand,
-                                   'reference': reference,
-                                   'reference length': int(reference_len)/3,
-                                   'target start': utils.adjust_reference_coord(int(target_start),
-                                                                                int(reference_len)/3),
-                                   'target end': utils.adjust_reference_coord(int(target_end),
-                                                                              int(reference_len)/3),
-                                   'exact matches': exact_matches,
-                                   'snp': snp,
-                                   'indels': indel}
+    __slots__ = ('contigs', 'contig_lengths', 'references', 'reference_lengths', 'blocks', 'offsets', 'indels',
+                 'indel_offsets')
+
+    def __init__(self, contigs, contig_lengths, references, reference_lengths, blocks, indels, indel_offsets):
+        order = np.argsort(blocks['contig'], kind='stable')
+        indel_counts = np.diff(indel_offsets)[order]
+
+        # reorder the indels with their blocks
+        self.indel_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(indel_counts, out=self.indel_offsets[1:])
+        self.indels = indels[np.repeat(indel_offsets[:-1][order], indel_counts) +
+                             np.arange(self.indel_offsets[-1]) - np.repeat(self.indel_offsets[:-1], indel_counts)]
+
+        self.contigs = contigs
+        self.contig_lengths = contig_lengths
+        self.references = references
+        self.reference_lengths = reference_lengths
+        self.blocks = blocks[order]
+        self.offsets = np.searchsorted(self.blocks['contig'], np.arange(len(contigs) + 1))
+
+    def __len__(self):
+        return len(self.contigs)
+
+    def __iter__(self):
+        """
+        :return: tuples with contig index, contig name and view of its alignment blocks (yield)
+        """
+        for i, contig in enumerate(self.contigs):
+            yield i, contig, self.blocks[self.offsets[i]:self.offsets[i + 1]]
+
+    def block_counts(self):
+        """
+        :return: numpy array with the number of alignment blocks of each contig
+        """
+        return np.diff(self.offsets)
+
+    def get_block(self, j):
+        """
+        Gets an alignment block as a dict, with names instead of indexes (for printing).
+        :param j: int with block index
+        :return: dict with the block values
+        """
+        block = self.blocks[j]
+        return {'contig length': int(self.contig_lengths[block['contig']]),
+                'query start': int(block['query start']),
+                'query end': int(block['query end']),
+                'strand': '+' if block['strand'] > 0 else '-',
+                'reference': self.references[block['reference']],
+                'reference length': int(self.reference_lengths[block['reference']]),
+                'target start': int(block['target start']),
+                'target end': int(block['target end']),
+                'exact matches': int(block['exact matches']),
+                'snp': int(block['snp']),
+                'indels': self.indels[self.indel_offsets[j]:self.indel_offsets[j + 1]].tolist()}
+
+
+def read_alignment_blocks(paf_file):
+    """
+    Reads the non-perfect alignment blocks of a PAF file, with the target coordinates adjusted to the triple reference.
+    :param paf_file: path to the PAF file
+    :return: AlignmentBlocks
+    """
+    contig_ids, contig_lengths = {}, array('q')
+    reference_ids, reference_lengths = {}, array('q')
+    columns = {name: array('q') for name in BLOCK_DTYPE.names}
+    indels, indel_offsets = array('i'), array('q', [0])
+
+    with open(paf_file, 'r') as paf_fh:
+        for line in paf_fh:
+            line = line.split()
+
+            contig, contig_len, query_start, query_end, strand = line[0:5]
+            reference, reference_len, target_start, target_end = line[5:9]
+
+            # a non-perfect alignment or a different number of residue matches
+            if int(line[11]) != 0 or line[1] != line[9]:
+
+                cigar = line[-1]
+                exact_matches, snp, indel = utils.parse_cs(cigar)  # TODO - gap size to be adjusted by param
+
+                if contig not in contig_ids:
+                    contig_ids[contig] = len(contig_ids)
+                    contig_lengths.append(int(contig_len))
+                if reference not in reference_ids:
+                    reference_ids[reference] = len(reference_ids)
+                    reference_lengths.append(int(reference_len) // 3)
+                ref_len = reference_lengths[reference_ids[reference]]
+
+                columns['contig'].append(contig_ids[contig])
+                columns['query start'].append(int(query_start))
+                columns['query end'].append(int(query_end))
+                columns['strand'].append(1 if strand == '+' else -1)
+                columns['reference'].append(reference_ids[reference])
+                columns['target start'].append(utils.adjust_reference_coord(int(target_start), ref_len))
+                columns['target end'].append(utils.adjust_reference_coord(int(target_end), ref_len))
+                columns['exact matches'].append(exact_matches)
+                columns['snp'].append(snp)
+
+                indels.extend(int(size) for size in indel)
+                indel_offsets.append(len(indels))
+
+    blocks = np.empty(len(columns['contig']), dtype=BLOCK_DTYPE)
+    for name, values in columns.items():
+        values = np.frombuffer(values, dtype=np.int64) if len(values) else np.empty(0, dtype=np.int64)
+        # the assignment would silently wrap the values that don't fit in the field
+        limits = np.iinfo(BLOCK_DTYPE[name])
+        if len(values) and (values.min() < limits.min or values.max() > limits.max):
+            raise ValueError(f'{paf_file}: {name} out of the range of {BLOCK_DTYPE[name]} '
+                             f'({values.min()} to {values.max()})')
+        blocks[name] = values
+
+    return AlignmentBlocks(list(contig_ids), np.frombuffer(contig_lengths, dtype=np.int64),
+                           list(reference_ids), np.frombuffer(reference_lengths, dtype=np.int64), blocks,
+                           np.frombuffer(indels, dtype=np.int32), np.frombuffer(indel_offsets, dtype=np.int64))
 
-                    if assembler not in missmatch_dict.keys():
-                        missmatch_dict[assembler] = {contig: [contig_dict]}
-                    else:
-                        if contig in missmatch_dict[assembler].keys():
-                            missmatch_dict[assembler][contig].append(contig_dict)
-                        else:
-                            missmatch_dict[assembler][contig] = [contig_dict]
 
-    return missmatch_dict
+def check_missassemblies(mappings):
+    """
+    :param mappings: list of paf files
+    :return: dictionary with assembler names as keys and AlignmentBlocks as values
+    """
+    return {utils.get_assember_name(paf_file): read_alignment_blocks(paf_file) for paf_file in mappings}
 
 
 def evaluate_misassembled_contigs(mis_dict):
     for assembler in mis_dict.keys():
-        for contig in mis_dict[assembler].keys():
-            if len(mis_dict[assembler][contig]) > 1:
+        alignment_blocks = mis_dict[assembler]
+        for i, contig, blocks in alignment_blocks:
+            if len(blocks) > 1:
                 print(contig)
-                num_alignment_blocks = len(mis_dict[assembler][contig])
-                aligned_bases = 0
-                contig_len = int(mis_dict[assembler][contig][0]['contig length'])
-                reference = set()
-                strands = set()
-                blocks_to_order = []
-                for alignment_block in mis_dict[assembler][contig]:
-                    print(alignment_block)
-                    aligned_bases += (alignment_block['query end'] - alignment_block['query start'])
-                    reference.add(alignment_block['reference'])
-                    strands.add(alignment_block['strand'])
-                    blocks_to_order.append(alignment_block['query start'])
-                    # get order
+                contig_len = int(alignment_blocks.contig_lengths[i])
+                for j in range(alignment_blocks.offsets[i], alignment_blocks.offsets[i + 1]):
+                    print(alignment_blocks.get_block(j))
+                aligned_bases = int((blocks['query end'] - blocks['query start']).sum())
                 if not math.isclose(aligned_bases, contig_len, rel_tol=50):  # TODO - Hardcoded!
                     print("has gaps")
-                if len(reference) > 1:
+                if len(np.unique(blocks['reference'])) > 1:
                     print("Difference references!")
-                if len(strands) > 1:
+                if len(np.unique(blocks['strand'])) > 1:
                     print("Different strands!")
                 # get order of blocks
-                blocks_ordered = sorted(blocks_to_order)
-                order = []
-                for item in blocks_to_order:
-                    order.append(blocks_ordered.index(item))
-                print(order)
+                order = np.argsort(np.argsort(blocks['query start'], kind='stable'), kind='stable')
+                print(order.tolist())
 
                 ##### CHECK ORDER OF ASSEMBLY BLOCKS! FROM ORDER; EVALUATE TYPE OF MISASSEMBLY
                 #### CHECK STRANDS OF ASSEMBLY BLOCKS
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Fast scanner for large (read-level) PAF files, such as the mapping of the read dataset to each assembly.
+
+Each PAF file is memory-mapped and split into byte ranges aligned to line boundaries, which are scanned in parallel
+by a pool of worker processes. Each range is read in blocks of bounded size, whose tab and line break positions are
+found with numpy, and only the needed columns (query name, query start and end, and target name) are loaded from the
+raw bytes, 8 bytes at a time, without splitting the lines in Python. The partial results of each range are merged
+in order, so a read with alignments on both sides of a range boundary is counted only once.
+
+Mapped reads are counted as the number of distinct consecutive query names, as minimap2 writes all the alignments
+of a read together. Paired-end mates share the same name, so each pair counts as one mapped read.
+
+For each PAF file, this script will output to the command line:
+  * Assembler - assembler name (from paf file name)
+  * Mapped reads - number of reads with at least one alignment
+  * Alignments - number of alignment records
+  * Aligned bases - sum of the query spans of all alignment records
+  * Targets - number of target sequences (contigs or references) with mapped reads
+The scanning throughput of all the files (MB/s) is printed to stderr.
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the read mappings (ending in *.paf)
+  * -t (optional) - number of worker processes (default: number of CPUs)
+  * --range-size (optional) - size of the byte ranges distributed to the workers, in MB (default: the size of the
+    files divided by the number of workers, up to 256 MB)
+  * --save (optional) - save a `<assembler>_reads_per_target.csv` table with the mapped reads per target sequence
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import mmap
+import glob
+import time
+import argparse
+import numpy as np
+from collections import Counter
+from multiprocessing import Pool
+
+#import commonly used functions from utils.py
+import utils
+
+BLOCK_SIZE = 4 * 1024 * 1024  # maximum number of bytes parsed at once by each worker (the arrays stay in cache)
+RANGE_SIZE = 256 * 1024 * 1024  # maximum size of the byte ranges distributed to the workers
+
+# masks of the lower 0 to 8 bytes of a word, and the word with 8 '0' digits
+BYTE_MASKS = np.array([(1 << (8 * n)) - 1 for n in range(9)], dtype=np.uint64)
+ZEROS = np.uint64(0x3030303030303030)
+
+
+def get_byte_ranges(paf_file, range_size=RANGE_SIZE):
+    """
+    Splits a file into byte ranges of about range_size bytes, each starting at the beginning of a line.
+    :param paf_file: path to the PAF file
+    :param range_size: target size of each range in bytes
+    :return: list of (start, end) tuples
+    """
+    file_size = os.path.getsize(paf_file)
+    if file_size == 0:
+        return []
+
+    ranges = []
+    with open(paf_file, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < file_size:
+            end = mm.find(b'\n', min(start + range_size, file_size) - 1)
+            end = file_size if end == -1 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_block(mm, start, end):
+    """
+    Reads a block of a memory-mapped file, padded with 8 zero bytes on each side (see get_words).
+    :param mm: mmap of the file
+    :param start: start of the block
+    :param end: end (exclusive) of the block
+    :return: numpy uint8 array with the padded block
+    """
+    padded = np.zeros(end - start + 16, dtype=np.uint8)
+    padded[8:-8] = np.frombuffer(mm, dtype=np.uint8, count=end - start, offset=start)
+    return padded
+
+
+def get_words(padded):
+    """
+    Views a padded block as the (unaligned, little-endian) 8-byte word starting at each byte, so a field of up to 8
+    bytes is loaded at once. Word k starts at byte k - 8 of the block.
+    :param padded: numpy uint8 array with the padded block (see read_block)
+    :return: numpy uint64 array with one word per byte of the block, plus 9
+    """
+    return np.ndarray((len(padded) - 7,), dtype='<u8', buffer=padded, strides=(1,))
+
+
+def pack_fields(words, starts, ends):
+    """
+    Packs byte fields into rows of 8-byte words, padded with zeros (not found in PAF fields), to be compared with
+    whole-word operations.
+    :param words: numpy uint64 array with the words of the block (see get_words)
+    :param starts: numpy array with the start of each field
+    :param ends: numpy array with the end (exclusive) of each field
+    :return: 2D numpy uint64 array with one field per row
+    """
+    offsets = 8 * np.arange(-(-int((ends - starts).max(initial=0)) // 8))
+    remaining = np.clip((ends - starts)[:, None] - offsets, 0, 8)
+    # the words past the end of the shorter fields are masked out
+    return words[np.minimum(starts[:, None] + offsets + 8, len(words) - 1)] & BYTE_MASKS[remaining]
+
+
+def unpack_field(packed):
+    """
+    :param packed: numpy uint64 array with a packed field (see pack_fields)
+    :return: bytes with the field
+    """
+    return packed.astype('<u8').tobytes().rstrip(b'\0')
+
+
+def parse_integers(words, starts, ends):
+    """
+    Parses decimal integer fields, 8 digits at a time: the digits are loaded in a word, aligned to its end, and
+    combined pairwise with three multiplications (SWAR).
+    :param words: numpy uint64 array with the words of the block (see get_words)
+    :param starts: numpy array with the start of each field
+    :param ends: numpy array with the end (exclusive) of each field
+    :return: numpy uint64 array with the value of each field
+    """
+    values = np.zeros(len(starts), dtype=np.uint64)
+    for chunk in range(-(-int((ends - starts).max(initial=0)) // 8)):
+        digits = np.clip(ends - starts - 8 * chunk, 0, 8)
+        # the bytes before the digits (in the lower bytes of the little-endian word) are set to '0'
+        leading = BYTE_MASKS[8 - digits]
+        word = (words[np.maximum(ends - 8 * chunk, 0)] & ~leading) | (ZEROS & leading)
+        word = word - ZEROS
+        word = (word * np.uint64(10) + (word >> np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+        word = (word * np.uint64(100) + (word >> np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+        word = (word * np.uint64(10000) + (word >> np.uint64(32))) & np.uint64(0x00000000FFFFFFFF)
+        values += word * np.uint64(10 ** (8 * chunk))
+    return values
+
+
+def get_changes(packed, previous):
+    """
+    :param packed: 2D numpy uint64 array with one field per row (see pack_fields)
+    :param previous: bytes with the field before the first row (None if there is none)
+    :return: numpy boolean array, True for the rows different from the previous one
+    """
+    changes = np.empty(len(packed), dtype=bool)
+    changes[1:] = (packed[1:] != packed[:-1]).any(axis=1)
+    if len(packed):
+        changes[0] = unpack_field(packed[0]) != previous
+    return changes
+
+
+def count_fields(packed):
+    """
+    Counts the distinct packed fields. The rows are hashed to a single word to be counted with a 1D sort, and
+    compared with the first row of their hash (a collision falls back to comparing the whole rows).
+    :param packed: 2D numpy uint64 array with one field per row (see pack_fields)
+    :return: Counter with the bytes of each distinct field as keys and its number of rows as values
+    """
+    hashes = np.zeros(len(packed), dtype=np.uint64)
+    for column in packed.T:
+        hashes = (hashes ^ column) * np.uint64(0x100000001B3)
+    unique, counts = np.unique(hashes, return_counts=True)
+    inverse = np.searchsorted(unique, hashes)
+    # first row of each hash (the last assignment of repeated indexes is kept)
+    first = np.empty(len(unique), dtype=np.int64)
+    first[inverse[::-1]] = np.arange(len(packed) - 1, -1, -1)
+    if (packed != packed[first[inverse]]).any():
+        rows = np.ascontiguousarray(packed).view(np.dtype((np.void, 8 * packed.shape[1]))).ravel()
+        _, first, counts = np.unique(rows, return_index=True, return_counts=True)
+    return Counter({unpack_field(packed[row]): int(count) for row, count in zip(first, counts)})
+
+
+def scan_block(padded, previous_key):
+    """
+    Scans a block of complete PAF lines. The positions of the line breaks and tabs are found with numpy, and only
+    the query name, query start and end, and target name columns are loaded from the raw bytes.
+    :param padded: numpy uint8 array with the padded block (see read_block)
+    :param previous_key: (query, target) tuple of the last alignment before the block (None if there is none)
+    :return: dict with the first and last (query, target) keys, mapped reads, alignment records, aligned bases and
+    Counter with mapped reads per target
+    """
+    data = padded[8:-8]
+    # tabs and line breaks are the only bytes of a PAF file below 11, and are found in a single pass
+    separators = np.flatnonzero(data < 11)
+    line_breaks = np.flatnonzero(data[separators] == ord('\n'))
+    if len(data) and data[-1] != ord('\n'):
+        separators = np.append(separators, len(data))
+        line_breaks = np.append(line_breaks, len(separators) - 1)
+
+    # first 6 tabs of each line (7 fields, the rest are not parsed)
+    first_tabs = np.concatenate(([0], line_breaks[:-1] + 1))
+    valid = line_breaks - first_tabs >= 6
+    line_starts = np.concatenate(([0], separators[line_breaks[:-1]] + 1))[valid]
+    line_tabs = separators[first_tabs[valid, None] + np.arange(6)]
+
+    words = get_words(padded)
+    targets = pack_fields(words, line_tabs[:, 4] + 1, line_tabs[:, 5])
+    # unmapped reads (--paf-no-hit)
+    if len(line_starts):
+        mapped = targets[:, 0] != ord('*')
+        if not mapped.all():
+            line_starts, line_tabs, targets = line_starts[mapped], line_tabs[mapped], targets[mapped]
+    if not len(line_starts):
+        return {'first': None, 'last': previous_key, 'reads': 0, 'records': 0, 'aligned_bases': 0,
+                'targets': Counter()}
+
+    reads = pack_fields(words, line_starts, line_tabs[:, 0])
+    aligned_bases = parse_integers(words, line_tabs[:, 2] + 1, line_tabs[:, 3]).sum() - \
+        parse_integers(words, line_tabs[:, 1] + 1, line_tabs[:, 2]).sum()
+
+    read_changes = get_changes(reads, previous_key[0] if previous_key else None)
+    key_changes = read_changes | get_changes(targets, previous_key[1] if previous_key else None)
+
+    return {'first': (unpack_field(reads[0]), unpack_field(targets[0])),
+            'last': (unpack_field(reads[-1]), unpack_field(targets[-1])),
+            'reads': int(read_changes.sum()), 'records': len(reads), 'aligned_bases': int(aligned_bases),
+            'targets': count_fields(targets[key_changes])}
+
+
+def scan_range(task):
+    """
+    Scans a byte range of a PAF file, in blocks of at most BLOCK_SIZE bytes (see scan_block).
+    :param task: tuple with path to the PAF file, start and end of the range
+    :return: dict with the first and last (query, target) keys, mapped reads, alignment records, aligned bases and
+    Counter with mapped reads per target
+    """
+    paf_file, start, end = task
+
+    result = {'first': None, 'last': None, 'reads': 0, 'records': 0, 'aligned_bases': 0, 'targets': Counter()}
+
+    with open(paf_file, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = start
+        while position < end:
+            block_end = min(position + BLOCK_SIZE, end)
+            if block_end < end:
+                newline = mm.rfind(b'\n', position, block_end)
+                if newline == -1:
+                    newline = mm.find(b'\n', block_end, end)
+                block_end = end if newline == -1 else newline + 1
+            block = scan_block(read_block(mm, position, block_end), result['last'])
+            position = block_end
+
+            for field in ('reads', 'records', 'aligned_bases'):
+                result[field] += block[field]
+            result['targets'].update(block['targets'])
+            result['first'] = result['first'] or block['first']
+            result['last'] = block['last']
+
+    return result
+
+
+def merge_ranges(results):
+    """
+    Merges the results of consecutive byte ranges of the same file, discounting the reads split between ranges.
+    :param results: list of scan_range results, in file order
+    :return: dict with mapped reads, alignment records, aligned bases and Counter with mapped reads per target
+    """
+    merged = {'reads': 0, 'records': 0, 'aligned_bases': 0, 'targets': Counter()}
+    last_key = None
+
+    for result in results:
+        if result['first'] is None:
+            continue
+        merged['reads'] += result['reads']
+        merged['records'] += result['records']
+        merged['aligned_bases'] += result['aligned_bases']
+        merged['targets'].update(result['targets'])
+
+        if last_key is not None:
+            if result['first'][0] == last_key[0]:
+                merged['reads'] -= 1
+            if result['first'] == last_key:
+                merged['targets'][last_key[1]] -= 1
+        last_key = result['last']
+
+    merged['targets'] = Counter({target.decode(): count for target, count in merged['targets'].items()})
+    return merged
+
+
+def get_range_size(paf_files, threads=None):
+    """
+    Splits the files in about one range per worker, so small files are also scanned in parallel, with ranges of at
+    least BLOCK_SIZE and at most RANGE_SIZE bytes.
+    :param paf_files: list of paths to PAF files
+    :param threads: number of worker processes (default: number of CPUs)
+    :return: int with the target size of each byte range
+    """
+    total_size = sum(os.path.getsize(paf_file) for paf_file in paf_files)
+    return min(max(-(-total_size // (threads or os.cpu_count())), BLOCK_SIZE), RANGE_SIZE)
+
+
+def scan_paf_files(paf_files, threads=None, range_size=None):
+    """
+    Scans several PAF files, distributing the byte ranges of all files through a pool of worker processes.
+    :param paf_files: list of paths to PAF files
+    :param threads: number of worker processes (default: number of CPUs)
+    :param range_size: target size of each byte range (default: see get_range_size)
+    :return: dict with paf files as keys and merge_ranges results as values
+    """
+    range_size = range_size or get_range_size(paf_files, threads)
+    tasks = [(paf_file, start, end) for paf_file in paf_files
+             for start, end in get_byte_ranges(paf_file, range_size)]
+
+    with Pool(threads) as pool:
+        results = pool.map(scan_range, tasks, chunksize=1)
+
+    per_file = {paf_file: [] for paf_file in paf_files}
+    for (paf_file, _, _), result in zip(tasks, results):
+        per_file[paf_file].append(result)
+
+    return {paf_file: merge_ranges(per_file[paf_file]) for paf_file in paf_files}
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the read mappings (ending in *.paf).')
+    parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes.')
+    parser.add_argument('--range-size', type=int, dest='range_size',
+                        help='Size of the byte ranges distributed to the workers, in MB.')
+    parser.add_argument('--save', action='store_true', dest='save',
+                        help='Save a csv table with the mapped reads per target sequence, per assembler.')
+
+    args = parser.parse_args()
+    if args.range_size is not None and args.range_size < 1:
+        parser.error('the range size must be at least 1 MB')
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    mappings = sorted(glob.glob(args.mappings + '/*.paf'))
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    start = time.time()
+    results = scan_paf_files(mappings, args.threads, args.range_size and args.range_size * 1024 * 1024)
+    elapsed = time.time() - start
+    size = sum(os.path.getsize(paf_file) for paf_file in mappings) / (1024 * 1024)
+
+    print(','.join(['Assembler', 'Mapped reads', 'Alignments', 'Aligned bases', 'Targets']))
+
+    for paf_file in mappings:
+        assembler = utils.get_assember_name(paf_file)
+        result = results[paf_file]
+
+        print(','.join([assembler, f'{result["reads"]}', f'{result["records"]}', f'{result["aligned_bases"]}',
+                        f'{len(result["targets"])}']))
+
+        if args.save:
+            with open(assembler + '_reads_per_target.csv', 'w') as fh:
+                fh.write('Target,Mapped reads\n')
+                for target, count in result['targets'].most_common():
+                    fh.write(f'{target},{count}\n')
+
+    print(f'Scanned {size:.1f} MB in {elapsed:.1f} s ({size / max(elapsed, 1e-9):.1f} MB/s)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,9 @@ Expected input
 This script takes the following arguments (in this order):
   * Path to the filtered (min length of 1000bp) assembly files (ending in *.fasta)
   * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --manifest (optional) - manifest file (see manifest.py) to reuse and update between runs
+  * --engine (optional) - implementation of the gaps: legacy or vectorized (see validate_engines.py) (default: legacy)
+  * --profile (optional) - print timing and memory usage of each stage
 
 The triple bacterial reference files for the zymos mock community are available at
 "../../data/references/Zymos_Genomes_triple_chromosomes.fasta"
@@ -25,15 +28,16 @@ https://github.com/cimendes
 
 import os
 import sys
-from plotly.offline import plot
+import argparse
 import pandas as pd
-import glob
-import fnmatch
-import plotly.graph_objects as go
 from itertools import groupby
 
 #import commonly used functions from utils.py
 import utils
+import profiling
+import manifest
+import coverage_depth
+import reference_tracks
 
 REFERENCE_SEQUENCES = os.path.join(os.path.dirname(__file__),
                                    '..', '..', 'data', 'references', 'Zymos_Genomes_triple_chromosomes.fasta')
@@ -41,15 +45,27 @@ REFERENCE_SEQUENCES = os.path.join(os.path.dirname(__file__),
 COLUMNS = ['Assembler', 'Gap size']  # columns for dataframe
 
 
-def get_gaps(paf_file, ref_name, ref_len):
+def get_gaps(paf_file, ref_name, ref_len, engine='legacy'):
     """
     Function to process the mapping (*.paf) file for a given reference and output a list with gap sizes from
     the alignment.
     :param paf_file: tabular file with alignment information for an assembler
     :param ref_name: reference name to filter from the paf_filename
     :param ref_len: int with expected reference length
+    :param engine: 'legacy' (set of covered bases) or 'vectorized' (merged folded intervals)
     :return: gap_sizes: list with gap sizes in the assembly for the ref_name reference
     """
+    if engine == 'vectorized':
+        paf_df = utils.read_paf(paf_file)
+        paf_df = paf_df[paf_df['Reference'] == ref_name]
+        starts, ends = coverage_depth.fold_intervals(paf_df['Target Start'].values, paf_df['Target End'].values,
+                                                     int(ref_len))
+        gap_starts, gap_ends = reference_tracks.get_gaps(*reference_tracks.get_covered_intervals(starts, ends),
+                                                         int(ref_len))
+        # only the gaps between covered bases
+        interior = (gap_starts > 0) & (gap_ends < int(ref_len))
+        return (gap_ends[interior] - gap_starts[interior]).tolist()
+
     covered_bases_list = []
 
     with open(paf_file) as paf:
@@ -73,20 +89,22 @@ def get_gaps(paf_file, ref_name, ref_len):
             else:
                 covered_bases.add(int(base-(2*ref_len)))
 
-    covered_bases = list(covered_bases)
+    covered_bases = sorted(covered_bases)
     gaps = [[s, e]for s, e in zip(covered_bases, covered_bases[1:]) if s+1 < e]  # get list of gap sizes coords
     gap_sizes = [coord[1]-coord[0]-1 for coord in gaps]
     return gap_sizes
 
 
-def gap_size_distribution(assemblies, mappings):
+def gap_size_distribution(assemblies, mappings, engine='legacy'):
     """
     Parses paf files and returns info on 'Assembler' and 'Gap size' as dataframe
     :param assemblies: list of assembly files
     :param mappings: list of paf files
+    :param engine: implementation of the gaps (see utils.ENGINES)
     :return: pandas dataframe with gap sizes for each assembler
     """
-    df = pd.DataFrame(columns=COLUMNS)
+    rows = []
+    mapping_index = utils.index_by_assembler(mappings)
 
     for assembly_file in sorted(assemblies):
 
@@ -95,33 +113,27 @@ def gap_size_distribution(assemblies, mappings):
         # iterator for reference files (sequence length is needed)
         references = (x[1] for x in groupby(open(REFERENCE_SEQUENCES, "r"), lambda line: line[0] == ">"))
 
-        paf_file = fnmatch.filter(mappings, '*_' + filename + '.*')[0]
+        paf_file = mapping_index[filename]
         for header in references:
             header_str = header.__next__()[1:].strip().split()[0]
             seq = "".join(s.strip() for s in references.__next__())
 
-            gaps = get_gaps(paf_file, header_str, len(seq)/3)
-            for gap in gaps:
-                df = df.append({'Assembler': filename, 'Gap size': gap}, ignore_index=True)
+            with profiling.stage('get_gaps', filename) as stage:
+                gaps = get_gaps(paf_file, header_str, len(seq)/3, engine)
+                stage['Items'] = len(gaps)
+            rows.extend({'Assembler': filename, 'Gap size': gap} for gap in gaps)
 
-    return df
+    return pd.DataFrame(rows, columns=COLUMNS)
 
 
-def main():
-    try:
-        assemblies = glob.glob(sys.argv[1] + '/*.fasta')
-        mappings = glob.glob(sys.argv[2] + '/*.paf')
-    except IndexError as e:
-        print(e, "files not found")
-        sys.exit(0)
-
-    #add sanity check
-    if len(assemblies) != len(mappings):
-        print("Number of input files don't match.")
-        sys.exit(0)
+def plot_gap_sizes(df):
+    """
+    Boxplot with the gap size distribution per assembler.
+    :param df: pandas dataframe with gap sizes for each assembler (see gap_size_distribution)
+    """
+    from plotly.offline import plot
+    import plotly.graph_objects as go
 
-    df = gap_size_distribution(assemblies, mappings)
-    # Create plot - gap size distribution per assembler
     fig = go.Figure()
 
     for assembler in sorted(df['Assembler'].unique()):
@@ -135,5 +147,39 @@ def main():
     plot(fig)
 
 
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--manifest', type=str, dest='manifest',
+                        help='Manifest file (see manifest.py) to reuse and update between runs.')
+    parser.add_argument('--engine', choices=utils.ENGINES, default='legacy', dest='engine',
+                        help='Implementation of the gaps (legacy or vectorized, see validate_engines.py).')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    # paired and validated assembly and mapping files
+    assemblies, mappings = manifest.get_paired_files(args.assemblies, args.mappings, args.manifest)
+
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    df = gap_size_distribution(assemblies, mappings, args.engine)
+    with profiling.stage('plot'):
+        plot_gap_sizes(df)
+
+    profiling.report(args)
+
+
 if __name__ == '__main__':
     main()
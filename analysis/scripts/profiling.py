@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Timing and memory instrumentation for the analysis scripts.
+
+The stages of a script are wrapped with `profiling.stage(<name>, <assembler>)`, which records the wall time, CPU time,
+increase of the process high-water mark (peak RSS of the process at the end of the call minus the peak RSS at its
+start) and number of processed items of each call. The high-water mark is that of the whole process, so a stage that
+stays below the peak of an earlier stage reports 0, whatever memory it uses: it shows which stages raise the peak
+memory of the script, not the memory of every stage. Nothing is recorded unless the profiler is enabled,
+which the scripts do with the `--profile` flag (see `add_arguments`).
+
+At the end of the run, a summary table with the totals for each stage and assembler is printed to stderr (keeping
+the csv output of the scripts clean), and can be saved as JSON. Optionally, each stage is run under cProfile and the
+statistics of the slowest stage are dumped to a file, to be inspected with `pstats` or snakeviz.
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import sys
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+
+def get_peak_rss():
+    """
+    Gets the peak resident set size of the process.
+    :return: float with peak RSS in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes in macOS, kilobytes in linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, increase of the process high-water mark and item counts for each stage of a script.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.dump_file = None
+        self._profiles = {}
+        self._profiling = False
+
+    def enable(self, dump_file=None):
+        """
+        Starts recording stages.
+        :param dump_file: optional path to dump the cProfile statistics of the slowest stage
+        """
+        self.enabled = True
+        self.dump_file = dump_file
+
+    @contextmanager
+    def stage(self, name, assembler=None, items=None):
+        """
+        Context manager recording a stage. The number of processed items can be given, or set on the yielded record.
+        :param name: string with stage name
+        :param assembler: optional string with assembler name
+        :param items: optional number of items processed in the stage
+        :return: dict with the stage record (yield)
+        """
+        record = {'Stage': name, 'Assembler': assembler or '', 'Items': items}
+        if not self.enabled:
+            yield record
+            return
+
+        # nested stages are timed, but only the outermost one is run under cProfile
+        profile = None
+        if self.dump_file and not self._profiling:
+            profile = self._profiles.setdefault((name, assembler or ''), cProfile.Profile())
+            self._profiling = True
+            profile.enable()
+
+        wall, cpu, peak = time.perf_counter(), time.process_time(), get_peak_rss()
+        try:
+            yield record
+        finally:
+            record['Wall'] = time.perf_counter() - wall
+            record['CPU'] = time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            # ru_maxrss is the high-water mark of the whole process: only its increase is attributed to the stage
+            record['High-Water Increase'] = get_peak_rss() - peak
+            self.records.append(record)
+
+    def summary(self):
+        """
+        Totals of the recorded stages, per stage and assembler, sorted by wall time.
+        :return: list of dicts with Stage, Assembler, Calls, Items, Wall, CPU and High-Water Increase (largest of the
+        calls)
+        """
+        totals = {}
+        for record in self.records:
+            key = (record['Stage'], record['Assembler'])
+            if key not in totals:
+                totals[key] = {'Stage': key[0], 'Assembler': key[1], 'Calls': 0, 'Items': None, 'Wall': 0.0,
+                               'CPU': 0.0, 'High-Water Increase': 0.0}
+            total = totals[key]
+            total['Calls'] += 1
+            if record['Items'] is not None:
+                total['Items'] = (total['Items'] or 0) + record['Items']
+            total['Wall'] += record['Wall']
+            total['CPU'] += record['CPU']
+            total['High-Water Increase'] = max(total['High-Water Increase'], record['High-Water Increase'])
+
+        return sorted(totals.values(), key=lambda total: total['Wall'], reverse=True)
+
+    def report(self, json_file=None):
+        """
+        Prints the summary table to stderr, optionally saves it as JSON and dumps the cProfile statistics of the
+        slowest stage.
+        :param json_file: optional path to the JSON output file
+        """
+        if not self.enabled:
+            return
+
+        summary = self.summary()
+
+        print(','.join(['Stage', 'Assembler', 'Calls', 'Items', 'Wall (s)', 'CPU (s)', 'RSS High-Water Increase (MB)']),
+              file=sys.stderr)
+        for total in summary:
+            print(','.join([total['Stage'], total['Assembler'], f'{total["Calls"]}',
+                            '' if total['Items'] is None else f'{total["Items"]}', f'{total["Wall"]:.3f}',
+                            f'{total["CPU"]:.3f}', f'{total["High-Water Increase"]:.1f}']), file=sys.stderr)
+
+        if json_file:
+            with open(json_file, 'w') as fh:
+                json.dump({'summary': summary, 'records': self.records}, fh, indent=2)
+
+        if self.dump_file and self._profiles:
+            slowest = next(total for total in summary if (total['Stage'], total['Assembler']) in self._profiles)
+            self._profiles[(slowest['Stage'], slowest['Assembler'])].dump_stats(self.dump_file)
+            print(f'cProfile statistics of {slowest["Stage"]} {slowest["Assembler"]} saved to {self.dump_file}',
+                  file=sys.stderr)
+
+
+# profiler shared by all the modules of a script
+PROFILER = Profiler()
+
+
+def stage(name, assembler=None, items=None):
+    """
+    Records a stage in the shared profiler (see Profiler.stage).
+    """
+    return PROFILER.stage(name, assembler, items)
+
+
+def add_arguments(parser):
+    """
+    Adds the profiling options to an argparse parser.
+    :param parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--profile', action='store_true', dest='profile',
+                        help='Print wall time, CPU time, RSS high-water increase and items for each stage and '
+                             'assembler to stderr.')
+    parser.add_argument('--profile-json', type=str, dest='profile_json',
+                        help='Save the profiling summary as JSON (implies --profile).')
+    parser.add_argument('--profile-dump', type=str, dest='profile_dump',
+                        help='Dump the cProfile statistics of the slowest stage to a file (implies --profile).')
+
+
+def setup(args):
+    """
+    Enables the shared profiler according to the parsed profiling options.
+    :param args: argparse.Namespace with the options from add_arguments
+    """
+    if args.profile or args.profile_json or args.profile_dump:
+        PROFILER.enable(args.profile_dump)
+
+
+def report(args):
+    """
+    Reports the shared profiler according to the parsed profiling options.
+    :param args: argparse.Namespace with the options from add_arguments
+    """
+    PROFILER.report(args.profile_json)
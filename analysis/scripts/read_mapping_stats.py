@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Script to obtain the percentage of reads and basepairs of the read dataset that map back to each assembly.
+
+The read files (FASTQ, optionally gzipped) are streamed once to count reads and basepairs, and the mappings of the
+reads to each assembly (obtained with `minimap2 -x sr --secondary=no <assembly> <forward_read> <reverse_read>`) are
+scanned with paf_scanner.py. Both steps use bounded memory and are run in parallel across files.
+
+In the paired-end mappings the mates share the same name, so mapped reads are counted as read pairs with at least
+one mapped mate and compared against the number of read pairs in the dataset (use --single-end otherwise).
+
+For each assembly, this script will output to the command line:
+  * Assembler - assembler name (from paf file name)
+  * Mapped reads - number of reads (or read pairs) mapping to the assembly (and % over all reads)
+  * Mapped bp - number of read basepairs aligned to the assembly (and % over all read basepairs)
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the read files (ending in *.fq, *.fastq, *.fq.gz or *.fastq.gz)
+  * Path to the mapped reads to the assemblies (ending in *.paf)
+  * -t (optional) - number of worker processes (default: number of CPUs)
+  * --single-end (optional) - the reads are single-end
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import sys
+import glob
+import gzip
+import argparse
+from itertools import islice
+from multiprocessing import Pool
+
+#import commonly used functions from utils.py
+import utils
+import paf_scanner
+
+FASTQ_EXTENSIONS = ('*.fq', '*.fastq', '*.fq.gz', '*.fastq.gz')
+
+
+def count_fastq(fastq_file):
+    """
+    Counts the reads and basepairs of a (gzipped) fastq file in a single streaming pass.
+    :param fastq_file: path to the fastq file
+    :return: tuple with number of reads and number of basepairs
+    """
+    opener = gzip.open if fastq_file.endswith('.gz') else open
+
+    reads, bases = 0, 0
+    with opener(fastq_file, 'rb') as fh:
+        # sequence is the second line of each 4-line record
+        for seq in islice(fh, 1, None, 4):
+            reads += 1
+            bases += len(seq.rstrip())
+    return reads, bases
+
+
+def count_fastq_files(fastq_files, threads=None):
+    """
+    Counts the reads and basepairs of several fastq files in parallel.
+    :param fastq_files: list of paths to fastq files
+    :param threads: number of worker processes (default: number of CPUs)
+    :return: tuple with total number of reads and basepairs
+    """
+    with Pool(threads) as pool:
+        counts = pool.map(count_fastq, fastq_files, chunksize=1)
+
+    return sum(reads for reads, _ in counts), sum(bases for _, bases in counts)
+
+
+def get_read_mapping_stats(fastq_files, mappings, threads=None, paired=True):
+    """
+    Gets the number and percentage of reads and basepairs mapping to each assembly.
+    :param fastq_files: list of paths to fastq files
+    :param mappings: list of paf files with the reads mapped to each assembly
+    :param threads: number of worker processes (default: number of CPUs)
+    :param paired: Bool, mates share the same name in the paf files
+    :return: tuple with total reads, total basepairs and list of (assembler, mapped reads, aligned bases) tuples
+    """
+    total_reads, total_bases = count_fastq_files(fastq_files, threads)
+    if paired:
+        total_reads = total_reads // 2
+
+    results = paf_scanner.scan_paf_files(mappings, threads)
+
+    stats = [(utils.get_assember_name(paf_file), results[paf_file]['reads'], results[paf_file]['aligned_bases'])
+             for paf_file in mappings]
+    return total_reads, total_bases, stats
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('reads', type=str, help='Path to the read files (fastq, optionally gzipped).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped reads (ending in *.paf).')
+    parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes.')
+    parser.add_argument('--single-end', action='store_false', dest='paired',
+                        help='The reads are single-end.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    fastq_files = sorted(fastq_file for extension in FASTQ_EXTENSIONS
+                         for fastq_file in glob.glob(args.reads + '/' + extension))
+    mappings = sorted(glob.glob(args.mappings + '/*.paf'))
+
+    if not fastq_files or not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    total_reads, total_bases, stats = get_read_mapping_stats(fastq_files, mappings, args.threads, args.paired)
+
+    print(f'Total {"read pairs" if args.paired else "reads"}: {total_reads}, total bp: {total_bases}')
+    print(','.join(['Assembler', '% mapped reads', '% mapped bp']))
+
+    for assembler, mapped_reads, mapped_bases in stats:
+        print(','.join([assembler, f'{mapped_reads} ({(mapped_reads/max(total_reads, 1))*100:.2f}%)',
+                        f'{mapped_bases} ({(mapped_bases/max(total_bases, 1))*100:.2f}%)']))
+
+
+if __name__ == '__main__':
+    main()
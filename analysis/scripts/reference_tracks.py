@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Windowed quality tracks along each reference genome, for each assembler, for genome-browser-style plots.
+
+For each reference, the following tracks are computed in fixed windows (default: 1000 bp):
+  * covered - fraction of the window covered by at least one contig
+  * identity - fraction of matching bases over the aligned reference bases in the window (from the `cg` CIGAR
+    or the `cs` difference string of each alignment; NaN if nothing aligns to the window)
+  * contigs - number of distinct contigs aligned to the window
+together with the position of the coverage gaps (uncovered stretches of the reference).
+
+The CIGAR operations of all alignments are converted into reference segments once and folded into the coordinates of
+a single copy of the triple reference. The window values are then obtained in a single sweep over the sorted segment
+starts and ends (the integral of the segments at each window boundary), so the PAF file is never rescanned per
+window and no per-base arrays are needed.
+
+The tracks of each assembler are saved as a numpy archive (`<assembler>_tracks.npz`, loaded with `load_tracks`),
+and optionally as bedGraph files (`<assembler>_<track>.bedgraph`).
+
+For each assembler, this script will output to the command line for each reference genome:
+  * Reference - reference name
+  * Windows - number of windows
+  * Covered windows - number of windows with at least one aligned base
+  * Min identity - lowest window identity
+  * Max contigs - highest number of distinct contigs in a window
+  * Gaps - number of coverage gaps
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --reference (optional) - path to the triple reference genomes (default: reference lengths from the paf files)
+  * --window (optional) - window size (default: 1000)
+  * --bedgraph (optional) - also save the tracks as bedGraph files
+  * --plot (optional) - plot the tracks of each reference for all assemblers
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import re
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import coverage_depth
+
+WINDOW_SIZE = 1000
+
+TRACKS = ['covered', 'identity', 'contigs']
+
+# reference consuming operations (M matches are weighted by the alignment identity)
+REFERENCE_OPERATIONS = ['=', 'X', 'D', 'M']
+
+
+def get_cigar_operations(cigar):
+    """
+    Converts a CIGAR string or a cs difference string into a list of (length, operation) tuples, with the CIGAR
+    operations (=, X, I, D, M).
+    :param cigar: string with the `cg` or `cs` tag value (starting with a digit or a cs operator, respectively)
+    :return: list of tuples with operation length and operation
+    """
+    if not cigar:
+        return []
+    if cigar[0].isdigit():
+        return [(int(length), operation) for length, operation in re.findall(r'(\d+)([MIDNSHP=X])', cigar)]
+
+    operations = []
+    for operator, value in re.findall(r'([:*+\-~])([0-9]+|[a-z]+)', cigar.lower()):
+        if operator == ':':
+            operations.append((int(value), '='))
+        elif operator == '*':
+            operations.append((1, 'X'))  # value holds the reference and query bases
+        elif operator == '+':
+            operations.append((len(value), 'I'))
+        elif operator == '-':
+            operations.append((len(value), 'D'))
+    return operations
+
+
+def get_alignment_segments(paf_df):
+    """
+    Gets the aligned reference segments of all alignments from their CIGAR operations, in triple reference
+    coordinates. Alignments without a `cg` or `cs` tag are a single segment weighted by the alignment identity.
+    :param paf_df: pandas DataFrame with PAF columns and 'cg' and 'cs' tag columns (see utils.read_paf)
+    :return: tuple of numpy arrays with the segment starts, ends, matching base rate and alignment index
+    """
+    lengths, operations, alignments = [], [], []
+    for i, cigar in enumerate(paf_df['cg'].where(paf_df['cg'].notna(), paf_df['cs']).tolist()):
+        cigar_operations = get_cigar_operations(cigar) or [(None, 'M')]
+        lengths.extend(length for length, _ in cigar_operations)
+        operations.extend(operation for _, operation in cigar_operations)
+        alignments.extend([i] * len(cigar_operations))
+
+    alignments = np.array(alignments, dtype=np.int64)
+    target_starts = paf_df['Target Start'].values.astype(np.int64)
+    target_spans = paf_df['Target End'].values.astype(np.int64) - target_starts
+    alignment_identity = paf_df['Matching Bases'].values / np.maximum(paf_df['Alignment Len'].values, 1)
+
+    # untagged alignments span the whole target interval
+    lengths = np.array([length if length is not None else -1 for length in lengths], dtype=np.int64)
+    lengths = np.where(lengths < 0, target_spans[alignments], lengths)
+
+    operations = np.array(operations)
+    on_reference = np.isin(operations, REFERENCE_OPERATIONS)
+    reference_lengths = np.where(on_reference, lengths, 0)
+
+    # start of each segment: target start plus the reference bases of the previous segments of the alignment
+    consumed = np.cumsum(reference_lengths) - reference_lengths
+    first_segment = np.searchsorted(alignments, alignments)
+    starts = target_starts[alignments] + consumed - consumed[first_segment]
+    ends = starts + reference_lengths
+
+    match_rate = np.select([operations == '=', operations == 'M'], [1.0, alignment_identity[alignments]], 0.0)
+
+    return starts[on_reference], ends[on_reference], match_rate[on_reference], alignments[on_reference]
+
+
+def get_covered_intervals(starts, ends):
+    """
+    Merges overlapping (or adjacent) intervals into the disjoint intervals covered by at least one of them.
+    :param starts: numpy array with interval starts
+    :param ends: numpy array with interval ends (exclusive)
+    :return: tuple of numpy arrays with the starts and ends of the covered intervals, sorted
+    """
+    if not len(starts):
+        return starts, ends
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+
+    # a new covered interval starts where an interval starts after all the previous ones end
+    new_interval = np.ones(len(starts), dtype=bool)
+    new_interval[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(new_interval)
+    return starts[first], np.maximum.reduceat(ends, first)
+
+
+def get_gaps(covered_starts, covered_ends, ref_len):
+    """
+    Gets the uncovered stretches of the reference.
+    :param covered_starts: numpy array with the starts of the covered intervals (see get_covered_intervals)
+    :param covered_ends: numpy array with the ends of the covered intervals
+    :param ref_len: int with reference length
+    :return: tuple of numpy arrays with gap starts and ends (exclusive)
+    """
+    gap_starts = np.concatenate(([0], covered_ends))
+    gap_ends = np.concatenate((covered_starts, [ref_len]))
+    is_gap = gap_ends > gap_starts
+    return gap_starts[is_gap], gap_ends[is_gap]
+
+
+def get_window_sums(starts, ends, weights, boundaries):
+    """
+    Sums the weighted bases of the intervals within each window, from the integral of the intervals at the window
+    boundaries (sweep over the sorted interval starts and ends, without per-base arrays).
+    :param starts: numpy array with interval starts
+    :param ends: numpy array with interval ends (exclusive)
+    :param weights: numpy array with the weight of each interval base
+    :param boundaries: sorted numpy array with the window boundaries (first window start to last window end)
+    :return: numpy array with the sum of the weighted bases in each window
+    """
+    def integral(positions):
+        # sum of weight * (boundary - position) for the positions before each boundary
+        order = np.argsort(positions, kind='stable')
+        weight_sums = np.concatenate(([0.0], np.cumsum(weights[order])))
+        weighted_positions = np.concatenate(([0.0], np.cumsum(weights[order] * positions[order])))
+        before = np.searchsorted(positions[order], boundaries, side='right')
+        return boundaries * weight_sums[before] - weighted_positions[before]
+
+    return np.diff(integral(starts) - integral(ends))
+
+
+def get_reference_tracks(segments, contig_codes, ref_len, window_size=WINDOW_SIZE):
+    """
+    Computes the windowed tracks of a reference in a single sweep over the folded alignment segments.
+    :param segments: tuple with folded segment starts, ends, matching base rate and alignment index
+    :param contig_codes: numpy array with the contig code of each alignment
+    :param ref_len: int with reference length
+    :param window_size: int with window size
+    :return: dict with window starts, covered, identity and contigs tracks, and gap starts and ends
+    """
+    starts, ends, match_rate, alignments = segments
+    window_starts = np.arange(0, ref_len, window_size)
+    boundaries = np.append(window_starts, ref_len)
+
+    aligned = get_window_sums(starts, ends, np.ones(len(starts)), boundaries)
+    matching = get_window_sums(starts, ends, match_rate, boundaries)
+
+    covered_starts, covered_ends = get_covered_intervals(starts, ends)
+    covered = get_window_sums(covered_starts, covered_ends, np.ones(len(covered_starts)), boundaries)
+
+    # distinct contigs per window, from the unique (window, contig) pairs spanned by the segments
+    first_window, last_window = starts // window_size, (ends - 1) // window_size
+    spans = last_window - first_window + 1
+    segment = np.repeat(np.arange(len(starts)), spans)
+    windows = first_window[segment] + np.arange(len(segment)) - np.repeat(np.cumsum(spans) - spans, spans)
+    pairs = np.unique(windows * (contig_codes.max(initial=0) + 1) + contig_codes[alignments[segment]])
+    contigs = np.bincount(pairs // (contig_codes.max(initial=0) + 1), minlength=len(window_starts))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        identity = np.where(aligned > 0, matching / aligned, np.nan)
+
+    gap_starts, gap_ends = get_gaps(covered_starts, covered_ends, ref_len)
+
+    return {'starts': window_starts.astype(np.int32),
+            'covered': (covered / np.diff(boundaries)).astype(np.float32),
+            'identity': identity.astype(np.float32),
+            'contigs': contigs.astype(np.int32),
+            'gap_starts': gap_starts.astype(np.int32),
+            'gap_ends': gap_ends.astype(np.int32)}
+
+
+def get_tracks(paf_file, ref_lengths, window_size=WINDOW_SIZE):
+    """
+    Computes the windowed tracks of each reference for an assembler.
+    :param paf_file: path to the PAF file of the assembler
+    :param ref_lengths: dict with reference names as keys and single copy lengths as values
+    :param window_size: int with window size
+    :return: dict with reference names as keys and get_reference_tracks dicts as values
+    """
+    paf_df = utils.read_paf(paf_file, tags=('cg', 'cs'))
+    contig_codes = pd.factorize(paf_df['Contig'])[0]
+    reference_of_alignment = paf_df['Reference'].values
+
+    starts, ends, match_rate, alignments = get_alignment_segments(paf_df)
+
+    tracks = {}
+    for reference, ref_len in ref_lengths.items():
+        in_reference = reference_of_alignment[alignments] == reference
+        folded_starts, folded_ends, segment = coverage_depth.fold_intervals(starts[in_reference], ends[in_reference],
+                                                                            ref_len, return_index=True)
+        segments = (folded_starts, folded_ends, match_rate[in_reference][segment], alignments[in_reference][segment])
+        tracks[reference] = get_reference_tracks(segments, contig_codes, ref_len, window_size)
+
+    return tracks
+
+
+def save_tracks(tracks, ref_lengths, window_size, npz_file):
+    """
+    Saves the tracks of an assembler as a numpy archive, with `<reference>/<track>` arrays.
+    :param tracks: dict with reference names as keys and get_reference_tracks dicts as values
+    :param ref_lengths: dict with reference names as keys and single copy lengths as values
+    :param window_size: int with window size
+    :param npz_file: path to the output .npz file
+    """
+    arrays = {f'{reference}/{name}': values for reference, reference_tracks in tracks.items()
+              for name, values in reference_tracks.items()}
+    np.savez(npz_file, references=np.array(list(tracks)), lengths=np.array([ref_lengths[ref] for ref in tracks]),
+             window_size=np.array(window_size), **arrays)
+
+
+def load_tracks(npz_file):
+    """
+    Loads the tracks of an assembler saved with save_tracks.
+    :param npz_file: path to the .npz file
+    :return: tuple with dict of reference names and get_reference_tracks dicts, dict of reference lengths, and window
+    size
+    """
+    with np.load(npz_file) as archive:
+        references = archive['references'].tolist()
+        tracks = {reference: {name.split('/', 1)[1]: archive[name] for name in archive.files
+                              if name.startswith(reference + '/')} for reference in references}
+        return tracks, dict(zip(references, archive['lengths'].tolist())), int(archive['window_size'])
+
+
+def write_bedgraph(tracks, ref_lengths, window_size, prefix):
+    """
+    Writes each track of an assembler as a bedGraph file (`<prefix>_<track>.bedgraph`), skipping windows without data.
+    :param tracks: dict with reference names as keys and get_reference_tracks dicts as values
+    :param ref_lengths: dict with reference names as keys and single copy lengths as values
+    :param window_size: int with window size
+    :param prefix: output file prefix
+    """
+    for track in TRACKS:
+        with open(f'{prefix}_{track}.bedgraph', 'w') as fh:
+            fh.write(f'track type=bedGraph name="{prefix} {track}"\n')
+            for reference, reference_tracks in tracks.items():
+                window_starts = reference_tracks['starts']
+                df = pd.DataFrame({'chrom': reference, 'start': window_starts,
+                                   'end': np.minimum(window_starts + window_size, ref_lengths[reference]),
+                                   'value': reference_tracks[track]}).dropna()
+                df.to_csv(fh, sep='\t', header=False, index=False, float_format='%.4f')
+
+
+def plot_tracks(tracks_per_assembler, reference, window_size):
+    """
+    Line plots with the covered fraction, identity and distinct contigs tracks of a reference for all assemblers.
+    :param tracks_per_assembler: dict with assembler names as keys and get_tracks dicts as values
+    :param reference: reference name
+    :param window_size: int with window size
+    """
+    from plotly import subplots
+    from plotly.offline import plot
+    import plotly.graph_objects as go
+
+    reference_name = utils.REFERENCE_DIC.get(reference, reference)
+    fig = subplots.make_subplots(rows=len(TRACKS), cols=1, shared_xaxes=True, subplot_titles=TRACKS,
+                                 vertical_spacing=0.05)
+
+    for assembler, tracks in sorted(tracks_per_assembler.items()):
+        for r, track in enumerate(TRACKS, start=1):
+            fig.add_trace(go.Scatter(x=tracks[reference]['starts'], y=tracks[reference][track], name=assembler,
+                                     legendgroup=assembler, showlegend=r == 1, mode='lines', line=dict(width=1)),
+                          r, 1)
+
+    fig.update_layout(title=f"{reference_name} ({window_size} bp windows)", plot_bgcolor='rgb(255,255,255)')
+    fig.update_yaxes(gridcolor='#DCDCDC')
+    plot(fig, filename=reference_name.replace(' ', '_') + '_tracks.html')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--reference', type=str, dest='reference',
+                        help='Path to the triple reference genomes (default: reference lengths from the paf files).')
+    parser.add_argument('--window', type=int, default=WINDOW_SIZE, dest='window_size', help='Window size.')
+    parser.add_argument('--bedgraph', action='store_true', dest='bedgraph',
+                        help='Also save the tracks of each assembler as bedGraph files.')
+    parser.add_argument('--plot', action='store_true', dest='plot',
+                        help='Plot the tracks of each reference for all assemblers.')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    mappings = sorted(glob.glob(args.mappings + '/*.paf'))
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    ref_lengths = coverage_depth.get_reference_lengths(mappings, args.reference)
+
+    tracks_per_assembler = {}
+    for paf_file in mappings:
+        assembler = utils.get_assember_name(paf_file)
+
+        with profiling.stage('get_tracks', assembler, len(ref_lengths)):
+            tracks = get_tracks(paf_file, ref_lengths, args.window_size)
+
+        save_tracks(tracks, ref_lengths, args.window_size, assembler + '_tracks.npz')
+        if args.bedgraph:
+            write_bedgraph(tracks, ref_lengths, args.window_size, assembler)
+
+        print('\n\n------' + assembler + '------\n')
+        print(','.join(['Reference', 'Windows', 'Covered windows', 'Min identity', 'Max contigs', 'Gaps']))
+        for reference, reference_tracks in tracks.items():
+            identity = reference_tracks['identity']
+            print(','.join([utils.REFERENCE_DIC.get(reference, reference), f'{len(reference_tracks["starts"])}',
+                            f'{int((reference_tracks["covered"] > 0).sum())}',
+                            f'{np.nanmin(identity):.4f}' if np.isfinite(identity).any() else 'NA',
+                            f'{int(reference_tracks["contigs"].max(initial=0))}',
+                            f'{len(reference_tracks["gap_starts"])}']))
+
+        tracks_per_assembler[assembler] = tracks
+
+    if args.plot:
+        with profiling.stage('plot'):
+            for reference in ref_lengths:
+                plot_tracks(tracks_per_assembler, reference, args.window_size)
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
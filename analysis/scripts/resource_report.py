@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Resource usage report for the assembly pipelines, with recommended `cpus` and `memory` settings for each process.
+
+Parses the Nextflow trace files of one or more runs (`reports/pipeline_stats_<timestamp>.txt`, see the trace scope in
+nextflow.config) and, for the successful tasks of each process, collects the requested resources, the CPU usage, the
+peak memory (RSS), the wall time and the I/O.
+
+The recommended number of CPUs is the highest CPU usage observed, rounded up, so single-threaded assemblers stop
+being allocated a full node. The recommended memory is the highest peak RSS observed with 25% headroom, rounded up
+to the GB, and is scaled by the task attempt as in nextflow.config.
+
+For each process, this script will output to the command line:
+  * Process - Nextflow process name
+  * Tasks - number of successful tasks
+  * Requested cpus / Max cpu usage - requested cpus and highest %cpu / 100
+  * Requested memory / Max peak RSS - requested memory and highest peak RSS (GB)
+  * Max realtime - longest wall time (hours)
+  * Max read / Max written - highest bytes read and written from disk (GB)
+  * Recommended cpus / Recommended memory
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * One or more Nextflow trace files
+  * -o (optional) - write the recommendations as a Nextflow config file (ex: resources.config)
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import re
+import argparse
+import numpy as np
+import pandas as pd
+
+MEMORY_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4, 'PB': 1024 ** 5}
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+MEMORY_HEADROOM = 1.25
+
+
+def parse_memory(value):
+    """
+    Converts a Nextflow memory value ('1.2 GB', '512 MB' or raw bytes) to bytes.
+    :param value: string with memory value
+    :return: float with number of bytes (NaN if not available)
+    """
+    value = str(value).strip()
+    match = re.fullmatch(r'([\d.]+)\s*([KMGTP]?B)?', value)
+    if not match:
+        return float('nan')
+    return float(match.group(1)) * MEMORY_UNITS[match.group(2) or 'B']
+
+
+def parse_duration(value):
+    """
+    Converts a Nextflow duration ('1h 2m 3s', '45.3s', '250ms' or raw milliseconds) to seconds.
+    :param value: string with duration value
+    :return: float with number of seconds (NaN if not available)
+    """
+    value = str(value).strip()
+    if re.fullmatch(r'[\d.]+', value):
+        return float(value) / 1000
+    parts = re.findall(r'([\d.]+)(ms|[smhd])', value)
+    if not parts:
+        return float('nan')
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_percentage(value):
+    """
+    Converts a Nextflow percentage ('345.6%') to a float.
+    :param value: string with percentage value
+    :return: float (NaN if not available)
+    """
+    value = str(value).strip().rstrip('%')
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+
+def read_traces(trace_files):
+    """
+    Reads the successful tasks of one or more Nextflow trace files.
+    :param trace_files: list of paths to trace files
+    :return: pandas dataframe with one row per task and resource values in bytes, seconds and cpus
+    """
+    df = pd.concat([pd.read_csv(trace_file, sep='\t', dtype=str).assign(Run=trace_file)
+                    for trace_file in trace_files], ignore_index=True)
+    df = df[df['status'].isin(['COMPLETED', 'CACHED'])].copy()
+
+    df['Requested cpus'] = pd.to_numeric(df['cpus'], errors='coerce')
+    df['Requested memory'] = df['memory'].map(parse_memory)
+    df['Cpu usage'] = df['%cpu'].map(parse_percentage) / 100
+    peak_rss = df['peak_rss'] if 'peak_rss' in df.columns else df['rss']
+    df['Peak RSS'] = peak_rss.map(parse_memory)
+    df['Realtime'] = df['realtime'].map(parse_duration)
+    for column, name in (('read_bytes', 'Read'), ('write_bytes', 'Written')):
+        df[name] = df[column].map(parse_memory) if column in df.columns else float('nan')
+
+    return df
+
+
+def get_recommendations(df):
+    """
+    Summarises the resource usage of each process and recommends cpus and memory.
+    :param df: pandas dataframe with tasks (see read_traces)
+    :return: pandas dataframe with one row per process
+    """
+    summary = df.groupby('process').agg(**{'Tasks': ('Run', 'size'),
+                                           'Requested cpus': ('Requested cpus', 'max'),
+                                           'Max cpu usage': ('Cpu usage', 'max'),
+                                           'Requested memory': ('Requested memory', 'max'),
+                                           'Max peak RSS': ('Peak RSS', 'max'),
+                                           'Max realtime': ('Realtime', 'max'),
+                                           'Max read': ('Read', 'max'),
+                                           'Max written': ('Written', 'max')})
+    summary.index.name = 'Process'
+
+    summary['Recommended cpus'] = np.ceil(summary['Max cpu usage']).clip(lower=1)
+    summary['Recommended memory'] = np.ceil(summary['Max peak RSS'] * MEMORY_HEADROOM / MEMORY_UNITS['GB'])\
+        .clip(lower=1)
+
+    for column in ('Requested memory', 'Max peak RSS', 'Max read', 'Max written'):
+        summary[column] = summary[column] / MEMORY_UNITS['GB']
+    summary['Max realtime'] = summary['Max realtime'] / 3600
+
+    return summary.reset_index()
+
+
+def write_config(summary, config_file):
+    """
+    Writes the recommended resources as a Nextflow config file.
+    :param summary: pandas dataframe with recommendations (see get_recommendations)
+    :param config_file: path to the output config file
+    """
+    with open(config_file, 'w') as fh:
+        fh.write('process {\n')
+        for process, cpus, memory in summary[['Process', 'Recommended cpus', 'Recommended memory']]\
+                .itertuples(index=False):
+            if pd.isna(cpus) or pd.isna(memory):
+                continue
+            fh.write('        withName: {} {{\n'.format(process))
+            fh.write('            cpus = {}\n'.format(int(cpus)))
+            fh.write('            memory = {{{}.GB*task.attempt}}\n'.format(int(memory)))
+            fh.write('        }\n')
+        fh.write('}\n')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('trace_files', nargs='+', type=str, help='Nextflow trace files.')
+    parser.add_argument('-o', type=str, dest='config_file',
+                        help='Write the recommendations as a Nextflow config file.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    summary = get_recommendations(read_traces(args.trace_files))
+
+    print(summary.to_csv(index=False, float_format='%.2f'), end='')
+
+    if args.config_file:
+        write_config(summary, args.config_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Incremental results store for multi-sample comparisons.
+
+All metrics are kept in a single SQLite file, in long format, with one row per sample, assembler, reference and
+metric. Each analysis run upserts its values, so re-running a sample replaces its previous numbers without touching
+the other samples. Metrics that are not specific to a reference genome are stored with an empty reference.
+
+Cross-sample tables and plots are obtained with a single indexed query (see `get_metrics`) instead of re-parsing
+every CSV file in the results tree.
+
+Expected input
+--------------
+This script takes the following arguments:
+  * Path to the SQLite results file (created if missing)
+  * A command:
+    * import-csv - load `*_breadth_of_coverage_contigs.csv` tables for a sample (requires --sample)
+    * export - print the stored metrics for the requested samples and metrics as csv
+    * merge - upsert all the metrics of other results files (ex: one per pipeline task) into this one
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    sample TEXT NOT NULL,
+    assembler TEXT NOT NULL,
+    reference TEXT NOT NULL DEFAULT '',
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (sample, assembler, reference, metric)
+);
+CREATE INDEX IF NOT EXISTS metrics_by_metric ON metrics (metric, sample, assembler, reference);
+"""
+
+UPSERT = "INSERT OR REPLACE INTO metrics (sample, assembler, reference, metric, value) VALUES (?, ?, ?, ?, ?)"
+
+
+def connect(db_file):
+    """
+    Opens (and creates, if needed) the results store.
+    :param db_file: path to the SQLite file
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def upsert_metrics(conn, sample, assembler, reference, metrics):
+    """
+    Inserts or replaces the metrics of a sample/assembler/reference combination.
+    :param conn: sqlite3 connection to the results store
+    :param sample: string with sample name
+    :param assembler: string with assembler name
+    :param reference: string with reference name ('' for assembly-wide metrics)
+    :param metrics: dict with metric names and numeric values
+    """
+    rows = [(sample, assembler, reference or '', metric, float(value)) for metric, value in metrics.items()]
+    with conn:
+        conn.executemany(UPSERT, rows)
+
+
+def upsert_dataframe(conn, sample, df, metrics):
+    """
+    Inserts or replaces the metrics of a wide dataframe with 'Assembler' and (optionally) 'Reference' columns.
+    :param conn: sqlite3 connection to the results store
+    :param sample: string with sample name
+    :param df: pandas DataFrame with one row per assembler (and reference)
+    :param metrics: list of columns of df to store
+    """
+    long_df = df.melt(id_vars=[col for col in ('Assembler', 'Reference') if col in df.columns],
+                      value_vars=metrics, var_name='Metric', value_name='Value')
+    if 'Reference' not in long_df.columns:
+        long_df['Reference'] = ''
+
+    rows = [(sample, assembler, reference, metric, float(value)) for assembler, reference, metric, value in
+            long_df[['Assembler', 'Reference', 'Metric', 'Value']].itertuples(index=False)]
+    with conn:
+        conn.executemany(UPSERT, rows)
+
+
+def get_metrics(conn, metrics, samples=None):
+    """
+    Gets the requested metrics for all (or some) samples as a wide dataframe.
+    :param conn: sqlite3 connection to the results store
+    :param metrics: list of metric names
+    :param samples: optional list of sample names to restrict the query
+    :return: pandas DataFrame with columns Sample, Assembler, Reference and one column per metric
+    """
+    query = "SELECT sample, assembler, reference, metric, value FROM metrics WHERE metric IN ({})".format(
+        ','.join('?' * len(metrics)))
+    params = list(metrics)
+    if samples:
+        query += " AND sample IN ({})".format(','.join('?' * len(samples)))
+        params += list(samples)
+
+    df = pd.read_sql_query(query, conn, params=params)
+    df.columns = ['Sample', 'Assembler', 'Reference', 'Metric', 'Value']
+
+    df = df.pivot_table(index=['Sample', 'Assembler', 'Reference'], columns='Metric', values='Value',
+                        aggfunc='first').reset_index()
+    df.columns.name = None
+    return df.reindex(columns=['Sample', 'Assembler', 'Reference'] + list(metrics))
+
+
+def import_breadth_tables(conn, sample, csv_tables):
+    """
+    Loads `<assembler>_breadth_of_coverage_contigs.csv` tables (see assembly_mapping_stats_per_ref.py --print-csv)
+    into the results store.
+    :param conn: sqlite3 connection to the results store
+    :param sample: string with sample name
+    :param csv_tables: list of csv files
+    """
+    for csv_file in csv_tables:
+        assembler = os.path.basename(csv_file).split('_')[0]
+        data = pd.read_csv(csv_file, skipinitialspace=True)
+        data = data.rename(columns={'Contigs': 'Aligned Contigs'})
+        data['Assembler'] = assembler
+        upsert_dataframe(conn, sample, data, ['Breadth of Coverage', 'Aligned Contigs'])
+
+
+def merge_stores(conn, db_files):
+    """
+    Upserts all the metrics of other results stores into this one.
+    :param conn: sqlite3 connection to the results store
+    :param db_files: list of paths to the SQLite files to merge
+    """
+    for db_file in db_files:
+        conn.execute("ATTACH DATABASE ? AS other", (db_file,))
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO metrics (sample, assembler, reference, metric, value) "
+                         "SELECT sample, assembler, reference, metric, value FROM other.metrics")
+        conn.execute("DETACH DATABASE other")
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('db', type=str, help='Path to the SQLite results file.')
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    import_parser = subparsers.add_parser('import-csv', help='Import breadth of coverage csv tables.')
+    import_parser.add_argument('--sample', type=str, required=True, help='Sample name for the imported tables.')
+    import_parser.add_argument('csv_tables', nargs='+', type=str, help='Breadth of coverage csv tables.')
+
+    export_parser = subparsers.add_parser('export', help='Print stored metrics as csv.')
+    export_parser.add_argument('--metric', nargs='+', type=str, required=True, dest='metrics',
+                               help='Metrics to export.')
+    export_parser.add_argument('--sample', nargs='+', type=str, dest='samples', help='Samples to export.')
+
+    merge_parser = subparsers.add_parser('merge', help='Upsert the metrics of other results files.')
+    merge_parser.add_argument('db_files', nargs='+', type=str, help='SQLite results files to merge.')
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(0)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    conn = connect(args.db)
+
+    if args.command == 'import-csv':
+        import_breadth_tables(conn, args.sample, args.csv_tables)
+    elif args.command == 'export':
+        print(get_metrics(conn, args.metrics, args.samples).to_csv(index=False), end='')
+    elif args.command == 'merge':
+        merge_stores(conn, args.db_files)
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Alignment-free pre-screening of the assemblies, to triage them before mapping the contigs to the triple reference.
+
+The references and the assemblies are sketched with FracMinHash (see sketches.py), with a cache on disk and one worker
+process per fasta file, and the sketch of each reference is intersected with the sketch of each assembly.
+
+For each assembler, this script will output to the command line for each reference genome:
+  * Reference - reference name
+  * Reference Hashes - number of hashes in the reference sketch
+  * Shared Hashes - number of reference hashes found in the assembly sketch
+  * Containment - fraction of the reference k-mers found in the assembly (approximate breadth of coverage, lowered
+    by sequence differences between the assembly and the reference)
+  * Containment ANI - average nucleotide identity estimated from the containment (containment^(1/k)), only meaningful
+    for well covered references
+  * Assembly Fraction - fraction of the assembly k-mers found in the reference
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the metagenomic assembly files (ending in *.fasta)
+  * --reference (optional) - path to the triple reference genomes
+  * -k (optional) - k-mer size, up to 32 (default: 21)
+  * --scaled (optional) - keep one in every `scaled` k-mers in the sketches (default: 1000)
+  * -t (optional) - number of worker processes (default: number of CPUs)
+  * --cache (optional) - sketch cache directory (default: .sketch_cache)
+  * --no-cache (optional) - do not read or write the sketch cache
+  * --store (optional) - SQLite results store (see results_store.py) to upsert the sketch metrics into
+  * --sample (optional) - sample name for the results store (default: from the assembly file names)
+
+The triple bacterial reference files for the zymos mock community are available at
+"../../data/references/Zymos_Genomes_triple_chromosomes.fasta"
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+import sketches
+import results_store
+
+REFERENCE_SEQUENCES = os.path.join(os.path.dirname(__file__),
+                                   '..', '..', 'data', 'references', 'Zymos_Genomes_triple_chromosomes.fasta')
+
+SKETCH_STATS_COLUMNS = ['Reference', 'Reference Hashes', 'Shared Hashes', 'Containment', 'Containment ANI',
+                        'Assembly Fraction']
+
+
+def get_sketch_stats(reference_sketches, assembly_sketch, ksize=sketches.KSIZE):
+    """
+    Compares the sketch of an assembly with the sketch of each reference.
+    :param reference_sketches: dict with reference names as keys and sketches as values
+    :param assembly_sketch: sorted numpy array of unique hashes of the assembly
+    :param ksize: int with the k-mer size of the sketches
+    :return: pandas DataFrame with SKETCH_STATS_COLUMNS, one row per reference
+    """
+    rows = []
+    for reference, reference_sketch in reference_sketches.items():
+        shared, containment = sketches.get_containment(reference_sketch, assembly_sketch)
+        rows.append({'Reference': utils.REFERENCE_DIC.get(reference, reference),
+                     'Reference Hashes': len(reference_sketch), 'Shared Hashes': shared,
+                     'Containment': containment, 'Containment ANI': containment ** (1 / ksize),
+                     'Assembly Fraction': shared / len(assembly_sketch) if len(assembly_sketch) else 0.0})
+    return pd.DataFrame(rows, columns=SKETCH_STATS_COLUMNS)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('--reference', type=str, default=REFERENCE_SEQUENCES, dest='reference',
+                        help='Path to the triple reference genomes (default: Zymos_Genomes_triple_chromosomes.fasta '
+                             'in the data folder).')
+    parser.add_argument('-k', type=int, default=sketches.KSIZE, dest='ksize', help='K-mer size (up to 32).')
+    parser.add_argument('--scaled', type=int, default=sketches.SCALED, dest='scaled',
+                        help='Keep one in every `scaled` k-mers in the sketches.')
+    parser.add_argument('-t', type=int, dest='threads', help='Number of worker processes.')
+    parser.add_argument('--cache', type=str, default=sketches.CACHE_DIR, dest='cache_dir',
+                        help='Sketch cache directory.')
+    parser.add_argument('--no-cache', action='store_const', const=None, dest='cache_dir',
+                        help='Do not read or write the sketch cache.')
+    parser.add_argument('--store', type=str, dest='store',
+                        help='SQLite results store to upsert the sketch metrics per reference into.')
+    parser.add_argument('--sample', type=str, dest='sample',
+                        help='Sample name for the results store (default: from the assembly file names).')
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    if not 0 < args.ksize <= 32:
+        parser.error('the k-mer size must be between 1 and 32')
+    if args.scaled < 1:
+        parser.error('the scaled factor must be at least 1')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    assemblies = manifest.list_files(args.assemblies, '.fasta')
+    if not assemblies:
+        print("files not found")
+        sys.exit(0)
+
+    with profiling.stage('sketch_references', items=1):
+        reference_sketches = sketches.get_sketches(args.reference, args.ksize, args.scaled, True, args.cache_dir)
+
+    with profiling.stage('sketch_assemblies', items=len(assemblies)):
+        assembly_sketches = sketches.sketch_files(assemblies, args.ksize, args.scaled, False, args.cache_dir,
+                                                  args.threads)
+
+    store = results_store.connect(args.store) if args.store else None
+
+    for assembly in assemblies:
+        assembler = utils.get_assember_name(assembly)
+        assembly_sketch = next(iter(assembly_sketches[assembly].values()), [])
+
+        with profiling.stage('get_sketch_stats', assembler, len(reference_sketches)):
+            stats = get_sketch_stats(reference_sketches, assembly_sketch, args.ksize)
+
+        print('\n\n------' + assembler + '------\n')
+        print(stats.to_csv(index=False, float_format='%.4f'), end='')
+
+        if store is not None:
+            stats = stats.rename(columns=lambda column: column if column == 'Reference' else 'Sketch ' + column)
+            stats['Assembler'] = assembler
+            results_store.upsert_dataframe(store, args.sample or utils.get_sample_name(assembly), stats,
+                                           [column for column in stats.columns if column.startswith('Sketch ')])
+
+    if store is not None:
+        store.close()
+
+    profiling.report(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+FracMinHash k-mer sketches of fasta files, cached on disk, for alignment-free comparisons of assemblies and references.
+
+A FracMinHash sketch keeps the hashes of the canonical k-mers of a sequence that fall below 2^64/scaled, so roughly
+one in every `scaled` distinct k-mers. Two sketches built with the same k and scaled can be intersected directly: the
+fraction of the hashes of A found in B estimates the fraction of the k-mers of A contained in B.
+
+The fasta files are read as a stream of bytes, in chunks of bounded size (with a k-1 bases overlap between chunks), and
+the k-mers of each chunk are encoded, reverse complemented and hashed with numpy array operations. K-mers with bases
+other than ACGT are skipped. For the triple reference genomes, sketching the whole record gives the same sketch as a
+single copy, plus the k-mers spanning the start/end junction of the (circular) chromosome.
+
+Sketches are saved as `.npz` files in a cache directory, keyed by the path, size and modification time of the fasta
+file and by the sketch parameters, so each file is only sketched once. Several files are sketched in parallel, one
+per worker process.
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import hashlib
+from multiprocessing import Pool
+import numpy as np
+
+SKETCH_VERSION = 1
+KSIZE = 21
+SCALED = 1000
+CACHE_DIR = '.sketch_cache'
+CHUNK_SIZE = 4 * 1024 * 1024  # maximum number of bases hashed at once
+
+# 2-bit code of each byte (4 for bases other than ACGT)
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, bases in enumerate([b'Aa', b'Cc', b'Gg', b'Tt']):
+    BASE_CODES[list(bases)] = code
+
+
+def hash_kmers(kmers):
+    """
+    Mixes 2-bit encoded k-mers into uniformly distributed 64 bit hashes (splitmix64 finalizer).
+    :param kmers: numpy array of uint64 encoded k-mers
+    :return: numpy array of uint64 hashes
+    """
+    with np.errstate(over='ignore'):
+        kmers = kmers ^ (kmers >> np.uint64(30))
+        kmers = kmers * np.uint64(0xbf58476d1ce4e5b9)
+        kmers = kmers ^ (kmers >> np.uint64(27))
+        kmers = kmers * np.uint64(0x94d049bb133111eb)
+        return kmers ^ (kmers >> np.uint64(31))
+
+
+def get_sequence_hashes(sequence, ksize=KSIZE, scaled=SCALED):
+    """
+    Gets the FracMinHash hashes of the canonical k-mers of a sequence.
+    :param sequence: bytes with the sequence
+    :param ksize: int with k-mer size (up to 32)
+    :param scaled: int with the scaled factor, at least 1 (keep hashes below 2^64/scaled, all of them with 1)
+    :return: numpy array of uint64 hashes (unsorted, may have duplicates)
+    """
+    codes = BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+    n_kmers = len(codes) - ksize + 1
+    if n_kmers <= 0:
+        return np.empty(0, dtype=np.uint64)
+
+    # k-mers with invalid bases, from the number of invalid bases in each window
+    invalid = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == 4, out=invalid[1:])
+    valid = invalid[ksize:] == invalid[:n_kmers]
+
+    bases = np.minimum(codes, 3).astype(np.uint64)
+    complement = np.uint64(3) - bases
+    forward = np.zeros(n_kmers, dtype=np.uint64)
+    reverse = np.zeros(n_kmers, dtype=np.uint64)
+    for i in range(ksize):
+        forward = (forward << np.uint64(2)) | bases[i:i + n_kmers]
+        reverse = (reverse << np.uint64(2)) | complement[ksize - 1 - i:ksize - 1 - i + n_kmers]
+
+    hashes = hash_kmers(np.minimum(forward, reverse)[valid])
+    if scaled == 1:
+        return hashes
+    # 2^64 doesn't fit in a uint64
+    return hashes[hashes < np.uint64(2 ** 64 - 1) // np.uint64(scaled)]
+
+
+def iter_chunks(fasta_file, ksize=KSIZE, chunk_size=CHUNK_SIZE):
+    """
+    Reads the sequences of a fasta file in chunks of bounded size, overlapping by k-1 bases.
+    :param fasta_file: path to the fasta file
+    :param ksize: int with k-mer size
+    :param chunk_size: int with the number of bases that triggers a new chunk
+    :return: tuples with header and bytes with a chunk of its sequence (yield)
+    """
+    header, lines, size = None, [], 0
+    with open(fasta_file, 'rb') as fh:
+        for line in fh:
+            if line.startswith(b'>'):
+                if header is not None and size:
+                    yield header, b''.join(lines)
+                header, lines, size = line[1:].split()[0].decode(), [], 0
+            else:
+                line = line.strip()
+                lines.append(line)
+                size += len(line)
+                if size >= chunk_size:
+                    chunk = b''.join(lines)
+                    yield header, chunk
+                    lines, size = [chunk[-(ksize - 1):]], ksize - 1
+    if header is not None and size:
+        yield header, b''.join(lines)
+
+
+def sketch_fasta(fasta_file, ksize=KSIZE, scaled=SCALED, per_record=False):
+    """
+    Builds the FracMinHash sketch of a fasta file, or of each of its records.
+    :param fasta_file: path to the fasta file
+    :param ksize: int with k-mer size
+    :param scaled: int with the scaled factor
+    :param per_record: Bool to build a sketch per record instead of a single sketch of the whole file
+    :return: dict with record names (or the file name) as keys and sorted numpy arrays of unique hashes as values
+    """
+    name = os.path.basename(fasta_file)
+    hashes = {}
+    for header, chunk in iter_chunks(fasta_file, ksize):
+        hashes.setdefault(header if per_record else name, []).append(get_sequence_hashes(chunk, ksize, scaled))
+    return {key: np.unique(np.concatenate(values)) for key, values in hashes.items()}
+
+
+def get_cache_file(fasta_file, ksize=KSIZE, scaled=SCALED, per_record=False, cache_dir=CACHE_DIR):
+    """
+    :param fasta_file: path to the fasta file
+    :param ksize: int with k-mer size
+    :param scaled: int with the scaled factor
+    :param per_record: Bool for a sketch per record
+    :param cache_dir: path to the cache directory
+    :return: path to the cached sketch of the file, which changes with the file size and modification time
+    """
+    path = os.path.abspath(fasta_file)
+    stat = os.stat(path)
+    key = f'{SKETCH_VERSION}:{path}:{stat.st_size}:{stat.st_mtime_ns}:{ksize}:{scaled}:{per_record}'
+    return os.path.join(cache_dir, os.path.basename(path) + '.' + hashlib.md5(key.encode()).hexdigest()[:16] + '.npz')
+
+
+def save_sketches(sketches, sketch_file):
+    """
+    Saves sketches as a single npz file (names, concatenated hashes and offsets), replacing it atomically.
+    :param sketches: dict with names as keys and numpy arrays of hashes as values
+    :param sketch_file: path to the npz file
+    """
+    names = list(sketches)
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([len(sketches[name]) for name in names], out=offsets[1:])
+    hashes = np.concatenate([sketches[name] for name in names]) if names else np.empty(0, dtype=np.uint64)
+
+    tmp_file = sketch_file + '.' + str(os.getpid()) + '.tmp.npz'
+    np.savez(tmp_file, names=np.array(names, dtype=str), hashes=hashes, offsets=offsets)
+    os.replace(tmp_file, sketch_file)
+
+
+def load_sketches(sketch_file):
+    """
+    :param sketch_file: path to the npz file (see save_sketches)
+    :return: dict with names as keys and numpy arrays of hashes as values
+    """
+    with np.load(sketch_file) as data:
+        offsets = data['offsets']
+        return {str(name): data['hashes'][offsets[i]:offsets[i + 1]] for i, name in enumerate(data['names'])}
+
+
+def get_sketches(fasta_file, ksize=KSIZE, scaled=SCALED, per_record=False, cache_dir=CACHE_DIR):
+    """
+    Gets the sketches of a fasta file from the cache, building and caching them if needed.
+    :param fasta_file: path to the fasta file
+    :param ksize: int with k-mer size
+    :param scaled: int with the scaled factor
+    :param per_record: Bool for a sketch per record
+    :param cache_dir: path to the cache directory (None to disable the cache)
+    :return: dict with record names (or the file name) as keys and sorted numpy arrays of unique hashes as values
+    """
+    if cache_dir is None:
+        return sketch_fasta(fasta_file, ksize, scaled, per_record)
+
+    sketch_file = get_cache_file(fasta_file, ksize, scaled, per_record, cache_dir)
+    if os.path.isfile(sketch_file):
+        return load_sketches(sketch_file)
+
+    sketches = sketch_fasta(fasta_file, ksize, scaled, per_record)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_sketches(sketches, sketch_file)
+    return sketches
+
+
+def _get_sketches(task):
+    return get_sketches(*task)
+
+
+def sketch_files(fasta_files, ksize=KSIZE, scaled=SCALED, per_record=False, cache_dir=CACHE_DIR, threads=None):
+    """
+    Gets the sketches of several fasta files, sketching the files missing from the cache in a pool of worker processes.
+    :param fasta_files: list of paths to fasta files
+    :param ksize: int with k-mer size
+    :param scaled: int with the scaled factor
+    :param per_record: Bool for a sketch per record
+    :param cache_dir: path to the cache directory (None to disable the cache)
+    :param threads: number of worker processes (default: number of CPUs)
+    :return: dict with fasta files as keys and get_sketches results as values
+    """
+    tasks = [(fasta_file, ksize, scaled, per_record, cache_dir) for fasta_file in fasta_files]
+    if len(tasks) <= 1 or threads == 1:
+        return {task[0]: _get_sketches(task) for task in tasks}
+
+    with Pool(threads) as pool:
+        return dict(zip(fasta_files, pool.map(_get_sketches, tasks, chunksize=1)))
+
+
+def get_containment(query, target):
+    """
+    :param query: sorted numpy array of unique hashes
+    :param target: sorted numpy array of unique hashes
+    :return: tuple with the number of query hashes in the target and the fraction of the query contained in the target
+    """
+    shared = len(np.intersect1d(query, target, assume_unique=True))
+    return shared, shared / len(query) if len(query) else 0.0
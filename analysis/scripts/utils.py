@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 import os
-import fnmatch
 from itertools import groupby
+import numpy as np
 import pandas as pd
 import re
 
+import profiling
+
 COLUMNS = ['Assembler', 'Contig', 'Contig Len', 'Mapped']  # columns for dataframe
 
+# implementations of the metrics: the original ones, and the vectorized ones (validated with validate_engines.py)
+ENGINES = ['legacy', 'vectorized']
+
+# mandatory columns of the PAF format
+PAF_COLUMNS = ['Contig', 'Contig Len', 'Query Start', 'Query End', 'Strand', 'Reference', 'Reference Len',
+               'Target Start', 'Target End', 'Matching Bases', 'Alignment Len', 'MapQ']
+
 # Dic for pretty print of reference names
 REFERENCE_DIC = {
     "BS.pilon.polished.v3.ST170922": "Bacillus subtilis",
@@ -29,6 +38,31 @@ def get_assember_name(assembly_file):
     return os.path.basename(assembly_file).split('.')[0].rsplit('_')[-1]
 
 
+def index_by_assembler(files):
+    """
+    Indexes a list of assembly or mapping files of a sample by assembler name, for constant time lookups.
+    :param files: list of paths
+    :return: dict with assembler names as keys and paths as values
+    """
+    index = {}
+    for path in files:
+        assembler = get_assember_name(path)
+        if assembler in index:
+            raise ValueError(f'More than one file for assembler {assembler}: {index[assembler]}, {path}')
+        index[assembler] = path
+    return index
+
+
+def get_sample_name(assembly_file):
+    """
+    get sample name from filename. Expected format: `[filtered_]<SampleName>_<AssemblerName>.fasta`
+    :param assembly_file: path
+    :return: sample name
+    """
+    sample = os.path.basename(assembly_file).split('.')[0].rsplit('_', 1)[0]
+    return sample[len('filtered_'):] if sample.startswith('filtered_') else sample
+
+
 def fasta_iter(fasta_name):
     """
     Given a fasta file. yield tuples of header, sequence.
@@ -83,31 +117,90 @@ def get_mapped_contigs_with_ref(paf_file):
     return mapped_contigs
 
 
-def parse_assemblies(assemblies, mappings):
+def read_paf(paf_file, tags=()):
+    """
+    Reads the 12 mandatory columns of a PAF file into a dataframe. Optional SAM-like tags (ex: 'cg', 'cs') are only
+    read if requested, into a column per tag with the tag value (None if missing in the line)
+    :param paf_file: path to the PAF file
+    :param tags: list of tag names to read
+    :return: pandas dataframe with PAF_COLUMNS and the requested tags
+    """
+    if not tags:
+        try:
+            return pd.read_csv(paf_file, sep='\t', header=None, usecols=range(len(PAF_COLUMNS)), names=PAF_COLUMNS,
+                               dtype={'Contig': str, 'Strand': str, 'Reference': str})
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame(columns=PAF_COLUMNS)
+
+    rows = []
+    with open(paf_file) as paf:
+        for line in paf:
+            parts = line.rstrip('\n').split('\t')
+            line_tags = {part[:2]: part[5:] for part in parts[len(PAF_COLUMNS):]}
+            rows.append(parts[:len(PAF_COLUMNS)] + [line_tags.get(tag) for tag in tags])
+
+    df = pd.DataFrame(rows, columns=PAF_COLUMNS + list(tags))
+    numeric = [col for col in PAF_COLUMNS if col not in ('Contig', 'Strand', 'Reference')]
+    df[numeric] = df[numeric].astype('int64')
+    return df
+
+
+def parse_assemblies(assemblies, mappings, engine='legacy', composition=False):
     """
     Parses fastas and paf files and returns info on 'Assembler','Contig', 'Contig Len', 'Mapped' as dataframe
     :param assemblies: list of assembly files
     :param mappings: list of paf files
+    :param engine: 'legacy' (mapped contigs looked up in a list) or 'vectorized' (in a set)
+    :param composition: Bool to add the composition of each contig (see contig_composition.COMPOSITION_COLUMNS),
+    from the bases collected in the same pass over each fasta
     :return: pandas dataframe
     """
-    df = pd.DataFrame(columns=COLUMNS)
+    # contig_composition imports this module
+    import contig_composition
+
+    rows = []
+    compositions = []
+    mapping_index = index_by_assembler(mappings)
 
     for fasta_file in assemblies:
 
         filename = get_assember_name(fasta_file)
-        mapped_contigs = get_mapped_contigs(fnmatch.filter(mappings, '*_' + filename + '.*')[0])
-
-        fasta = fasta_iter(fasta_file)
-        for header, seq in fasta:
-            if header in mapped_contigs:
-                is_mapped = 'Mapped'
-            else:
-                is_mapped = 'Unmapped'
-
-            df = df.append({'Assembler': filename, 'Contig': header, 'Contig Len': len(seq), 'Mapped': is_mapped},
-                           ignore_index=True)
-
-    df = df.reset_index()
+        with profiling.stage('parse_assemblies', filename) as stage:
+            mapped_contigs = get_mapped_contigs(mapping_index[filename])
+            if engine == 'vectorized':
+                mapped_contigs = set(mapped_contigs)
+
+            names, bases, lengths = [], bytearray(), []
+
+            fasta = fasta_iter(fasta_file)
+            stage['Items'] = 0
+            for header, seq in fasta:
+                if header in mapped_contigs:
+                    is_mapped = 'Mapped'
+                else:
+                    is_mapped = 'Unmapped'
+
+                rows.append({'Assembler': filename, 'Contig': header, 'Contig Len': len(seq), 'Mapped': is_mapped})
+                stage['Items'] += 1
+
+                if composition:
+                    names.append(header)
+                    bases += seq.upper().encode()
+                    lengths.append(len(seq))
+
+        if composition:
+            with profiling.stage('get_composition', filename, len(names)):
+                offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+                compositions.append(contig_composition.get_composition(names, np.frombuffer(bases, dtype=np.uint8),
+                                                                       offsets))
+
+    df = pd.DataFrame(rows, columns=COLUMNS).reset_index()
+
+    if composition:
+        # the composition rows are in the same order as the assembly rows
+        df_composition = pd.concat(compositions, ignore_index=True) if compositions else \
+            pd.DataFrame(columns=contig_composition.COMPOSITION_COLUMNS)
+        df = pd.concat([df, df_composition.drop(columns=['Contig', 'Contig Len'])], axis=1)
 
     return df
 
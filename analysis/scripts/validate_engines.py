@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Differential validation of the vectorized engines against the legacy implementations, before switching them on in
+production (with `--engine vectorized`, see utils.ENGINES).
+
+Each engine is run through the production function with engine='legacy' and engine='vectorized' on the same inputs,
+and every metric of the two outputs is compared within the tolerance of the engine (absolute difference). Each
+implementation is timed in a forked process, and its peak memory is the increase of the peak RSS of that process.
+The engines are:
+  * covered_bases - breadth of coverage of each reference (assembly_mapping_stats_per_ref.get_covered_bases). The
+    legacy values are also compared to the published tables (`<assembler>_breadth_of_coverage_contigs.csv`), if given.
+  * gaps - number, total and largest size of the gaps between covered bases of each reference
+    (plot_gap_sizes.get_gaps)
+  * window_identity - lowest identity in 1000 bp windows of the longest alignment of each reference
+    (assembly_mapping_stats_per_ref.get_lowest_window_identity)
+  * parse_assemblies - number of contigs, mapped contigs, mapped basepairs and contigs with a different length or
+    mapping status (utils.parse_assemblies), with the assemblies only
+
+Large inputs can be validated on a random subset of the alignments (and contigs) with --sample.
+
+This script will output to the command line, for each engine, the metrics of each case (assembler and reference) with
+the legacy and accelerated (vectorized) values, their difference and if it is within tolerance, followed by a summary
+with the failed cases, speedup (and if the vectorized engine is faster) and peak memory of each engine. It exits with
+an error if any metric is out of tolerance.
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --assemblies (optional) - path to the assembly files (ending in *.fasta), to validate parse_assemblies
+  * --published (optional) - path to the published tables (ex: results/mockSample/tables)
+  * --engines (optional) - engines to validate (default: all)
+  * --sample (optional) - fraction of the alignments (and contigs) to validate on (default: 1, all)
+  * --seed (optional) - random seed for --sample
+  * --tolerance (optional) - tolerance of an engine, as `<engine>=<value>` (can be repeated)
+  * --no-memory (optional) - do not measure the peak memory
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+import plot_gap_sizes
+import assembly_mapping_stats_per_ref
+
+WINDOW_SIZE = 1000
+
+# maximum absolute difference between the legacy and accelerated value of each metric of an engine
+TOLERANCES = {'covered_bases': 1e-6, 'gaps': 0, 'window_identity': 1e-9, 'parse_assemblies': 0}
+
+VALIDATION_COLUMNS = ['Case', 'Metric', 'Legacy', 'Accelerated', 'Difference', 'Within Tolerance']
+SUMMARY_COLUMNS = ['Engine', 'Cases', 'Failed', 'Legacy (s)', 'Accelerated (s)', 'Speedup', 'Faster',
+                   'Legacy Peak (MB)', 'Accelerated Peak (MB)']
+
+
+def get_reference_cases(mappings, assemblies=None):
+    """
+    :param mappings: list of paf files
+    :param assemblies: list of assembly files (not used)
+    :return: list of dicts with the assembler, paf file, PAF rows, reference and single copy reference length of each
+    assembler and reference
+    """
+    cases = []
+    for paf_file in mappings:
+        paf_df = utils.read_paf(paf_file, tags=('cg',))
+        for reference, df in paf_df.groupby('Reference', sort=True):
+            cases.append({'Case': utils.get_assember_name(paf_file) + ' ' + utils.REFERENCE_DIC.get(reference,
+                                                                                                     reference),
+                          'assembler': utils.get_assember_name(paf_file), 'paf_file': paf_file, 'rows': df,
+                          'reference': reference, 'ref_len': int(df['Reference Len'].iloc[0]) // 3})
+    return cases
+
+
+def get_covered_bases_cases(mappings, assemblies=None):
+    """
+    :return: list of dicts with the inputs of each case (see get_reference_cases), with the alignment coordinates
+    """
+    cases = get_reference_cases(mappings)
+    for case in cases:
+        case['intervals'] = case['rows'][['Target Start', 'Target End']].values.tolist()
+    return cases
+
+
+def covered_bases(case, engine):
+    """
+    :param case: dict with the inputs of the case
+    :param engine: implementation (see utils.ENGINES)
+    :return: dict with the metrics of the case
+    """
+    return {'Breadth of Coverage': assembly_mapping_stats_per_ref.get_covered_bases(case['intervals'], case['ref_len'],
+                                                                                    engine)}
+
+
+def get_gap_metrics(gap_sizes):
+    """
+    :param gap_sizes: list or numpy array of gap sizes
+    :return: dict with the number, total size and largest gap
+    """
+    return {'Gaps': len(gap_sizes), 'Gap bp': int(np.sum(gap_sizes)), 'Largest gap': int(np.max(gap_sizes, initial=0))}
+
+
+def gaps(case, engine):
+    """
+    :param case: dict with the inputs of the case
+    :param engine: implementation (see utils.ENGINES)
+    :return: dict with the metrics of the case
+    """
+    return get_gap_metrics(plot_gap_sizes.get_gaps(case['paf_file'], case['reference'], case['ref_len'], engine))
+
+
+def get_window_identity_cases(mappings, assemblies=None):
+    """
+    :return: list of dicts with the inputs of each case (see get_reference_cases), with the CIGAR of the longest
+    alignment
+    """
+    cases = []
+    for case in get_reference_cases(mappings):
+        # the longest alignment of each reference, as in assembly_mapping_stats_per_ref.get_alignment_stats
+        rows = case['rows']
+        longest = rows.iloc[int(np.argmax((rows['Target End'] - rows['Target Start']).values))]
+        case['cigar'] = 'cg:Z:' + longest['cg'] if longest['cg'] else ''
+        cases.append(case)
+    return cases
+
+
+def window_identity(case, engine):
+    """
+    :param case: dict with the inputs of the case
+    :param engine: implementation (see utils.ENGINES)
+    :return: dict with the metrics of the case
+    """
+    return {'Lowest Identity': assembly_mapping_stats_per_ref.get_lowest_window_identity(case['cigar'], WINDOW_SIZE,
+                                                                                         engine)}
+
+
+def get_parse_assemblies_cases(mappings, assemblies):
+    """
+    :return: list of dicts with the assembly and paf file of each assembler
+    """
+    mapping_index = utils.index_by_assembler(mappings)
+    return [{'Case': utils.get_assember_name(assembly), 'assembly': assembly,
+             'mapping': mapping_index[utils.get_assember_name(assembly)]}
+            for assembly in assemblies if utils.get_assember_name(assembly) in mapping_index]
+
+
+def parse_assemblies(case, engine):
+    """
+    :param case: dict with the inputs of the case
+    :param engine: implementation (see utils.ENGINES)
+    :return: dict with the number of contigs, mapped contigs and mapped basepairs, and the contigs table
+    """
+    contigs = utils.parse_assemblies([case['assembly']], [case['mapping']], engine)
+    mapped = contigs['Mapped'] == 'Mapped'
+    return {'Contigs': len(contigs), 'Mapped contigs': int(mapped.sum()),
+            'Mapped bp': int(contigs['Contig Len'][mapped].sum()), 'contigs': contigs}
+
+
+def compare_parse_assemblies(legacy, accelerated):
+    """
+    Adds the number of contigs with a different length or mapping status in the two outputs.
+    :param legacy: dict with the legacy output (see parse_assemblies)
+    :param accelerated: dict with the accelerated output (see parse_assemblies)
+    """
+    merged = legacy.pop('contigs').merge(accelerated.pop('contigs'), on='Contig', how='outer', indicator=True)
+    different = (merged['_merge'] != 'both') | (merged['Contig Len_x'] != merged['Contig Len_y']) | \
+        (merged['Mapped_x'] != merged['Mapped_y'])
+    legacy['Different contigs'] = 0
+    accelerated['Different contigs'] = int(different.sum())
+
+
+# engine name: (get cases, implementation run with engine='legacy' and 'vectorized', optional function comparing the
+# outputs)
+ENGINES = {
+    'covered_bases': (get_covered_bases_cases, covered_bases, None),
+    'gaps': (get_reference_cases, gaps, None),
+    'window_identity': (get_window_identity_cases, window_identity, None),
+    'parse_assemblies': (get_parse_assemblies_cases, parse_assemblies, compare_parse_assemblies),
+}
+
+
+def _measure(function, case, engine, connection):
+    baseline = profiling.get_peak_rss()
+    start = time.perf_counter()
+    output = function(case, engine)
+    wall = time.perf_counter() - start
+    connection.send((output, wall, profiling.get_peak_rss() - baseline))
+    connection.close()
+
+
+def run(function, case, engine, memory=True):
+    """
+    Runs an implementation and times it. To measure its peak memory, it is run in a forked process, starting with the
+    memory of this process, and its peak memory is the increase of the peak RSS of that process.
+    :param function: implementation of an engine
+    :param case: dict with the inputs of the case
+    :param engine: implementation (see utils.ENGINES)
+    :param memory: Bool to measure the peak memory
+    :return: tuple with the output, wall time in seconds and peak memory in MB (NaN if not measured)
+    """
+    if not memory:
+        start = time.perf_counter()
+        output = function(case, engine)
+        return output, time.perf_counter() - start, np.nan
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(target=_measure, args=(function, case, engine, sender))
+    process.start()
+    sender.close()
+    try:
+        output, wall, peak = receiver.recv()
+    except EOFError:
+        output = None
+    process.join()
+    if output is None:
+        raise RuntimeError(f'{function.__name__} ({engine}) failed (exit code {process.exitcode})')
+    return output, wall, peak
+
+
+def validate_engine(engine, mappings, assemblies, tolerance, memory=True):
+    """
+    Runs the legacy and vectorized implementation of an engine on each case and compares their outputs.
+    :param engine: engine name (see ENGINES)
+    :param mappings: list of paf files
+    :param assemblies: list of assembly files
+    :param tolerance: maximum absolute difference of each metric
+    :param memory: Bool to measure the peak memory
+    :return:
+        - pandas DataFrame with VALIDATION_COLUMNS, one row per case and metric
+        - dict with SUMMARY_COLUMNS
+    """
+    get_cases, function, compare = ENGINES[engine]
+    cases = get_cases(mappings, assemblies)
+
+    rows = []
+    times, peaks = [0.0, 0.0], [0.0, 0.0]
+    for case in cases:
+        with profiling.stage('validate_' + engine, case['Case']):
+            legacy_output, legacy_time, legacy_peak = run(function, case, 'legacy', memory)
+            accelerated_output, accelerated_time, accelerated_peak = run(function, case, 'vectorized', memory)
+        if compare:
+            compare(legacy_output, accelerated_output)
+
+        times = [times[0] + legacy_time, times[1] + accelerated_time]
+        peaks = [max(peaks[0], legacy_peak), max(peaks[1], accelerated_peak)]
+        for metric, legacy_value in legacy_output.items():
+            difference = abs(accelerated_output[metric] - legacy_value)
+            rows.append([case['Case'], metric, legacy_value, accelerated_output[metric], difference,
+                         difference <= tolerance])
+
+    df = pd.DataFrame(rows, columns=VALIDATION_COLUMNS)
+    failed = df.loc[~df['Within Tolerance'], 'Case'].nunique() if len(df) else 0
+    speedup = times[0] / times[1] if times[1] else np.nan
+    summary = dict(zip(SUMMARY_COLUMNS, [engine, len(cases), failed, times[0], times[1], speedup, speedup > 1,
+                                         peaks[0] if memory else np.nan, peaks[1] if memory else np.nan]))
+    return df, summary
+
+
+def compare_published(df, published_dir, tolerance):
+    """
+    Compares the legacy breadth of coverage with the published tables.
+    :param df: pandas DataFrame with the covered_bases validation (see validate_engine)
+    :param published_dir: path to the `<assembler>_breadth_of_coverage_contigs.csv` tables
+    :param tolerance: maximum absolute difference
+    :return: pandas DataFrame with Case, Published, Legacy, Difference and Within Tolerance columns (cases with a
+    published value)
+    """
+    rows = []
+    for case, legacy_value in df[['Case', 'Legacy']].itertuples(index=False):
+        assembler, reference = case.split(' ', 1)
+        table = os.path.join(published_dir, assembler + '_breadth_of_coverage_contigs.csv')
+        if not os.path.isfile(table):
+            continue
+        published = pd.read_csv(table, skipinitialspace=True).set_index('Reference')['Breadth of Coverage']
+        if reference in published.index:
+            difference = abs(legacy_value - published[reference])
+            rows.append([case, published[reference], legacy_value, difference, difference <= tolerance])
+    return pd.DataFrame(rows, columns=['Case', 'Published', 'Legacy', 'Difference', 'Within Tolerance'])
+
+
+def sample_inputs(mappings, assemblies, fraction, output_dir, seed=None):
+    """
+    Writes a random subset of the alignments of each paf file, and of the contigs of each assembly.
+    :param mappings: list of paf files
+    :param assemblies: list of assembly files
+    :param fraction: fraction of the alignments and contigs to keep
+    :param output_dir: path to the directory of the subsets
+    :param seed: optional random seed
+    :return: tuple with the lists of sampled paf and assembly files
+    """
+    rng = random.Random(seed)
+
+    sampled_mappings = []
+    for paf_file in mappings:
+        sampled_mappings.append(os.path.join(output_dir, os.path.basename(paf_file)))
+        with open(paf_file) as paf, open(sampled_mappings[-1], 'w') as out:
+            out.writelines(line for line in paf if rng.random() < fraction)
+
+    sampled_assemblies = []
+    for fasta_file in assemblies:
+        sampled_assemblies.append(os.path.join(output_dir, os.path.basename(fasta_file)))
+        with open(sampled_assemblies[-1], 'w') as out:
+            for header, seq in utils.fasta_iter(fasta_file):
+                if rng.random() < fraction:
+                    out.write('>' + header + '\n' + seq + '\n')
+
+    return sampled_mappings, sampled_assemblies
+
+
+def parse_tolerance(value):
+    """
+    :param value: string with `<engine>=<tolerance>`
+    :return: tuple with engine name and tolerance
+    """
+    engine, _, tolerance = value.partition('=')
+    if engine not in ENGINES:
+        raise argparse.ArgumentTypeError(f'unknown engine: {engine}')
+    try:
+        return engine, float(tolerance)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid tolerance: {value}')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--assemblies', type=str, dest='assemblies',
+                        help='Path to the assembly files (ending in *.fasta), to validate parse_assemblies.')
+    parser.add_argument('--published', type=str, dest='published',
+                        help='Path to the published tables (ex: results/mockSample/tables).')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES), dest='engines',
+                        help='Engines to validate.')
+    parser.add_argument('--sample', type=float, default=1.0, dest='sample',
+                        help='Fraction of the alignments (and contigs) to validate on.')
+    parser.add_argument('--seed', type=int, dest='seed', help='Random seed for --sample.')
+    parser.add_argument('--tolerance', type=parse_tolerance, action='append', default=[], dest='tolerances',
+                        help='Tolerance of an engine, as <engine>=<value> (can be repeated).')
+    parser.add_argument('--no-memory', action='store_false', dest='memory', help='Do not measure the peak memory.')
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    if not 0 < args.sample <= 1:
+        parser.error('the sample fraction must be between 0 and 1')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    if args.assemblies:
+        assemblies, mappings = manifest.get_paired_files(args.assemblies, args.mappings)
+    else:
+        assemblies, mappings = [], manifest.list_files(args.mappings, '.paf')
+    if not mappings:
+        print("files not found")
+        sys.exit(0)
+
+    tolerances = dict(TOLERANCES, **dict(args.tolerances))
+    engines = [engine for engine in args.engines if engine != 'parse_assemblies' or assemblies]
+
+    with tempfile.TemporaryDirectory() as sample_dir:
+        if args.sample < 1:
+            mappings, assemblies = sample_inputs(mappings, assemblies, args.sample, sample_dir, args.seed)
+
+        summaries = []
+        failed = False
+        for engine in engines:
+            df, summary = validate_engine(engine, mappings, assemblies, tolerances[engine], args.memory)
+            summaries.append(summary)
+            failed |= summary['Failed'] > 0
+
+            print('\n\n------' + engine + '------\n')
+            print(df.to_csv(index=False), end='')
+
+            # the published tables are only comparable on all the alignments
+            if engine == 'covered_bases' and args.published and args.sample == 1:
+                df_published = compare_published(df, args.published, tolerances[engine])
+                failed |= not df_published['Within Tolerance'].all()
+                print('\n\n------published------\n')
+                print(df_published.to_csv(index=False), end='')
+
+    print('\n\n------Summary------\n')
+    print(pd.DataFrame(summaries, columns=SUMMARY_COLUMNS).to_csv(index=False, float_format='%.4f'), end='')
+
+    profiling.report(args)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
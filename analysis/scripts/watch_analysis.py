@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Watch mode: analyses each assembly as soon as it and its mapping are published, instead of waiting for the slowest
+assembler.
+
+The assembly and mapping directories are polled (see manifest.py, without checksums) every --interval seconds. An
+assembly/PAF pair is ready when both files are non-empty, end with a newline and haven't been modified for --settle
+seconds. Each ready pair is analysed on its own and its metrics are upserted into the results store:
+  * assembly statistics (see assembly_stats_global.py)
+  * mapped contigs and basepairs (see assembly_mapping_stats_global.py)
+  * mapping stats per reference (see assembly_mapping_stats_per_ref.py)
+After each batch, the aggregate tables of all the analysed assemblers are rebuilt from the store with a single query:
+  * assembly_stats.csv - assembly and mapping statistics, one row per sample and assembler
+  * reference_stats.csv - mapping stats, one row per sample, assembler and reference
+
+The files of each analysed pair are recorded in a state file (size and modification time), so restarting the watch
+doesn't repeat the work, and a pair is only analysed again if one of its files changes. The watch exits with an error
+listing the pairs whose analysis failed.
+
+Expected input
+--------------
+This script takes the following arguments (in this order):
+  * Path to the metagenomic assembly files (ending in *.fasta)
+  * Path to the mapped contigs to the triple reference genomes (ending in *.paf)
+  * --reference (optional) - path to the triple reference genomes
+  * -o (optional) - output directory for the aggregate tables, results store and state file (default: .)
+  * --store (optional) - SQLite results store (see results_store.py) (default: results.db in the output directory)
+  * --interval (optional) - seconds between polls (default: 60)
+  * --settle (optional) - seconds without modifications for a file to be considered complete (default: 30)
+  * --expected (optional) - stop after this number of pairs are analysed, including the failed ones (default: run
+    until interrupted)
+  * --once (optional) - analyse the ready pairs and stop
+  * --recursive (optional) - also look for files in subdirectories
+  * --min-fraction (optional) - minimum fraction of aligned bases in a reference to assign a contig to it
+  * --engine (optional) - implementation of the breadth of coverage, lowest identity and assembly parsing: legacy or
+    vectorized (see validate_engines.py) (default: vectorized)
+
+The triple bacterial reference files for the zymos mock community are available at
+"../../data/references/Zymos_Genomes_triple_chromosomes.fasta"
+
+Authorship
+----------
+Inês Mendes, cimendes@medicina.ulisboa.pt
+https://github.com/cimendes
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+#import commonly used functions from utils.py
+import utils
+import profiling
+import manifest
+import results_store
+import assembly_stats_global
+import assembly_mapping_stats_global
+import assembly_mapping_stats_per_ref
+
+POLL_INTERVAL = 60
+SETTLE_TIME = 30
+STATE_FILE = 'watch_state.json'
+
+ASSEMBLY_METRICS = assembly_stats_global.ASSEMBLY_STATS_COLUMNS[1:] + ['Mapped contigs', 'Mapped bp']
+REFERENCE_METRICS = assembly_mapping_stats_per_ref.REFERENCE_STATS_COLUMNS[1:]
+
+
+def is_complete(path, record, settle_time=SETTLE_TIME, now=None):
+    """
+    Checks if a file has finished being written: non-empty, ending in a newline and not modified for settle_time.
+    :param path: path to the file
+    :param record: dict with the size and mtime_ns of the file (see manifest.get_file_record)
+    :param settle_time: seconds without modifications
+    :param now: optional current time, in seconds since the epoch
+    :return: Bool
+    """
+    if record['size'] == 0 or (now or time.time()) - record['mtime_ns'] / 1e9 < settle_time:
+        return False
+    with open(path, 'rb') as fh:
+        fh.seek(-1, os.SEEK_END)
+        return fh.read(1) == b'\n'
+
+
+def get_signature(entry, files):
+    """
+    :param entry: dict with a manifest entry (see manifest.build_manifest)
+    :param files: dict with the file records of the manifest
+    :return: list with the size and modification time of the assembly and mapping files
+    """
+    return [files[entry[kind]][field] for kind in ('assembly', 'mapping') for field in ('size', 'mtime_ns')]
+
+
+def get_pair_key(entry):
+    """
+    :param entry: dict with a manifest entry
+    :return: string with the group, sample and assembler of the entry
+    """
+    return '/'.join([entry['group'], entry['sample'], entry['assembler']])
+
+
+def get_pair_sample(entry):
+    """
+    :param entry: dict with a manifest entry
+    :return: string with the sample name, with the group (ex: minimum contig length) appended if any
+    """
+    return entry['sample'] + ('_' + entry['group'] if entry['group'] else '')
+
+
+def get_ready_pairs(current_manifest, state, settle_time=SETTLE_TIME):
+    """
+    Gets the assembly/mapping pairs that are complete and weren't analysed yet (or changed since).
+    :param current_manifest: dict with the manifest (see manifest.build_manifest)
+    :param state: dict with pair keys as keys and the signature of the analysed files as values
+    :param settle_time: seconds without modifications for a file to be considered complete
+    :return: list of manifest entries
+    """
+    files = current_manifest['files']
+    now = time.time()
+
+    ready = []
+    for entry in current_manifest['entries']:
+        if entry['status'] != 'OK' or state.get(get_pair_key(entry), {}).get('signature') == \
+                get_signature(entry, files):
+            continue
+        if all(is_complete(entry[kind], files[entry[kind]], settle_time, now) for kind in ('assembly', 'mapping')):
+            ready.append(entry)
+    return ready
+
+
+def get_pair_metrics(assembly, mapping, reference_file, min_fraction=None, engine='legacy'):
+    """
+    Computes the metrics of a single assembler.
+    :param assembly: path to the assembly file
+    :param mapping: path to the paf file
+    :param reference_file: path to the triple reference fasta file
+    :param min_fraction: minimum fraction of aligned bases in a reference to assign a contig to it (default: majority)
+    :param engine: implementation of the breadth of coverage, lowest identity and assembly parsing (see utils.ENGINES)
+    :return:
+        - pandas DataFrame with Assembler and ASSEMBLY_METRICS, with one row
+        - pandas DataFrame with Assembler and REFERENCE_METRICS, one row per reference
+    """
+    df_assembly = assembly_stats_global.get_assembly_stats([assembly])
+    metrics = assembly_mapping_stats_per_ref.get_sample_metrics([assembly], [mapping], reference_file, min_fraction,
+                                                                engine)
+    df_mapping = assembly_mapping_stats_global.get_mapping_summary(utils.parse_assemblies([assembly], [mapping],
+                                                                                          engine))
+
+    df_assembly = df_assembly.merge(df_mapping[['Assembler', 'Mapped contigs', 'Mapped bp']], on='Assembler')
+    return df_assembly, metrics.references
+
+
+def analyse_pair(store, sample, assembly, mapping, reference_file, min_fraction=None, engine='legacy'):
+    """
+    Computes the metrics of a single assembler and upserts them into the results store.
+    :param store: sqlite3 connection to the results store
+    :param sample: string with sample name
+    :param assembly: path to the assembly file
+    :param mapping: path to the paf file
+    :param reference_file: path to the triple reference fasta file
+    :param min_fraction: minimum fraction of aligned bases in a reference to assign a contig to it (default: majority)
+    :param engine: implementation of the breadth of coverage, lowest identity and assembly parsing (see utils.ENGINES)
+    """
+    df_assembly, df_references = get_pair_metrics(assembly, mapping, reference_file, min_fraction, engine)
+    results_store.upsert_dataframe(store, sample, df_assembly, ASSEMBLY_METRICS)
+    assembly_mapping_stats_per_ref.store_reference_stats(store, sample, df_references)
+
+
+def refresh_tables(store, samples, output_dir):
+    """
+    Rebuilds the aggregate tables of the analysed samples from the results store.
+    :param store: sqlite3 connection to the results store
+    :param samples: list of sample names
+    :param output_dir: path to the output directory
+    """
+    for filename, metrics in [('assembly_stats.csv', ASSEMBLY_METRICS), ('reference_stats.csv', REFERENCE_METRICS)]:
+        df = results_store.get_metrics(store, metrics, samples)
+        if filename == 'assembly_stats.csv':
+            df = df.drop(columns='Reference')
+        path = os.path.join(output_dir, filename)
+        df.to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+
+def load_state(state_file):
+    """
+    :param state_file: path to the state file
+    :return: dict with pair keys as keys and dicts with the sample and signature of the analysed files as values
+    """
+    if not os.path.isfile(state_file):
+        return {}
+    with open(state_file) as fh:
+        return json.load(fh)
+
+
+def save_state(state, state_file):
+    """
+    :param state: dict with the analysed pairs (see load_state)
+    :param state_file: path to the state file
+    """
+    with open(state_file + '.tmp', 'w') as fh:
+        json.dump(state, fh, indent=1)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def watch(args):
+    """
+    Polls the assembly and mapping directories, analysing the pairs as they become ready, until interrupted, until
+    --expected pairs are analysed (successfully or not), or after a single pass with --once.
+    :param args: parsed command line arguments (see parse_arguments)
+    :return: list with the keys of the pairs whose analysis failed
+    """
+    state_file = os.path.join(args.output_dir, STATE_FILE)
+    state = load_state(state_file)
+    store = results_store.connect(args.store or os.path.join(args.output_dir, 'results.db'))
+
+    try:
+        while True:
+            current_manifest = manifest.build_manifest(args.assemblies, args.mappings, recursive=args.recursive,
+                                                       checksum=False)
+            ready = get_ready_pairs(current_manifest, state, args.settle)
+
+            for entry in ready:
+                key = get_pair_key(entry)
+                sample = get_pair_sample(entry)
+                with profiling.stage('analyse_pair', entry['assembler']):
+                    try:
+                        analyse_pair(store, sample, entry['assembly'], entry['mapping'], args.reference,
+                                     args.min_fraction, args.engine)
+                        status = 'OK'
+                    except Exception as e:
+                        # not retried until one of the files changes
+                        status = f'failed: {e}'
+
+                state[key] = {'sample': sample, 'signature': get_signature(entry, current_manifest['files']),
+                              'status': status}
+                save_state(state, state_file)
+                print(f'{time.strftime("%H:%M:%S")} {key}: {status}', file=sys.stderr)
+
+            if ready:
+                with profiling.stage('refresh_tables'):
+                    refresh_tables(store, sorted({pair['sample'] for pair in state.values()}), args.output_dir)
+
+            # failed pairs are only retried when one of their files changes, so they count as analysed
+            if args.once or (args.expected and len(state) >= args.expected):
+                break
+            time.sleep(args.interval)
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+    return sorted(key for key, pair in state.items() if pair['status'] != 'OK')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('assemblies', type=str, help='Path to the assembly files (ending in *.fasta).')
+    parser.add_argument('mappings', type=str, help='Path to the mapped contigs (ending in *.paf).')
+    parser.add_argument('--reference', type=str, default=assembly_mapping_stats_per_ref.REFERENCE_SEQUENCES,
+                        dest='reference',
+                        help='Path to the triple reference genomes (default: Zymos_Genomes_triple_chromosomes.fasta '
+                             'in the data folder).')
+    parser.add_argument('-o', type=str, default='.', dest='output_dir',
+                        help='Output directory for the aggregate tables, results store and state file.')
+    parser.add_argument('--store', type=str, dest='store',
+                        help='SQLite results store (default: results.db in the output directory).')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, dest='interval',
+                        help='Seconds between polls.')
+    parser.add_argument('--settle', type=float, default=SETTLE_TIME, dest='settle',
+                        help='Seconds without modifications for a file to be considered complete.')
+    parser.add_argument('--expected', type=int, dest='expected',
+                        help='Stop after this number of pairs are analysed (including the failed ones).')
+    parser.add_argument('--once', action='store_true', dest='once', help='Analyse the ready pairs and stop.')
+    parser.add_argument('--recursive', action='store_true', dest='recursive',
+                        help='Also look for files in subdirectories.')
+    parser.add_argument('--min-fraction', type=float, dest='min_fraction',
+                        help='Minimum fraction of aligned bases to assign a contig (default: majority).')
+    parser.add_argument('--engine', choices=utils.ENGINES, default='vectorized', dest='engine',
+                        help='Implementation of the breadth of coverage, lowest identity and assembly parsing.')
+    profiling.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    profiling.setup(args)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    failed = watch(args)
+
+    profiling.report(args)
+    if failed:
+        sys.exit('Failed pairs:\n' + '\n'.join(failed))
+
+
+if __name__ == '__main__':
+    main()